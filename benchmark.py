@@ -0,0 +1,315 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+import main
+
+# Per scale 1 sizes used when no real database is given with --source
+default_base = {"entries": 1000, "holidays": 150, "earlyCloses": 15, "products": 100}
+cme_markets = ["cme", "cbot", "nymex", "comex"]
+other_entry_prefixes = ["Equity-usa", "Index-usa", "Forex-oanda", "Future-ice", "Future-eurex", "Cfd-oanda"]
+# The workbooks market_hours_database.cme_keys_filenames reads
+cme_workbooks = {
+    "equity": "cme_equities.xlsx",
+    "interest": "cme_interest_rate.xlsx",
+    "fx": "cme_fx.xlsx",
+    "crypto": "cme_crypto.xlsx",
+    "energy": "cme_energy.xlsx",
+    "metals": "cme_metals.xlsx",
+    "grains": "cme_grains.xlsx",
+    "dairy": "cme_dairy.xlsx",
+    "livestock": "cme_livestock.xlsx",
+}
+
+def measure_base(source):
+    # Sizes of the real database and workbooks, which scale 1 reproduces
+    base = dict(default_base)
+    with open(source, "r") as f:
+        entries = json.load(f)["entries"]
+    base["entries"] = len(entries)
+    base["holidays"] = round(sum(len(entry.get("holidays", [])) for entry in entries.values()) / max(len(entries), 1))
+    base["earlyCloses"] = round(sum(len(entry.get("earlyCloses", {})) for entry in entries.values()) / max(len(entries), 1))
+    workbooks = [filename for filename in cme_workbooks.values() if os.path.exists(filename)]
+    if len(workbooks) != 0:
+        base["products"] = round(sum(len(main.read_cme_keys(filename)) for filename in workbooks) / len(workbooks))
+    return base
+
+def random_date(rng, first_year=1998, last_year=2035):
+    return f"{rng.randint(1, 12)}/{rng.randint(1, 28)}/{rng.randint(first_year, last_year)}"
+
+def random_entry(rng, holidays, early_closes):
+    entry = {"dataTimeZone": "UTC", "exchangeTimeZone": "America/Chicago"}
+    for weekday in main.weekdays:
+        entry[weekday] = [] if weekday == "saturday" else [{"start": "08:30:00", "end": "15:00:00", "state": "market"}]
+    entry["holidays"] = sorted({random_date(rng) for _ in range(holidays)}, key=main.date_to_ordinal)
+    # A few duplicates and holiday/early close overlaps for the validators to find
+    if len(entry["holidays"]) != 0 and rng.random() < 0.1:
+        entry["holidays"].append(entry["holidays"][0])
+    entry["earlyCloses"] = {random_date(rng): "12:15:00" for _ in range(early_closes)}
+    if len(entry["holidays"]) != 0 and rng.random() < 0.1:
+        entry["earlyCloses"][entry["holidays"][-1]] = "12:15:00"
+    entry["bankHolidays"] = sorted({random_date(rng) for _ in range(max(early_closes // 5, 1))}, key=main.date_to_ordinal)
+    entry["lateOpens"] = {random_date(rng): "09:30:00" for _ in range(max(early_closes // 5, 1))}
+    return entry
+
+def write_workbook(filename, products):
+    rows = [[None] * 13 for _ in range(3)]
+    rows.append(["Product Name", "Clearing", "Globex", "Floor", "Clearport", "Exchange", "Asset Class", "Product Group", "Category", "Sub Category", "Cleared As", "Volume", "Open Interest"])
+    for ticker, market in products:
+        rows.append([f"{ticker} Futures", ticker, ticker, "-", ticker, market.upper(), "-", "-", "-", "-", "Futures", "0", "0"])
+    pd.DataFrame(rows).to_excel(filename, header=False, index=False)
+
+def generate_workspace(directory, scale, base, seed):
+    # Writes a synthetic database, CME workbooks, ICE info and change-set into
+    # directory with the entries, dates per entry and products per CME class of
+    # base multiplied by scale. Every CME product has an entry in the database
+    rng = random.Random(seed)
+    holidays = max(round(base["holidays"] * scale), 1)
+    early_closes = max(round(base["earlyCloses"] * scale), 1)
+    products_per_class = max(round(base["products"] * scale), 1)
+
+    entries = {}
+    for market in cme_markets:
+        entries[f"Future-{market}-[*]"] = random_entry(rng, holidays // 10, early_closes // 10)
+    products = {}
+    for cme_class, filename in cme_workbooks.items():
+        products[cme_class] = [(f"{cme_class[:2].upper()}{index}", cme_markets[index % len(cme_markets)]) for index in range(products_per_class)]
+        write_workbook(os.path.join(directory, filename), products[cme_class])
+        for ticker, market in products[cme_class]:
+            entries[f"Future-{market}-{ticker}"] = random_entry(rng, holidays, early_closes)
+    for ticker, market in [("LBR", "cme"), ("CJ", "nymex"), ("KT", "nymex"), ("YO", "nymex"), ("TT", "nymex"), ("KE", "cbot")]:
+        entries[f"Future-{market}-{ticker}"] = random_entry(rng, holidays, early_closes)
+    entries["Forex-oanda-[*]"] = random_entry(rng, holidays, early_closes)
+    index = 0
+    while len(entries) < round(base["entries"] * scale):
+        prefix = other_entry_prefixes[index % len(other_entry_prefixes)]
+        entries[f"{prefix}-T{index}"] = random_entry(rng, holidays, early_closes)
+        index += 1
+    with open(os.path.join(directory, "market-hours-database.json"), "w") as f:
+        f.write(json.dumps({"entries": entries}, indent=2))
+
+    with open(os.path.join(directory, "ice-futures-info.json"), "w") as f:
+        json.dump({"softs": {"keys": ["KC", "CC", "SB"]}}, f)
+
+    def pick(dates, count):
+        dates = list(dates)
+        return rng.sample(dates, min(count, len(dates)))
+
+    changes = {"cme": {}, "eurex": {"holidays": []}, "ice": {}, "cfe": {"holidays": [], "earlyCloses": {}}, "oanda": {"holidays": [], "lateOpens": [], "remove": {"holidays": []}}}
+    for cme_class in list(products.keys()) + ["lumber"]:
+        ticker, market = products[cme_class][0] if cme_class in products else ("LBR", "cme")
+        entry = entries[f"Future-{market}-{ticker}"]
+        changes["cme"][cme_class] = {
+            "exchangeTimeZone": "America/Chicago",
+            "earlyCloses": {random_date(rng, 2030, 2035): "12:15:00" for _ in range(early_closes)},
+            "lateOpens": {random_date(rng, 2030, 2035): "09:30:00" for _ in range(max(early_closes // 5, 1))},
+            "holidays": [random_date(rng, 2030, 2035) for _ in range(holidays // 10 + 1)],
+            "bankHolidays": [random_date(rng, 2030, 2035) for _ in range(max(early_closes // 5, 1))],
+            "remove": {
+                "earlyCloses": pick(entry["earlyCloses"], early_closes // 2 + 1),
+                "lateOpens": pick(entry["lateOpens"], 1),
+                "holidays": pick(entry["holidays"], holidays // 10 + 1),
+                "bankHolidays": pick(entry["bankHolidays"], 1),
+            },
+        }
+    with open(os.path.join(directory, "changes.json"), "w") as f:
+        json.dump(changes, f, indent=2)
+
+    dates = sum(len(entry[label]) for entry in entries.values() for label in main.date_labels)
+    return {"entries": len(entries), "dates": dates, "productsPerClass": products_per_class, "bytes": os.path.getsize(os.path.join(directory, "market-hours-database.json"))}
+
+def remove_caches():
+    for filename in ["cme-keys-cache.json", main.snapshot_filename]:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+def load_database(use_snapshot=True):
+    return main.market_hours_database(source_mode="local", use_snapshot=use_snapshot)
+
+def load_database_with_changes():
+    mhdb = load_database()
+    return mhdb, mhdb.read_changes_from_json("changes.json")
+
+def get_change_classes(changes):
+    return list(changes["cme"].keys())
+
+def setup_load():
+    remove_caches()
+
+def setup_load_cached():
+    remove_caches()
+    load_database(use_snapshot=False)
+
+def setup_load_snapshot():
+    load_database()
+
+def run_get_cme_keys(mhdb):
+    mhdb.cme_keys_cache = {}
+    for filename in mhdb.cme_keys_filenames.values():
+        mhdb._get_cme_keys(filename)
+
+def run_apply_cme_changes(state):
+    mhdb, changes = state
+    for cme_class in get_change_classes(changes):
+        mhdb.apply_cme_changes(cme_class, changes)
+
+def run_remove_all(state):
+    mhdb, changes = state
+    for cme_class in get_change_classes(changes):
+        mhdb.remove_all(cme_class, changes)
+
+def load_database_with_raw_changes():
+    with open("changes.json", "r") as f:
+        return load_database(), json.load(f)
+
+def run_apply_exchange_changes(state, workers=1):
+    mhdb, changes = state
+    mhdb.apply_exchange_changes(changes, workers=workers)
+
+def setup_save():
+    mhdb, changes = load_database_with_changes()
+    run_apply_cme_changes((mhdb, changes))
+    return mhdb
+
+# name: (setup, run). setup() prepares a fresh state outside of the measurement
+# and its result is passed to run()
+benchmark_cases = {
+    "market_hours_database": (setup_load, lambda state: load_database(use_snapshot=False)),
+    "market_hours_database-cme-keys-cache": (setup_load_cached, lambda state: load_database(use_snapshot=False)),
+    "market_hours_database-snapshot": (setup_load_snapshot, lambda state: load_database()),
+    "_get_cme_keys": (load_database, run_get_cme_keys),
+    "apply_cme_changes": (load_database_with_changes, run_apply_cme_changes),
+    "remove_all": (load_database_with_changes, run_remove_all),
+    "apply_exchange_changes": (load_database_with_raw_changes, run_apply_exchange_changes),
+    "apply_exchange_changes-parallel": (load_database_with_raw_changes, lambda state: run_apply_exchange_changes(state, os.cpu_count() or 1)),
+    "check_duplicates": (load_database, lambda mhdb: mhdb.check_duplicates()),
+    "check_disjoint_holidays": (load_database, lambda mhdb: mhdb.check_disjoint_holidays()),
+    "check_disjoint_holidays_with_parent": (load_database, lambda mhdb: mhdb.check_disjoint_holidays_with_parent()),
+    "save": (setup_save, lambda mhdb: mhdb.save()),
+}
+
+# (faster, slower): the first case must take less time than the second at every
+# scale both of them ran at. The snapshot is only worth keeping if it beats a load
+# that already has its CME keys cached
+benchmark_expectations = [
+    ("market_hours_database-snapshot", "market_hours_database-cme-keys-cache"),
+]
+
+def run_case(name, repeats):
+    # Times are measured without tracemalloc, which slows allocations down, and the
+    # peak memory in one extra traced run
+    setup, run = benchmark_cases[name]
+    seconds = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeats):
+            state = setup()
+            start = time.perf_counter()
+            run(state)
+            seconds.append(time.perf_counter() - start)
+        state = setup()
+        tracemalloc.start()
+        try:
+            run(state)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {"seconds": statistics.median(seconds), "runs": seconds, "peakMemory": peak}
+
+def run_benchmarks(scales, cases, repeats, seed, source=None):
+    base = default_base if source is None else measure_base(source)
+    report = {"python": platform.python_version(), "platform": platform.platform(), "seed": seed, "repeats": repeats, "base": base, "scales": {}}
+    cwd = os.getcwd()
+    for scale in scales:
+        directory = tempfile.mkdtemp(prefix="mhdb-benchmark-")
+        try:
+            dataset = generate_workspace(directory, scale, base, seed)
+            os.chdir(directory)
+            results = {}
+            for name in cases:
+                results[name] = run_case(name, repeats)
+                print(f"Scale {scale:g} {name}: {results[name]['seconds']:.3f}s, peak {results[name]['peakMemory'] / 2**20:.1f} MiB", file=sys.stderr)
+            report["scales"][f"{scale:g}"] = {"dataset": dataset, "cases": results}
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(directory, ignore_errors=True)
+    return report
+
+def find_regressions(report, baseline, tolerance):
+    # A case regresses when its time or peak memory exceeds the baseline by more
+    # than tolerance. Scales and cases missing from the baseline are not compared
+    regressions = []
+    for scale, results in report["scales"].items():
+        baseline_cases = baseline.get("scales", {}).get(scale, {}).get("cases", {})
+        for name, result in results["cases"].items():
+            if name not in baseline_cases:
+                continue
+            for metric in ["seconds", "peakMemory"]:
+                previous = baseline_cases[name][metric]
+                if previous > 0 and result[metric] > previous * (1 + tolerance):
+                    regressions.append({"scale": scale, "case": name, "metric": metric, "baseline": previous, "current": result[metric], "ratio": result[metric] / previous})
+    return regressions
+
+def find_unmet_expectations(report):
+    unmet = []
+    for scale, results in report["scales"].items():
+        for faster, slower in benchmark_expectations:
+            if faster in results["cases"] and slower in results["cases"]:
+                seconds = results["cases"][faster]["seconds"]
+                limit = results["cases"][slower]["seconds"]
+                if seconds >= limit:
+                    unmet.append({"scale": scale, "case": faster, "slower": slower, "seconds": seconds, "limit": limit})
+    return unmet
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks loading, changing, validating and saving a synthetic market hours database")
+    parser.add_argument("--scale", type=float, action="append", help="size relative to the base database, from 0 to 10, can be repeated (default: 1)")
+    parser.add_argument("--case", action="append", choices=list(benchmark_cases.keys()), help="case to run, can be repeated (default: all)")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per case, the median is reported")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--source", help="real database whose size scale 1 reproduces")
+    parser.add_argument("--output", help="file to write the JSON report to (default: stdout)")
+    parser.add_argument("--baseline", default="benchmark-baseline.json", help="report to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this report as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown or memory growth over the baseline")
+    args = parser.parse_args()
+
+    scales = [1.0] if args.scale is None else args.scale
+    if any(scale <= 0 or scale > 10 for scale in scales):
+        parser.error("--scale must be greater than 0 and at most 10")
+    cases = list(benchmark_cases.keys()) if args.case is None else args.case
+    report = run_benchmarks(scales, cases, args.repeats, args.seed, args.source)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r") as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance)
+    report["regressions"] = regressions
+    for regression in regressions:
+        print(f"Regression at scale {regression['scale']} in {regression['case']}: {regression['metric']} {regression['current']:.6g} vs {regression['baseline']:.6g} ({regression['ratio']:.2f}x)", file=sys.stderr)
+
+    unmet = find_unmet_expectations(report)
+    report["unmetExpectations"] = unmet
+    for expectation in unmet:
+        print(f"Expectation not met at scale {expectation['scale']}: {expectation['case']} took {expectation['seconds']:.6g}s, not less than {expectation['slower']} ({expectation['limit']:.6g}s)", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            f.write(text)
+    sys.exit(1 if len(regressions) != 0 or len(unmet) != 0 else 0)
@@ -2,18 +2,1561 @@ from time import timezone
 import pytz
 
 import pandas as pd
+import numpy as np
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from collections import OrderedDict
 from collections import Counter
 import requests
+import asyncio
 import json
+import hashlib
+import os
+import re
+import time
+import mmap
+import struct
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from bisect import bisect_left, bisect_right, insort
+from functools import lru_cache
+import argparse
+import contextlib
+import functools
+import gc
+import logging
+
+# Conversions between datetimes and the m/d/yyyy dates and hh:mm:ss times the MHDB
+# stores. The same few dates are converted once per product, so every conversion
+# is memoized in a bounded LRU cache; get_conversion_cache_stats() reports hit rates
+@lru_cache(maxsize=64)
+def get_time_zone(time_zone):
+    return ZoneInfo(time_zone)
+
+@lru_cache(maxsize=8192)
+def format_ymd(year, month, day):
+    return f"{month}/{day}/{year}"
+
+def format_mhdb_date(date):
+    # Portable replacement for strftime("%#m/%#d/%Y"), which only strips the leading
+    # zeros on Windows
+    return format_ymd(date.year, date.month, date.day)
+
+@lru_cache(maxsize=8192)
+def parse_mhdb_date(date, time_zone=None):
+    month, day, year = date.split("/")
+    return datetime(int(year), int(month), int(day), tzinfo=None if time_zone is None else get_time_zone(time_zone))
+
+@lru_cache(maxsize=8192)
+def parse_mhdb_datetime(date, time, time_zone=None):
+    hours, minutes, seconds = time.split(":")
+    return parse_mhdb_date(date, time_zone).replace(hour=int(hours), minute=int(minutes), second=int(seconds))
+
+@lru_cache(maxsize=8192)
+def format_local_time(date, time_zone):
+    return date.astimezone(get_time_zone(time_zone)).strftime("%H:%M:%S")
+
+def get_conversion_cache_stats():
+    stats = {}
+    for function in [get_time_zone, format_ymd, parse_mhdb_date, parse_mhdb_datetime, format_local_time, date_to_ordinal, time_to_seconds]:
+        info = function.cache_info()
+        calls = info.hits + info.misses
+        stats[function.__name__] = {"hits": info.hits, "misses": info.misses, "hitRate": info.hits / calls if calls != 0 else 0.0, "size": info.currsize, "maxSize": info.maxsize}
+    return stats
+
+logger = logging.getLogger("mhdb")
+
+event_messages = {
+    "date-added": "Date {date} added it to {entry} {label}",
+    "date-removed": "Date {date} removed from {entry} {label}",
+    "label-missing": "{label} not present in {entry} entry",
+    "dates-fixed": "Dates {dates} removed from {entry} {label}",
+    "new-entry": "Product {ticker} is a new entry",
+    "dates-hoisted": "Dates {dates} moved from the {children} children of {entry} into its {label}",
+    "cme-keys-cache-hit": "CME keys cache hit for {filename}",
+    "cme-keys-cache-miss": "CME keys cache miss for {filename}",
+}
+
+def format_finding(finding):
+    if finding["rule"] == "duplicate":
+        return f"Duplicated {finding['entry']} {finding['label']}: {finding['dates']}"
+    if finding["rule"] == "holiday-overlap":
+        return f"The following dates belong to both holidays and {finding['label']} of {finding['entry']}: {finding['dates']}"
+    return f"The following dates belong to both {finding['label']} of {finding['entry']} and its generic entry {finding['parent']}: {finding['dates']}"
+
+def format_event(event):
+    if event["event"] == "finding":
+        return format_finding(event)
+    return event_messages[event["event"]].format(**event)
+
+def log_events(events):
+    # Default sink, each event is logged at INFO on the "mhdb" logger with the
+    # event dict in the "event" attribute of the record
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    for event in events:
+        logger.info(format_event(event), extra={"event": event})
+
+class mhdb_instrumentation:
+    # Collects the events of the add/remove/validation paths in a buffer that is
+    # handed to sink(events) every buffer_size events and on flush(), and counts
+    # them per event and label and per event, entry and label. With timing=True
+    # instrument() wraps the public methods of an object in timing spans
+    def __init__(self, sink=log_events, buffer_size=1000, timing=False):
+        self.sink = sink
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.counters = Counter()
+        self.entry_counters = Counter()
+        self.timing = timing
+        self.spans = {}
+
+    def emit(self, event, entry=None, label=None, **fields):
+        self.counters[(event, label)] += 1
+        if entry is not None:
+            self.entry_counters[(event, entry, label)] += 1
+        if self.sink is None:
+            return
+        self.buffer.append(dict(fields, event=event, entry=entry, label=label))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) != 0:
+            events, self.buffer = self.buffer, []
+            self.sink(events)
+
+    def get_counters(self):
+        counters = {}
+        for (event, label), count in self.counters.items():
+            counters.setdefault(event, {})[label] = count
+        return counters
+
+    def get_entry_counters(self, event):
+        counters = {}
+        for (name, entry, label), count in self.entry_counters.items():
+            if name == event:
+                counters.setdefault(entry, {})[label] = count
+        return counters
+
+    def instrument(self, target):
+        if not self.timing:
+            return
+        for name in dir(type(target)):
+            if name.startswith("_") or not callable(getattr(type(target), name)):
+                continue
+            setattr(target, name, self.timed(name, getattr(target, name)))
+
+    def timed(self, name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                span = self.spans.setdefault(name, [0, 0.0])
+                span[0] += 1
+                span[1] += time.perf_counter() - start
+        return wrapper
+
+    def print_summary(self):
+        self.flush()
+        for (event, label), count in sorted(self.counters.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            print(f"{event}{'' if label is None else ' ' + label}: {count}")
+        # Nested methods are included in the time of their callers
+        for name, (calls, elapsed) in sorted(self.spans.items(), key=lambda item: -item[1][1]):
+            print(f"{name}: {calls} calls, {elapsed:.3f}s")
+
+class change_batch:
+    # Collects adds and removes on the MHDB entries and defers the expensive part
+    # (re-sorting and filtering the date collections) until apply(), so every
+    # touched collection is sorted once instead of after every single insert
+    def __init__(self, entries):
+        self.entries = entries
+        self.date_counts = {}
+        self.touched_lists = set()
+        self.touched_dicts = set()
+
+    def _get_date_counts(self, key, label):
+        if (key, label) not in self.date_counts:
+            self.date_counts[(key, label)] = Counter(self.entries[key][label])
+        return self.date_counts[(key, label)]
+
+    def add_to_list(self, key, label, date):
+        counts = self._get_date_counts(key, label)
+        if counts[date] != 0:
+            return False
+        counts[date] = 1
+        self.entries[key][label].append(date)
+        self.touched_lists.add((key, label, True))
+        return True
+
+    def remove_from_list(self, key, label, date, remove_all_occurrences=True):
+        counts = self._get_date_counts(key, label)
+        if counts[date] == 0:
+            return False
+        if remove_all_occurrences:
+            counts[date] = 0
+            self.touched_lists.add((key, label, False))
+        else:
+            counts[date] -= 1
+            self.touched_lists.add((key, label, True))
+        return True
+
+    def add_to_dict(self, key, label, date, hour):
+        if date in self.entries[key][label]:
+            return False
+        self.entries[key][label][date] = hour
+        self.touched_dicts.add((key, label))
+        return True
+
+    def remove_from_dict(self, key, label, date):
+        return self.entries[key][label].pop(date, None) is not None
+
+    def apply(self):
+        sorted_lists = {(key, label) for (key, label, needs_sort) in self.touched_lists if needs_sort}
+        for (key, label) in {(key, label) for (key, label, _) in self.touched_lists}:
+            counts = self.date_counts[(key, label)]
+            kept = Counter()
+            dates = []
+            for date in self.entries[key][label]:
+                if kept[date] < counts[date]:
+                    kept[date] += 1
+                    dates.append(date)
+            if (key, label) in sorted_lists:
+                dates = sorted(dates, key=parse_mhdb_date)
+            self.entries[key][label] = dates
+
+        for (key, label) in self.touched_dicts:
+            self.entries[key][label] = dict(sorted(self.entries[key][label].items(), key=lambda d: parse_mhdb_date(d[0])))
+
+class mhdb_transaction:
+    # Undo log of one transaction over the entries. Beginning one is O(1): nothing
+    # is copied until a label is about to change, then the label is copied and the
+    # original kept, so rollback and commit cost O(touched labels)
+    missing = object()
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.labels = {}
+
+    def save_label(self, key, label):
+        if (key, label) in self.labels or key not in self.entries:
+            return
+        entry = self.entries[key]
+        original = entry.get(label, self.missing)
+        self.labels[(key, label)] = (entry, original)
+        if isinstance(original, list):
+            entry[label] = list(original)
+        elif isinstance(original, dict):
+            entry[label] = dict(original)
+
+    def merge(self, transaction):
+        # Keeps the oldest original of each label when a nested transaction commits
+        # into this one
+        for item, value in transaction.labels.items():
+            self.labels.setdefault(item, value)
+
+    def rollback(self):
+        # Restores the saved labels and returns the keys they belong to
+        for (key, label), (entry, original) in self.labels.items():
+            if original is self.missing:
+                entry.pop(label, None)
+            else:
+                entry[label] = original
+        return {key for key, _ in self.labels}
+
+# Upstream inputs: where to download each one and the file used in "local" mode
+remote_sources = {
+    "mhdb": {
+        "url": "https://raw.githubusercontent.com/Marinovsky/Lean/master/Data/market-hours/market-hours-database.json",
+        "path": "market-hours-database.json",
+    },
+    "cme-group-futures-info": {
+        "url": "https://www.dropbox.com/scl/fi/09j95smm8ko09aupx66gl/cme-group-futures-info.json?rlkey=43ne4e093vtsqo6o2vnbrvtfh&st=7honpni6&dl=1",
+        "path": "cme-group-futures-info.json",
+    },
+    "ice-futures-info": {
+        "url": "https://www.dropbox.com/scl/fi/hbgp1j70jn2c0zsiy7vuf/ice-futures-info.json?rlkey=6yhs8a5nw16urdmyuhtnlb0lv&st=6xbh4im7&dl=1",
+        "path": "ice-futures-info.json",
+    },
+}
+
+retry_status_codes = {429, 500, 502, 503, 504}
+
+class source_cache:
+    # Content-addressed on-disk cache for remote inputs. Payloads are stored under
+    # objects/<sha256> and index.json maps each URL to its current object together
+    # with the ETag/Last-Modified validators and the time it was last confirmed fresh
+    def __init__(self, directory=".source-cache", ttl=24 * 60 * 60, timeout=30, concurrency=4, retries=3, backoff=0.5, chunk_size=1 << 16):
+        self.directory = directory
+        self.ttl = ttl
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.chunk_size = chunk_size
+        self.index_filename = os.path.join(directory, "index.json")
+        self.index = None
+        self.session = None
+        # Guards the index while fetch_all() runs several fetches at once
+        self.lock = threading.Lock()
+
+    def load_index(self):
+        if self.index is None:
+            self.index = {}
+            if os.path.exists(self.index_filename):
+                try:
+                    with open(self.index_filename, "r") as f:
+                        self.index = json.load(f)
+                except (OSError, ValueError):
+                    logger.warning(f"Ignoring unreadable source cache index {self.index_filename}")
+        return self.index
+
+    def save_index(self):
+        self.write_atomically(self.index_filename, json.dumps(self.index, indent=2).encode())
+
+    def write_atomically(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as outfile:
+            outfile.write(content)
+        os.replace(temporary, path)
+
+    def get_object_path(self, content_hash):
+        return os.path.join(self.directory, "objects", content_hash)
+
+    def get_cached_path(self, url):
+        entry = self.load_index().get(url)
+        if entry is None or not os.path.exists(self.get_object_path(entry["hash"])):
+            return None
+        return self.get_object_path(entry["hash"])
+
+    def is_fresh(self, url):
+        entry = self.load_index().get(url)
+        return entry is not None and time.time() - entry["checked"] < self.ttl
+
+    def get_session(self):
+        # One pooled session shared by every fetch, so concurrent downloads from the
+        # same host reuse connections instead of opening one per request
+        if self.session is None:
+            self.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+        return self.session
+
+    def request(self, url, headers):
+        # Retries connection errors, timeouts and 429/5xx responses with exponential backoff
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.get_session().get(url, headers=headers, timeout=self.timeout, stream=True)
+                if response.status_code not in retry_status_codes or attempt == self.retries:
+                    return response
+                response.close()
+                reason = f"HTTP {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                reason = e
+            delay = self.backoff * 2 ** attempt
+            logger.warning(f"Retrying {url} in {delay:g}s after {reason}")
+            time.sleep(delay)
+
+    def store_stream(self, url, response, etag=None, last_modified=None):
+        # Writes the body to a temporary file while hashing it, then moves it to its object
+        directory = os.path.join(self.directory, "objects")
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(descriptor, "wb") as outfile:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    digest.update(chunk)
+                    outfile.write(chunk)
+            path = self.get_object_path(digest.hexdigest())
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        with self.lock:
+            self.load_index()[url] = {"hash": digest.hexdigest(), "etag": etag, "lastModified": last_modified, "checked": time.time()}
+            self.save_index()
+        return path
+
+    def fetch(self, url, mode="cached"):
+        cached_path = self.get_cached_path(url)
+        if mode == "cached" and cached_path is not None and self.is_fresh(url):
+            return cached_path
+
+        headers = {}
+        entry = self.load_index().get(url)
+        if mode == "cached" and cached_path is not None:
+            if entry["etag"] is not None:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["lastModified"] is not None:
+                headers["If-Modified-Since"] = entry["lastModified"]
+
+        try:
+            with self.request(url, headers) as response:
+                if response.status_code == 304 and cached_path is not None:
+                    with self.lock:
+                        entry["checked"] = time.time()
+                        self.save_index()
+                    return cached_path
+                response.raise_for_status()
+                return self.store_stream(url, response, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        except requests.RequestException as e:
+            if mode == "cached" and cached_path is not None:
+                logger.warning(f"Using stale cached copy of {url}: {e}")
+                return cached_path
+            raise
+
+    async def fetch_all_async(self, urls, mode="cached"):
+        # Runs the blocking fetches on worker threads, at most self.concurrency at a time
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async def fetch(url):
+            async with semaphore:
+                return await asyncio.to_thread(self.fetch, url, mode)
+        self.load_index()
+        results = await asyncio.gather(*(fetch(url) for url in urls), return_exceptions=True)
+        errors = [(url, result) for url, result in zip(urls, results) if isinstance(result, BaseException)]
+        for url, error in errors:
+            logger.error(f"Failed to fetch {url}: {error}")
+        if errors:
+            raise errors[0][1]
+        return dict(zip(urls, results))
+
+    def fetch_all(self, urls, mode="cached"):
+        return asyncio.run(self.fetch_all_async(list(urls), mode))
+
+def get_entry_labels(entries):
+    # {key: (entry, its (label, value) pairs)}, compared by identity by is_same_entry
+    return {} if entries is None else {key: (entry, tuple(entry.items())) for key, entry in entries.items()}
+
+missing_label = object()
+
+def is_same_entry(recorded, entry):
+    # True when entry is the recorded object and still holds the same label objects
+    if recorded is None or recorded[0] is not entry or len(recorded[1]) != len(entry):
+        return False
+    return all(entry.get(label, missing_label) is value for label, value in recorded[1])
+
+json_decoder = json.JSONDecoder()
+json_whitespace = re.compile(r"[ \t\n\r]*")
+
+def load_json_with_entry_spans(text):
+    # Parses the MHDB like json.loads but also records where the value of each
+    # entry starts and ends in text, so save() can copy untouched entries verbatim
+    spans = {}
+    def skip(index):
+        return json_whitespace.match(text, index).end()
+
+    def expect(index, character):
+        if text[index] != character:
+            raise ValueError(f"Expecting '{character}' at position {index}")
+        return skip(index + 1)
+
+    def parse_object(index, record):
+        data = {}
+        index = expect(index, "{")
+        if text[index] == "}":
+            return data, index + 1
+        while True:
+            if text[index] != '"':
+                raise ValueError(f"Expecting property name at position {index}")
+            key, index = json_decoder.raw_decode(text, index)
+            index = expect(skip(index), ":")
+            if record is None and key == "entries" and text[index] == "{":
+                value, end = parse_object(index, spans)
+            else:
+                value, end = json_decoder.raw_decode(text, index)
+                if record is not None:
+                    record[key] = (index, end)
+            data[key] = value
+            index = skip(end)
+            if text[index] == "}":
+                return data, index + 1
+            index = expect(index, ",")
+
+    try:
+        data, end = parse_object(skip(0), None)
+        if skip(end) != len(text):
+            raise ValueError(f"Extra data at position {end}")
+    except (ValueError, IndexError):
+        return json.loads(text), {}
+    return data, spans
+
+date_labels = ["holidays", "bankHolidays", "earlyCloses", "lateOpens"]
+# Labels stored as {date: time} instead of a list of dates
+dict_labels = ["earlyCloses", "lateOpens"]
+
+def get_parent_key(key):
+    security_type, market, _ = key.split("-", 2)
+    return f"{security_type}-{market}-[*]"
+
+def find_inconsistencies(entries, parents, rules=None):
+    # Checks every entry once. The rules are "duplicate" (a date listed twice in
+    # holidays or bankHolidays), "holiday-overlap" (a holiday also listed under
+    # another label of the same entry) and "parent-overlap" (a date the entry
+    # already inherits from its [*] parent). parents must hold the parent entry
+    # of every entry in entries that has one
+    rules = ["duplicate", "holiday-overlap", "parent-overlap"] if rules is None else rules
+    findings = []
+    parent_dates = {}
+    for key, entry in entries.items():
+        dates = {label: set(entry[label]) for label in date_labels if label in entry}
+
+        if "duplicate" in rules:
+            for label in ["holidays", "bankHolidays"]:
+                if label in dates and len(dates[label]) != len(entry[label]):
+                    duplicates = [date for date, count in Counter(entry[label]).items() if count > 1]
+                    findings.append({"rule": "duplicate", "entry": key, "label": label, "dates": duplicates, "parent": None})
+
+        if "holiday-overlap" in rules and "holidays" in dates:
+            for label in ["earlyCloses", "lateOpens", "bankHolidays"]:
+                if label in dates:
+                    intersection = dates["holidays"] & dates[label]
+                    if len(intersection) != 0:
+                        findings.append({"rule": "holiday-overlap", "entry": key, "label": label, "dates": sorted(intersection, key=date_to_ordinal), "parent": None})
+
+        parent = get_parent_key(key)
+        if "parent-overlap" in rules and parent != key and parent in parents:
+            if parent not in parent_dates:
+                parent_dates[parent] = {label: set(parents[parent][label]) for label in date_labels if label in parents[parent]}
+            for label in date_labels:
+                if label in dates and label in parent_dates[parent]:
+                    intersection = dates[label] & parent_dates[parent][label]
+                    if len(intersection) != 0:
+                        findings.append({"rule": "parent-overlap", "entry": key, "label": label, "dates": sorted(intersection, key=date_to_ordinal), "parent": parent})
+    return findings
+
+def to_ordinal(date):
+    if isinstance(date, str):
+        return date_to_ordinal(date)
+    if isinstance(date, int):
+        return date
+    return date.toordinal()
+
+class mhdb_date_index:
+    # Inverted index from date ordinal to the keys of the entries that list that
+    # date under each label. Changed entries are marked stale and re-indexed on the
+    # next query, so the index costs O(touched entries) to keep up to date.
+    # With a snapshot the entries it holds, except the ones in changed, are bulk
+    # loaded from its date arrays
+    def __init__(self, entries, snapshot=None, changed=()):
+        self.entries = entries
+        self.postings = {label: {} for label in date_labels}
+        self.ordinals = {label: [] for label in date_labels}
+        self.entry_dates = {}
+        self.children = {}
+        self.stale = set()
+        loaded = set() if snapshot is None else self.load_snapshot(snapshot, changed)
+        for key in entries:
+            if key not in loaded:
+                self.update_entry(key)
+
+    def load_snapshot(self, snapshot, changed):
+        keys = np.array(snapshot.keys, dtype=object)
+        selected = np.array([key in self.entries and key not in changed for key in snapshot.keys], dtype=bool)
+        loaded = set(keys[selected].tolist())
+        for key in loaded:
+            self.entry_dates[key] = {}
+            parent = get_parent_key(key)
+            if parent != key:
+                self.children.setdefault(parent, set()).add(key)
+        for label in date_labels:
+            offsets = snapshot.get_array(f"{label}-offsets")
+            ordinals = snapshot.get_ordinals(label)
+            owners = np.repeat(np.arange(len(keys)), np.diff(offsets))
+            mask = selected[owners]
+            label_ordinals = ordinals[mask]
+            order = np.argsort(label_ordinals)
+            unique, starts = np.unique(label_ordinals[order], return_index=True)
+            owner_keys = keys[owners[mask][order]].tolist()
+            bounds = starts.tolist() + [len(owner_keys)]
+            self.postings[label] = {ordinal: set(owner_keys[bounds[i]:bounds[i + 1]]) for i, ordinal in enumerate(unique.tolist())}
+            self.ordinals[label] = unique.tolist()
+            for position in np.flatnonzero(selected).tolist():
+                # Kept as array views, update_entry turns them into sets when needed
+                self.entry_dates[snapshot.keys[position]][label] = ordinals[offsets[position]:offsets[position + 1]]
+        return loaded
+
+    def mark_stale(self, key):
+        self.stale.add(key)
+
+    def refresh(self):
+        for key in self.stale:
+            self.update_entry(key)
+        self.stale = set()
+
+    def update_entry(self, key):
+        old_dates = self.entry_dates.pop(key, {label: set() for label in date_labels})
+        old_dates = {label: set(dates.tolist()) if isinstance(dates, np.ndarray) else dates for label, dates in old_dates.items()}
+        new_dates = {label: set() for label in date_labels}
+        if key in self.entries:
+            for label in date_labels:
+                new_dates[label] = {date_to_ordinal(date) for date in self.entries[key].get(label, [])}
+            self.entry_dates[key] = new_dates
+            parent = get_parent_key(key)
+            if parent != key:
+                self.children.setdefault(parent, set()).add(key)
+        else:
+            self.children.get(get_parent_key(key), set()).discard(key)
+
+        for label in date_labels:
+            postings = self.postings[label]
+            for ordinal in old_dates[label] - new_dates[label]:
+                postings[ordinal].discard(key)
+                if len(postings[ordinal]) == 0:
+                    del postings[ordinal]
+                    del self.ordinals[label][bisect_left(self.ordinals[label], ordinal)]
+            for ordinal in new_dates[label] - old_dates[label]:
+                if ordinal not in postings:
+                    postings[ordinal] = set()
+                    insort(self.ordinals[label], ordinal)
+                postings[ordinal].add(key)
+
+    def resolve(self, keys, inherited):
+        if not inherited:
+            return set(keys)
+        resolved = set(keys)
+        for key in keys:
+            resolved |= self.children.get(key, set())
+        return resolved
+
+    def query(self, date, labels=None, inherited=True):
+        # Returns {label: entry keys} for the entries affected on date. With
+        # inherited=True the children of a matching [*] entry are included too
+        self.refresh()
+        ordinal = to_ordinal(date)
+        labels = date_labels if labels is None else labels
+        return {label: self.resolve(self.postings[label].get(ordinal, set()), inherited) for label in labels}
+
+    def query_range(self, start, end, label, inherited=True):
+        # Returns {date ordinal: entry keys} for every date in [start, end] under label
+        self.refresh()
+        ordinals = self.ordinals[label]
+        first = bisect_left(ordinals, to_ordinal(start))
+        last = bisect_right(ordinals, to_ordinal(end))
+        return {ordinal: self.resolve(self.postings[label][ordinal], inherited) for ordinal in ordinals[first:last]}
+
+class mhdb_inheritance:
+    # Parent -> children graph of the [*] entries, built once, and a cache of the
+    # effective calendar of each entry (its own dates plus the ones of its parent)
+    # and of the dates it repeats from its parent. A change to an entry only drops
+    # its own cache, or the caches of its children when it is a parent
+    def __init__(self, entries):
+        self.entries = entries
+        self.children = {}
+        self.effective = {}
+        self.overlaps = {}
+        for key in entries:
+            self.add_entry(key)
+
+    def add_entry(self, key):
+        parent = get_parent_key(key)
+        if parent != key:
+            self.children.setdefault(parent, set()).add(key)
+
+    def get_parent(self, key):
+        parent = get_parent_key(key)
+        return parent if parent != key and parent in self.entries else None
+
+    def get_children(self, parent):
+        return [key for key in self.children.get(parent, ()) if key in self.entries]
+
+    def invalidate(self, key):
+        if key in self.entries:
+            self.add_entry(key)
+        else:
+            self.children.get(get_parent_key(key), set()).discard(key)
+        for child in [key] + list(self.children.get(key, ())):
+            for label in date_labels:
+                self.effective.pop((child, label), None)
+                self.overlaps.pop((child, label), None)
+
+    def get_effective(self, key, label):
+        # Dates of key under label, including inherited ones. A frozenset for list
+        # labels and a {date: time} dict for the others, where own times win
+        if (key, label) not in self.effective:
+            parent = self.get_parent(key)
+            own = self.entries[key].get(label, {} if label in dict_labels else [])
+            inherited = {} if parent is None else self.entries[parent].get(label, {})
+            if label in dict_labels:
+                self.effective[(key, label)] = {**inherited, **own}
+            else:
+                self.effective[(key, label)] = frozenset(inherited) | frozenset(own)
+        return self.effective[(key, label)]
+
+    def get_parent_overlap(self, key, label):
+        # Dates key lists under label although its parent already does
+        if (key, label) not in self.overlaps:
+            parent = self.get_parent(key)
+            if parent is None or label not in self.entries[key] or label not in self.entries[parent]:
+                self.overlaps[(key, label)] = []
+            else:
+                intersection = set(self.entries[key][label]) & set(self.entries[parent][label])
+                self.overlaps[(key, label)] = sorted(intersection, key=date_to_ordinal)
+        return self.overlaps[(key, label)]
+
+    def find_parent_overlaps(self):
+        # Same findings as the "parent-overlap" rule of find_inconsistencies
+        findings = []
+        for key in self.entries:
+            for label in date_labels:
+                dates = self.get_parent_overlap(key, label)
+                if len(dates) != 0:
+                    findings.append({"rule": "parent-overlap", "entry": key, "label": label, "dates": list(dates), "parent": get_parent_key(key)})
+        return findings
+
+    def find_common_dates(self, parent, label, min_children=2):
+        # Dates every child of parent lists under label. Early closes and late opens
+        # also need the same time in every child, the time zone of the parent and
+        # no other time for the date in the parent
+        children = self.get_children(parent)
+        if parent not in self.entries or len(children) < min_children:
+            return {} if label in dict_labels else []
+        if label in dict_labels:
+            time_zone = self.entries[parent].get("exchangeTimeZone")
+            if any(self.entries[child].get("exchangeTimeZone") != time_zone for child in children):
+                return {}
+            common = set(self.entries[children[0]].get(label, {}).items())
+            for child in children[1:]:
+                common &= set(self.entries[child].get(label, {}).items())
+            # A date the parent already has at another time stays in the children
+            own = self.entries[parent].get(label, {})
+            common = {(date, value) for date, value in common if own.get(date, value) == value}
+            return {date: value for date, value in sorted(common, key=lambda item: date_to_ordinal(item[0]))}
+        common = set(self.entries[children[0]].get(label, []))
+        for child in children[1:]:
+            common &= set(self.entries[child].get(label, []))
+        return sorted(common, key=date_to_ordinal)
+
+def get_sorted_ordinals(ordinals):
+    # np.unique without its fixed cost, the arrays of one entry are short
+    return np.array(sorted(set(ordinals.tolist())), dtype=np.int32)
+
+class mhdb_entry:
+    # Typed view of one entry: holidays and bank holidays as sorted numpy arrays of
+    # date ordinals, early closes and late opens as {ordinal: seconds} maps, None
+    # for a label the entry does not have. Labels are converted the first time they
+    # are used, from the date arrays of source, a (snapshot, position) pair, when
+    # the entry is unchanged since the snapshot was loaded. The view is never
+    # written through, raw is the JSON dict it was read from and serializes back
+    # exactly as it was
+    __slots__ = ("key", "security_type", "market", "ticker", "raw", "source", "holidays", "bank_holidays", "early_closes", "late_opens", "dict_ordinals")
+
+    attributes = {"holidays": "holidays", "bankHolidays": "bank_holidays", "earlyCloses": "early_closes", "lateOpens": "late_opens"}
+    not_loaded = object()
+
+    def __init__(self, key, raw, source=None):
+        self.key = key
+        self.security_type, self.market, self.ticker = key.split("-", 2)
+        self.raw = raw
+        self.source = source
+        self.dict_ordinals = {}
+        for label in date_labels:
+            self.reset_label(label)
+
+    def reset_label(self, label):
+        setattr(self, self.attributes[label], self.not_loaded)
+        self.dict_ordinals.pop(label, None)
+
+    def get_values(self, label):
+        values = getattr(self, self.attributes[label])
+        if values is not self.not_loaded:
+            return values
+        dates = self.raw.get(label)
+        if dates is not None and self.source is not None:
+            ordinals, seconds, ordered = self.source[0].get_entry_dates(label, self.source[1])
+        else:
+            ordinals, seconds, ordered = None, None, None
+        if dates is None:
+            values = None
+        elif label not in dict_labels:
+            if ordinals is None:
+                ordinals = np.fromiter(map(date_to_ordinal, dates), dtype=np.int32, count=len(dates))
+                # The lists are almost always sorted without duplicates already
+                ordered = len(ordinals) < 2 or (ordinals[1:] > ordinals[:-1]).all()
+            values = ordinals if ordered else get_sorted_ordinals(ordinals)
+        elif not isinstance(dates, dict):
+            # Dates listed without their times
+            values = dict.fromkeys(date_to_ordinal(date) for date in dates)
+        elif ordinals is not None:
+            values = dict(zip(ordinals.tolist(), seconds.tolist()))
+        else:
+            values = {date_to_ordinal(date): time_to_seconds(time) for date, time in dates.items()}
+        setattr(self, self.attributes[label], values)
+        return values
+
+    def is_parent(self):
+        return self.ticker == "[*]"
+
+    def has(self, label):
+        return label in self.raw
+
+    def get_ordinals(self, label):
+        # Sorted ordinals of label. Early closes and late opens keep them next to
+        # their {ordinal: seconds} map, which is only built once their times are needed
+        if label not in dict_labels:
+            values = self.get_values(label)
+            return np.zeros(0, dtype=np.int32) if values is None else values
+        ordinals = self.dict_ordinals.get(label)
+        if ordinals is not None:
+            return ordinals
+        values = getattr(self, self.attributes[label])
+        if values is self.not_loaded and isinstance(self.raw.get(label), dict):
+            if self.source is not None:
+                ordinals, _, ordered = self.source[0].get_entry_dates(label, self.source[1])
+            else:
+                dates = self.raw[label]
+                ordinals, ordered = np.fromiter(map(date_to_ordinal, dates), dtype=np.int32, count=len(dates)), False
+            ordinals = ordinals if ordered else get_sorted_ordinals(ordinals)
+        else:
+            values = self.get_values(label)
+            ordinals = np.array(sorted(values or ()), dtype=np.int32)
+        self.dict_ordinals[label] = ordinals
+        return ordinals
+
+    def contains(self, label, ordinal):
+        values = self.get_values(label)
+        if values is None:
+            return False
+        if label in dict_labels:
+            return ordinal in values
+        index = values.searchsorted(ordinal)
+        return index < len(values) and values[index] == ordinal
+
+    def discard(self, label, ordinal):
+        self.dict_ordinals.pop(label, None)
+        values = getattr(self, self.attributes[label])
+        if values is self.not_loaded or values is None:
+            return
+        if label in dict_labels:
+            values.pop(ordinal, None)
+        else:
+            setattr(self, self.attributes[label], values[values != ordinal])
+
+    def get_overlap(self, label, other, other_label=None):
+        # Ordinals listed under label here and under other_label (default: label) by other
+        other_label = label if other_label is None else other_label
+        longer, shorter = self.get_ordinals(label), other.get_ordinals(other_label)
+        if len(longer) < len(shorter):
+            longer, shorter = shorter, longer
+        if len(shorter) == 0:
+            return shorter
+        # Both are sorted without duplicates, the shorter one is looked up in the longer one
+        index = np.minimum(longer.searchsorted(shorter), len(longer) - 1)
+        return shorter[longer[index] == shorter]
+
+    def get_dates(self, label, ordinals):
+        # The dates of label as written in the entry, for the given ordinals. They are
+        # looked up as ordinal_to_date writes them first, the whole label is only
+        # parsed again when some are written another way
+        wanted = set(ordinals.tolist())
+        written = self.raw.get(label, ())
+        written = written if isinstance(written, dict) else set(written)
+        dates = [date for date in map(ordinal_to_date, wanted) if date in written]
+        if len(dates) < len(wanted):
+            dates = [date for date in written if date_to_ordinal(date) in wanted]
+        return sorted(dates, key=date_to_ordinal)
+
+    def to_json(self):
+        return self.raw
+
+class mhdb_model:
+    # Indexes the entry keys by security type, market, ticker and parent [*] entry
+    # and builds the mhdb_entry of a key the first time it is looked up. Changed
+    # entries are marked stale and their view is built again on the next lookup.
+    # With a snapshot the views of the entries it holds, except the ones in changed,
+    # take their dates from its arrays instead of parsing them
+    def __init__(self, entries, snapshot=None, changed=()):
+        self.entries = entries
+        self.views = {}
+        self.stale = set()
+        self.snapshot = snapshot
+        self.positions = {} if snapshot is None else {key: position for position, key in enumerate(snapshot.keys) if key not in changed}
+        self.count = 0
+        self.by_security_type = {}
+        self.by_market = {}
+        self.by_ticker = {}
+        self.children = {}
+        for key in entries:
+            self.add_key(key)
+
+    def get_indexes(self, key):
+        security_type, market, ticker = key.split("-", 2)
+        indexes = [(self.by_security_type, security_type), (self.by_market, market), (self.by_ticker, ticker)]
+        parent = get_parent_key(key)
+        if parent != key:
+            indexes.append((self.children, parent))
+        return indexes
+
+    def add_key(self, key):
+        # Dicts keep the keys in the order of the entries, like the entries dict does
+        for index, value in self.get_indexes(key):
+            index.setdefault(value, {})[key] = None
+        self.count += 1
+
+    def remove_key(self, key):
+        for index, value in self.get_indexes(key):
+            index[value].pop(key, None)
+        self.count -= 1
+        self.views.pop(key, None)
+
+    def invalidate(self, key):
+        indexed = key in self.by_market.get(key.split("-", 2)[1], ())
+        if key in self.entries and not indexed:
+            self.add_key(key)
+        elif key not in self.entries and indexed:
+            self.remove_key(key)
+        self.stale.add(key)
+        self.positions.pop(key, None)
+
+    def remove_date(self, key, label, date):
+        # Keeps the view of key up to date after the caller removed date from label
+        # alone and reported it, instead of converting the whole entry again
+        if key not in self.views or key not in self.entries:
+            return
+        view = self.views[key]
+        view.raw = self.entries[key]
+        if date not in view.raw.get(label, ()):
+            view.discard(label, date_to_ordinal(date))
+        self.stale.discard(key)
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        if key not in self.views or key in self.stale:
+            source = (self.snapshot, self.positions[key]) if key in self.positions else None
+            self.views[key] = mhdb_entry(key, self.entries[key], source)
+            self.stale.discard(key)
+        return self.views[key]
+
+    def get_parent(self, key):
+        parent = get_parent_key(key)
+        return None if parent == key else self.get(parent)
+
+    def get_children(self, parent):
+        return list(self.children.get(parent, ()))
+
+    def get_keys(self, security_type=None, market=None, ticker=None):
+        # Keys matching every given part, in the order of the entries
+        selected = [(index, value) for index, value in [(self.by_security_type, security_type), (self.by_market, market), (self.by_ticker, ticker)] if value is not None]
+        if len(selected) == 0:
+            return list(self.entries.keys())
+        (index, value), others = selected[0], selected[1:]
+        return [key for key in index.get(value, ()) if all(key in other.get(other_value, ()) for other, other_value in others)]
+
+    def find_parent_overlaps(self):
+        # Same findings as the "parent-overlap" rule of find_inconsistencies. The
+        # dates of all the children of a parent are looked up in it at once
+        overlaps = {}
+        for parent_key, children in self.children.items():
+            parent = self.get(parent_key)
+            if parent is None:
+                continue
+            for label in date_labels:
+                if len(parent.raw.get(label, ())) == 0:
+                    continue
+                keys = [key for key in children if label in self.entries[key]]
+                arrays = [self.get(key).get_ordinals(label) for key in keys]
+                if len(arrays) == 0:
+                    continue
+                ordinals = np.concatenate(arrays)
+                owners = np.repeat(np.arange(len(keys)), [len(array) for array in arrays])
+                found = np.flatnonzero(np.isin(ordinals, parent.get_ordinals(label)))
+                found_owners, starts = np.unique(owners[found], return_index=True)
+                bounds = starts.tolist() + [len(found)]
+                for i, owner in enumerate(found_owners.tolist()):
+                    overlaps[(keys[owner], label)] = ordinals[found[bounds[i]:bounds[i + 1]]]
+        findings = []
+        for key in self.entries:
+            for label in date_labels:
+                if (key, label) in overlaps:
+                    dates = self.get(key).get_dates(label, overlaps[(key, label)])
+                    findings.append({"rule": "parent-overlap", "entry": key, "label": label, "dates": dates, "parent": get_parent_key(key)})
+        return findings
+
+    def to_json(self, mhdb):
+        return {**mhdb, "entries": {key: self.get(key).to_json() for key in self.entries}}
+
+weekdays = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+epoch_ordinal = datetime(1970, 1, 1).toordinal()
+
+def timespan_to_seconds(timespan):
+    # Parses the d.hh:mm:ss TimeSpan layout LEAN uses for segment ends such as "1.00:00:00"
+    days = 0
+    if "." in timespan.split(":")[0]:
+        days, timespan = timespan.split(".", 1)
+    return int(days) * 86400 + time_to_seconds(timespan.split(".")[0])
+
+def get_weekly_session_bounds(entry):
+    # First open and last close (seconds after local midnight) of the market segments
+    # of each weekday, -1 when the market does not open that day
+    opens = np.full(7, -1, dtype=np.int64)
+    closes = np.full(7, -1, dtype=np.int64)
+    for weekday, name in enumerate(weekdays):
+        segments = [segment for segment in entry.get(name, []) if segment.get("state", "market") == "market"]
+        if len(segments) != 0:
+            opens[weekday] = min(timespan_to_seconds(segment["start"]) for segment in segments)
+            closes[weekday] = max(timespan_to_seconds(segment["end"]) for segment in segments)
+    return opens, closes
+
+def get_dates_array(dates):
+    ordinals = np.array([date_to_ordinal(date) for date in dates], dtype=np.int64)
+    seconds = np.array([time_to_seconds(dates[date]) for date in dates], dtype=np.int64) if isinstance(dates, dict) else None
+    return ordinals, seconds
+
+class session_calendar:
+    # Per-day session bounds for a set of entries over a date range. opens and closes
+    # are (entries x days) int64 arrays of UTC epoch seconds, closed days hold the
+    # same value numpy uses for NaT so they can be viewed as datetime64[s]
+    closed = np.iinfo(np.int64).min
+
+    def __init__(self, keys, ordinals, opens, closes, time_zones):
+        self.keys = keys
+        self.ordinals = ordinals
+        self.opens = opens
+        self.closes = closes
+        self.time_zones = time_zones
+        self.rows = {key: row for row, key in enumerate(keys)}
+
+    def get(self, key):
+        row = self.rows[key]
+        return self.opens[row], self.closes[row]
+
+    def is_open(self):
+        return self.opens != self.closed
+
+    def save(self, directory, format="npy"):
+        os.makedirs(directory, exist_ok=True)
+        if format == "npy":
+            with open(os.path.join(directory, "keys.json"), "w") as outfile:
+                json.dump({"keys": self.keys, "timeZones": self.time_zones}, outfile, indent=2)
+            np.save(os.path.join(directory, "ordinals.npy"), self.ordinals)
+            np.save(os.path.join(directory, "opens.npy"), self.opens)
+            np.save(os.path.join(directory, "closes.npy"), self.closes)
+        elif format == "parquet":
+            df = pd.DataFrame({
+                "key": pd.Categorical(np.repeat(np.array(self.keys, dtype=object), len(self.ordinals)), categories=self.keys),
+                "ordinal": np.tile(self.ordinals, len(self.keys)),
+                "open": self.opens.ravel(),
+                "close": self.closes.ravel(),
+            })
+            df.to_parquet(os.path.join(directory, "sessions.parquet"), index=False)
+            with open(os.path.join(directory, "keys.json"), "w") as outfile:
+                json.dump({"keys": self.keys, "timeZones": self.time_zones}, outfile, indent=2)
+        else:
+            raise ValueError(f"Unknown session calendar format {format}")
+
+def load_session_calendar(directory):
+    with open(os.path.join(directory, "keys.json"), "r") as f:
+        header = json.load(f)
+    if os.path.exists(os.path.join(directory, "opens.npy")):
+        ordinals = np.load(os.path.join(directory, "ordinals.npy"), mmap_mode="r")
+        opens = np.load(os.path.join(directory, "opens.npy"), mmap_mode="r")
+        closes = np.load(os.path.join(directory, "closes.npy"), mmap_mode="r")
+    else:
+        df = pd.read_parquet(os.path.join(directory, "sessions.parquet"))
+        ordinals = np.unique(df["ordinal"].to_numpy())
+        shape = (len(header["keys"]), len(ordinals))
+        opens = df["open"].to_numpy().reshape(shape)
+        closes = df["close"].to_numpy().reshape(shape)
+    return session_calendar(header["keys"], ordinals, opens, closes, header["timeZones"])
+
+def build_session_calendar(entries, keys, start, end, inherited=True):
+    # Expands the weekly schedule, holidays, early closes and late opens of every
+    # entry in keys into session bounds for each day in [start, end]. Local times
+    # are converted to UTC in one tz_localize call per time zone instead of per day
+    ordinals = np.arange(to_ordinal(start), to_ordinal(end) + 1, dtype=np.int64)
+    epoch_days = ordinals - epoch_ordinal
+    weekday = (epoch_days + 3) % 7
+    local_opens = np.empty((len(keys), len(ordinals)), dtype=np.int64)
+    local_closes = np.empty((len(keys), len(ordinals)), dtype=np.int64)
+    for row, key in enumerate(keys):
+        entry = entries[key]
+        parent = get_parent_key(key)
+        sources = [entries[parent], entry] if inherited and parent != key and parent in entries else [entry]
+
+        weekly_opens, weekly_closes = get_weekly_session_bounds(entry)
+        opens = weekly_opens[weekday]
+        closes = weekly_closes[weekday]
+        # bankHolidays only close settlement, the market itself still trades
+        for source in sources:
+            holidays, _ = get_dates_array(source.get("holidays", []))
+            opens[np.isin(ordinals, holidays)] = -1
+            for label, bound in [("earlyCloses", np.minimum), ("lateOpens", np.maximum)]:
+                dates, seconds = get_dates_array(source.get(label, {}))
+                index = np.searchsorted(ordinals, dates)
+                valid = (index < len(ordinals)) & (ordinals[np.minimum(index, len(ordinals) - 1)] == dates)
+                target = closes if label == "earlyCloses" else opens
+                target[index[valid]] = np.where(opens[index[valid]] < 0, target[index[valid]], bound(target[index[valid]], seconds[valid]))
+        local_opens[row] = np.where(opens < 0, session_calendar.closed, epoch_days * 86400 + opens)
+        local_closes[row] = np.where(opens < 0, session_calendar.closed, epoch_days * 86400 + closes)
+
+    time_zones = [entries[key]["exchangeTimeZone"] for key in keys]
+    opens = np.full(local_opens.shape, session_calendar.closed, dtype=np.int64)
+    closes = np.full(local_closes.shape, session_calendar.closed, dtype=np.int64)
+    for time_zone in set(time_zones):
+        rows = np.array([row for row, zone in enumerate(time_zones) if zone == time_zone])
+        for local, utc in [(local_opens, opens), (local_closes, closes)]:
+            values = local[rows]
+            is_open = values != session_calendar.closed
+            localized = pd.DatetimeIndex(values[is_open].astype("datetime64[s]")).tz_localize(
+                time_zone, ambiguous=np.ones(is_open.sum(), dtype=bool), nonexistent="shift_forward")
+            block = utc[rows]
+            block[is_open] = localized.tz_convert("UTC").tz_localize(None).to_numpy().astype("datetime64[s]").astype(np.int64)
+            utc[rows] = block
+    return session_calendar(list(keys), ordinals, opens, closes, time_zones)
+
+class mhdb_date_table:
+    # The dates of every entry as flat columns, one row per (entry, label, date,
+    # time). Entry keys and labels are dictionary encoded: key_codes index keys and
+    # label_codes index date_labels. seconds is the time of early closes and late
+    # opens and -1 for holidays and bank holidays
+    def __init__(self, keys, key_codes, label_codes, ordinals, seconds):
+        self.keys = keys
+        self.key_codes = key_codes
+        self.label_codes = label_codes
+        self.ordinals = ordinals
+        self.seconds = seconds
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def get_key_column(self, field):
+        # "key", "securityType", "market" or "ticker" of each row
+        if field == "key":
+            values = np.array(self.keys, dtype=object)
+        else:
+            values = np.array([key.split("-", 2)[["securityType", "market", "ticker"].index(field)] for key in self.keys], dtype=object)
+        return values[self.key_codes]
+
+    def get_years(self):
+        return (self.ordinals - epoch_ordinal).astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64) + 1970
+
+    def select(self, label):
+        return self.label_codes == date_labels.index(label)
+
+    def count(self, label, by=("market", "year")):
+        # Rows of a label per group, e.g. early closes per market per year
+        rows = self.select(label)
+        columns = [self.get_years()[rows] if field == "year" else self.get_key_column(field)[rows] for field in by]
+        return pd.Series(1, index=pd.MultiIndex.from_arrays(columns, names=list(by))).groupby(level=list(by)).count()
+
+    def to_frame(self):
+        return pd.DataFrame({
+            "key": pd.Categorical.from_codes(self.key_codes, categories=self.keys),
+            "label": pd.Categorical.from_codes(self.label_codes, categories=date_labels),
+            "date": (self.ordinals - epoch_ordinal).astype("datetime64[D]"),
+            "seconds": self.seconds,
+        })
+
+    def save(self, path, format="npz"):
+        if format == "npz":
+            np.savez_compressed(path, keys=np.array(self.keys, dtype=str), key_codes=self.key_codes, label_codes=self.label_codes, ordinals=self.ordinals, seconds=self.seconds)
+        elif format == "parquet":
+            self.to_frame().to_parquet(path, index=False)
+        else:
+            raise ValueError(f"Unknown date table format {format}")
+
+def get_date_table(entries):
+    keys = list(entries.keys())
+    key_codes = []
+    label_codes = []
+    ordinals = []
+    seconds = []
+    for code, key in enumerate(keys):
+        entry = entries[key]
+        for label_code, label in enumerate(date_labels):
+            dates = entry.get(label)
+            if not dates:
+                continue
+            key_codes.append(np.full(len(dates), code, dtype=np.int32))
+            label_codes.append(np.full(len(dates), label_code, dtype=np.int8))
+            ordinals.append(np.fromiter((date_to_ordinal(date) for date in dates), dtype=np.int32, count=len(dates)))
+            if isinstance(dates, dict):
+                seconds.append(np.fromiter((time_to_seconds(time) for time in dates.values()), dtype=np.int32, count=len(dates)))
+            else:
+                seconds.append(np.full(len(dates), -1, dtype=np.int32))
+    if len(ordinals) == 0:
+        return mhdb_date_table(keys, np.empty(0, np.int32), np.empty(0, np.int8), np.empty(0, np.int32), np.empty(0, np.int32))
+    return mhdb_date_table(keys, np.concatenate(key_codes), np.concatenate(label_codes), np.concatenate(ordinals), np.concatenate(seconds))
+
+def load_date_table(path):
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path)
+        ordinals = (df["date"].to_numpy().astype("datetime64[D]").astype(np.int64) + epoch_ordinal).astype(np.int32)
+        return mhdb_date_table(list(df["key"].cat.categories), df["key"].cat.codes.to_numpy(np.int32), df["label"].cat.codes.to_numpy(np.int8), ordinals, df["seconds"].to_numpy(np.int32))
+    with np.load(path) as data:
+        return mhdb_date_table(data["keys"].tolist(), data["key_codes"], data["label_codes"], data["ordinals"], data["seconds"])
+
+snapshot_magic = b"MHDBSNAP"
+snapshot_version = 3
+snapshot_alignment = 64
+snapshot_prefix = struct.Struct("<8sII")
+snapshot_filename = "mhdb-snapshot.bin"
+
+class mhdb_snapshot:
+    # Read-only view of a snapshot file. The file is memory mapped and the date
+    # arrays are returned as numpy views over the map, so they are only paged in
+    # when they are used. The entries are stored without their dates, which are
+    # rebuilt from the date arrays, and without their text, which is read back from
+    # the database file the snapshot was built from
+    def __init__(self, path, header, buffer, start):
+        self.path = path
+        self.header = header
+        self.buffer = buffer
+        self.start = start
+        self.keys = None
+        self.arrays = {}
+        self.offsets = {}
+        self.unordered = {}
+
+    def get_bytes(self, name):
+        section = self.header["sections"][name]
+        offset = self.start + section["offset"]
+        return self.buffer[offset:offset + section["length"]]
+
+    def get_array(self, name):
+        if name not in self.arrays:
+            section = self.header["sections"][name]
+            self.arrays[name] = np.frombuffer(self.buffer, dtype=section["dtype"], count=section["count"], offset=self.start + section["offset"])
+        return self.arrays[name]
+
+    def close(self):
+        self.arrays = {}
+        self.offsets = {}
+        self.buffer.close()
+
+    def is_current(self, sources):
+        recorded = self.header["sources"]
+        return recorded.keys() == sources.keys() and all(recorded[path]["hash"] == sources[path]["hash"] for path in sources)
+
+    def get_ordinals(self, label):
+        if f"{label}-ordinals" not in self.arrays:
+            self.arrays[f"{label}-ordinals"] = self.get_array("dates")[self.get_array(f"{label}-date-codes")]
+        return self.arrays[f"{label}-ordinals"]
+
+    def get_seconds(self, label):
+        if f"{label}-seconds" not in self.arrays:
+            self.arrays[f"{label}-seconds"] = self.get_array("times")[self.get_array(f"{label}-time-codes")]
+        return self.arrays[f"{label}-seconds"]
+
+    def get_unordered(self, label):
+        # Positions of the entries whose dates under label are not strictly increasing
+        if label not in self.unordered:
+            ordinals = self.get_ordinals(label)
+            offsets = self.get_array(f"{label}-offsets")
+            breaks = np.flatnonzero(ordinals[1:] <= ordinals[:-1]) + 1
+            owners = np.searchsorted(offsets, breaks, side="right") - 1
+            # A break at the first date of an entry is between two entries
+            self.unordered[label] = set(owners[offsets[owners] != breaks].tolist())
+        return self.unordered[label]
+
+    def get_entry_dates(self, label, position):
+        # Ordinals of the dates entry position lists under label, in their order, for
+        # early closes and late opens their seconds, and whether they are sorted
+        # without duplicates
+        if label not in self.offsets:
+            self.offsets[label] = self.get_array(f"{label}-offsets").tolist()
+        start, end = self.offsets[label][position], self.offsets[label][position + 1]
+        seconds = self.get_seconds(label)[start:end] if label in dict_labels else None
+        return self.get_ordinals(label)[start:end], seconds, position not in self.get_unordered(label)
+
+    def get_state(self):
+        # The state is plain JSON and numpy arrays, reading a snapshot never runs code
+        # from the file. Entry i gets back the dates of label when label-rebuilt[i] is
+        # set, the other labels were stored as they are. The codes index the distinct
+        # dates and times, whose strings are stored once in the state. The rebuilt
+        # lists and dicts only hold strings, the cyclic collector is paused while
+        # millions of them are created since it would scan them for nothing
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            state = json.loads(self.get_bytes("state"))
+            date_strings = np.array(state.pop("dates"), dtype=object)
+            time_strings = np.array(state.pop("times"), dtype=object)
+            entries = state["mhdb"].get("entries", {})
+            self.keys = list(entries.keys())
+            for label in date_labels:
+                offsets = self.get_array(f"{label}-offsets").tolist()
+                dates = date_strings[self.get_array(f"{label}-date-codes")].tolist()
+                if label in dict_labels:
+                    times = time_strings[self.get_array(f"{label}-time-codes")].tolist()
+                for position in np.flatnonzero(self.get_array(f"{label}-rebuilt")).tolist():
+                    start, end = offsets[position], offsets[position + 1]
+                    if label in dict_labels:
+                        entries[self.keys[position]][label] = dict(zip(dates[start:end], times[start:end]))
+                    else:
+                        entries[self.keys[position]][label] = dates[start:end]
+        finally:
+            if collecting:
+                gc.enable()
+        return state
+
+    def get_spans(self):
+        spans = self.get_array("entry-spans").tolist()
+        return {key: (spans[2 * position], spans[2 * position + 1]) for position, key in enumerate(self.keys) if spans[2 * position] >= 0}
+
+def get_source_fingerprint(path, previous=None):
+    # Only hashes the file again when its size or modification time changed
+    stat = os.stat(path)
+    if previous is not None and previous["mtime"] == stat.st_mtime and previous["size"] == stat.st_size:
+        return previous
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return {"mtime": stat.st_mtime, "size": stat.st_size, "hash": digest.hexdigest()}
+
+def is_rebuilt_exactly(dates, label, canonical):
+    # True when the dates of a label are written the way the snapshot rebuilds them
+    # from its arrays. canonical caches the strings already checked
+    if label in dict_labels:
+        if not isinstance(dates, dict):
+            return False
+        items = dates.items()
+    elif isinstance(dates, list):
+        items = ((date, None) for date in dates)
+    else:
+        return False
+    for date, time in items:
+        if date not in canonical:
+            if not isinstance(date, str) or ordinal_to_date(date_to_ordinal(date)) != date:
+                return False
+            canonical.add(date)
+        if time is not None and time not in canonical:
+            if not isinstance(time, str) or seconds_to_time(time_to_seconds(time)) != time:
+                return False
+            canonical.add(time)
+    return True
+
+def get_snapshot_entries(entries):
+    # The entries with None in place of the labels get_snapshot_arrays rebuilds
+    # exactly, and the label-rebuilt flags telling which ones they are
+    canonical = set()
+    stripped = {}
+    rebuilt = {label: np.zeros(len(entries), dtype=np.uint8) for label in date_labels}
+    for position, (key, entry) in enumerate(entries.items()):
+        entry = dict(entry)
+        for label in date_labels:
+            if label in entry and is_rebuilt_exactly(entry[label], label, canonical):
+                entry[label] = None
+                rebuilt[label][position] = 1
+        stripped[key] = entry
+    return stripped, {f"{label}-rebuilt": flags for label, flags in rebuilt.items()}
+
+def get_codes(arrays):
+    # The distinct values of the arrays and, for each array, the index of each of its
+    # values among them
+    values, codes = np.unique(np.concatenate(arrays), return_inverse=True)
+    return values, np.split(codes.astype(np.int32), np.cumsum([len(array) for array in arrays])[:-1])
+
+def get_snapshot_arrays(entries):
+    # Flattens the dates of every entry into one array per label, entry i owns
+    # codes[offsets[i]:offsets[i + 1]]. The codes index the distinct ordinals and
+    # seconds of all labels, whose strings save_snapshot stores once
+    arrays = {}
+    ordinals = {}
+    seconds = {}
+    for label in date_labels:
+        offsets = np.zeros(len(entries) + 1, dtype=np.int64)
+        label_ordinals = [np.zeros(0, dtype=np.int64)]
+        label_seconds = [np.zeros(0, dtype=np.int64)]
+        for position, entry in enumerate(entries.values()):
+            dates = entry.get(label, [])
+            entry_ordinals, entry_seconds = get_dates_array(dates)
+            label_ordinals.append(entry_ordinals)
+            if label in dict_labels:
+                # Kept aligned with the ordinals even for a label that is not a dict
+                label_seconds.append(np.zeros(len(dates), dtype=np.int64) if entry_seconds is None else entry_seconds)
+            offsets[position + 1] = offsets[position] + len(dates)
+        arrays[f"{label}-offsets"] = offsets
+        ordinals[label] = np.concatenate(label_ordinals)
+        if label in dict_labels:
+            seconds[label] = np.concatenate(label_seconds)
+    dates, codes = get_codes(list(ordinals.values()))
+    arrays["dates"] = dates.astype(np.int32)
+    arrays.update({f"{label}-date-codes": label_codes for label, label_codes in zip(ordinals.keys(), codes)})
+    times, codes = get_codes(list(seconds.values()))
+    arrays["times"] = times.astype(np.int32)
+    arrays.update({f"{label}-time-codes": label_codes for label, label_codes in zip(seconds.keys(), codes)})
+    return arrays
+
+def write_snapshot(path, sources, state, arrays):
+    # Layout: magic, version, header length, JSON header and then the payload with
+    # the sections, each one aligned to snapshot_alignment. The header records the
+    # source file hashes the snapshot was built from and the section offsets
+    # relative to the payload
+    sections = {"state": json.dumps(state).encode("utf-8")}
+    payload = []
+    layout = {}
+    offset = 0
+    for name, data in list(sections.items()) + list(arrays.items()):
+        padding = -offset % snapshot_alignment
+        payload.append(b"\0" * padding)
+        offset += padding
+        data = data if isinstance(data, bytes) else np.ascontiguousarray(data).tobytes()
+        layout[name] = {"offset": offset, "length": len(data)}
+        if name in arrays:
+            layout[name]["dtype"] = arrays[name].dtype.str
+            layout[name]["count"] = arrays[name].size
+        payload.append(data)
+        offset += len(data)
+
+    header = json.dumps({"sources": sources, "sections": layout}).encode("utf-8")
+    header += b" " * (-(snapshot_prefix.size + len(header)) % snapshot_alignment)
+
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(snapshot_prefix.pack(snapshot_magic, snapshot_version, len(header)))
+        f.write(header)
+        for data in payload:
+            f.write(data)
+    os.replace(temporary, path)
+
+def open_snapshot(path):
+    # Returns None if the file is missing, from another format version, has an
+    # unreadable header or is shorter than its sections. Only the header is read
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            logger.warning(f"Ignoring empty snapshot {path}")
+            return None
+    try:
+        magic, version, header_length = snapshot_prefix.unpack_from(buffer, 0)
+        if magic != snapshot_magic:
+            logger.warning(f"Ignoring snapshot {path}: not a snapshot file")
+            return None
+        if version != snapshot_version:
+            logger.warning(f"Ignoring snapshot {path}: version {version}, expected {snapshot_version}")
+            return None
+        start = snapshot_prefix.size + header_length
+        header = json.loads(buffer[snapshot_prefix.size:start])
+    except (struct.error, ValueError):
+        logger.warning(f"Ignoring unreadable snapshot {path}")
+        return None
+    if not isinstance(header, dict) or any(name not in header for name in ("sources", "sections")):
+        logger.warning(f"Ignoring unreadable snapshot {path}")
+        return None
+    if any(start + section["offset"] + section["length"] > len(buffer) for section in header["sections"].values()):
+        logger.warning(f"Ignoring truncated snapshot {path}")
+        return None
+    return mhdb_snapshot(path, header, buffer, start)
+
+class cme_product_index:
+    # Bidirectional index between (ticker, market), CME class and MHDB key built
+    # from the cmeKeys of cme_group_futures_info. update_class() re-indexes one
+    # class after its definition changes
+    def __init__(self, cme_group_futures_info):
+        self.info = cme_group_futures_info
+        self.classes_by_product = {}
+        self.products_by_class = {}
+        for cme_class in cme_group_futures_info.keys():
+            self.update_class(cme_class)
+
+    def update_class(self, cme_class):
+        for product in self.products_by_class.pop(cme_class, []):
+            self.classes_by_product[product[:2]].discard(cme_class)
+            if len(self.classes_by_product[product[:2]]) == 0:
+                del self.classes_by_product[product[:2]]
+        if cme_class not in self.info.keys():
+            return
+        cme_keys = self.info[cme_class]["cmeKeys"]
+        products = [(ticker, cme_keys[ticker], f"Future-{cme_keys[ticker]}-{ticker}") for ticker in cme_keys.keys()]
+        self.products_by_class[cme_class] = products
+        for product in products:
+            self.classes_by_product.setdefault(product[:2], set()).add(cme_class)
+
+    def get_classes(self, ticker, market):
+        return self.classes_by_product.get((ticker, market), set())
+
+    def get_classes_by_key(self, key):
+        _, market, ticker = key.split("-", 2)
+        return self.get_classes(ticker, market)
+
+    def get_class_products(self, cme_class):
+        # List of (ticker, market, MHDB key) of the products of cme_class
+        return self.products_by_class[cme_class]
+
+    def contains(self, ticker, market):
+        return (ticker, market) in self.classes_by_product
+
+def read_cme_keys(filename):
+    df = pd.read_excel(filename, usecols=["Unnamed: 1", "Unnamed: 2", "Unnamed: 5"])
+    df = df.fillna("nan").astype(str)
+    markets = df["Unnamed: 5"].str.lower()
+    keys = {}
+    # Globex codes first, then clearing codes, which win when both columns hold the same symbol
+    for column in ["Unnamed: 2", "Unnamed: 1"]:
+        symbols = df[column]
+        symbols_and_markets = symbols + ":" + markets
+        mask = ~symbols_and_markets.str.contains("nan", regex=False) & ~symbols_and_markets.str.contains("Globex", regex=False)
+        pairs = pd.DataFrame({"symbol": symbols[mask], "market": markets[mask]}).drop_duplicates("symbol", keep="last")
+        keys |= dict(zip(pairs["symbol"], pairs["market"]))
+    return keys
+
+def read_cme_keys_timed(filename):
+    # Entry point for the process pool in market_hours_database.load_sources_parallel
+    start = time.perf_counter()
+    keys = read_cme_keys(filename)
+    return keys, time.perf_counter() - start
+
+@lru_cache(maxsize=65536)
+def date_to_ordinal(date):
+    return parse_mhdb_date(date).toordinal()
+
+def ordinal_to_date(ordinal):
+    date = datetime.fromordinal(ordinal)
+    return f"{date.month}/{date.day}/{date.year}"
+
+@lru_cache(maxsize=8192)
+def time_to_seconds(time):
+    hours, minutes, seconds = time.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+def seconds_to_time(seconds):
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
 
 class market_hours_database:
-    def __init__(self):
-        self.mhdb = self.get_mhdb_entries_from_local()
-        self.cme_group_futures_info = self.get_cme_group_future_info_from_local()
-        self.ice_futures_info = self.get_ice_future_info_from_cloud()
+    def __init__(self, parallel=False, source_mode="cached", use_snapshot=False, instrumentation=None):
+        self.instrumentation = mhdb_instrumentation() if instrumentation is None else instrumentation
+        self.instrumentation.instrument(self)
+        self.batch = None
+        self.transactions = []
+        # Entries modified since they were loaded or last saved. Untouched entries are
+        # written by save() straight from their serialized text. entry_labels holds
+        # the labels each entry had when its text was taken, to notice replaced ones
+        self.dirty_entries = set()
+        self.mhdb_source_text = None
+        self.mhdb_source_entries = None
+        self.mhdb_entry_spans = {}
+        self.serialized_entries = {}
+        self.entry_labels = {}
+        self.date_index = None
+        self.cme_product_index = None
+        self.model = None
+        self.inheritance = None
+        # "local" reads the files next to this script, "cached" serves remote inputs from
+        # the source cache while they are fresh and "remote" always downloads them
+        self.source_mode = source_mode
+        self.source_cache = source_cache()
+        self.sources = {name: dict(source) for name, source in remote_sources.items()}
+        # Binary image of the loaded sources, reused while none of them changed
+        self.snapshot_filename = snapshot_filename
+        self.snapshot = None
+        self.cme_keys_cache_filename = "cme-keys-cache.json"
+        self.cme_keys_cache = None
+        self.cme_keys_cache_hits = 0
+        self.cme_keys_cache_misses = 0
         self.cme_equities_filename = "cme_equities.xlsx"
         self.cme_interest_rate_filename = "cme_interest_rate.xlsx"
         self.cme_fx_filename = "cme_fx.xlsx"
@@ -24,29 +1567,174 @@ class market_hours_database:
         self.cme_lumber_filename = "cme_lumber.xlsx"
         self.cme_livestock_filename = "cme_livestock.xlsx"
         self.cme_dairy_filename = "cme_dairy.xlsx"
-
-    def get_mhdb_entries(self):
-        url = "https://raw.githubusercontent.com/Marinovsky/Lean/master/Data/market-hours/market-hours-database.json"
-        file = requests.get(url)
-        data = json.loads(file.content, object_pairs_hook=OrderedDict)
+        self.cme_keys_filenames = {
+            "equity": self.cme_equities_filename,
+            "interest": self.cme_interest_rate_filename,
+            "fx": self.cme_fx_filename,
+            "crypto": self.cme_crypto_filename,
+            "energy": self.cme_energy_filename,
+            "metals": self.cme_metals_filename,
+            "grains": self.cme_grains_filename,
+            "dairy": self.cme_dairy_filename,
+            "livestock": self.cme_livestock_filename,
+        }
+        if use_snapshot:
+            snapshot = open_snapshot(self.snapshot_filename)
+            snapshot_sources = self.get_snapshot_sources(snapshot)
+            if snapshot is not None and self.load_snapshot(snapshot, snapshot_sources):
+                return
+            if snapshot is not None:
+                # Windows cannot replace a file that is still mapped
+                snapshot.close()
+        if parallel:
+            self.load_sources_parallel()
+        else:
+            self.mhdb = self.get_mhdb_entries_from_local()
+            self.cme_group_futures_info = self.get_cme_group_future_info_from_local()
+            self.ice_futures_info = self.get_ice_future_info_from_cloud()
+        if use_snapshot:
+            self.save_snapshot(snapshot_sources)
+
+    def load_sources_parallel(self):
+        # JSON sources are read on threads, the workbooks that are not in the CME keys
+        # cache are parsed on a process pool since read_excel holds the GIL
+        timings = {}
+        def timed(name, function):
+            start = time.perf_counter()
+            result = function()
+            timings[name] = time.perf_counter() - start
+            return result
+
+        start = time.perf_counter()
+        cme_keys = {}
+        for cme_class, filename in self.cme_keys_filenames.items():
+            keys = self.get_cached_cme_keys(filename)
+            if keys is not None:
+                cme_keys[cme_class] = keys
+        pending = {cme_class: filename for cme_class, filename in self.cme_keys_filenames.items() if cme_class not in cme_keys}
+
+        # The workbooks are submitted before the threads start: the pool forks all of
+        # its workers on the first submit, and forking a multithreaded process can deadlock
+        processes = None
+        excel_futures = {}
+        if len(pending) != 0:
+            processes = ProcessPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1))
+            excel_futures = {cme_class: processes.submit(read_cme_keys_timed, filename) for cme_class, filename in pending.items()}
+        try:
+            with ThreadPoolExecutor(max_workers=2) as threads:
+                mhdb_future = threads.submit(timed, "market-hours-database.json", self.get_mhdb_entries_from_local)
+                ice_future = threads.submit(timed, "ice-futures-info.json", self.get_ice_future_info_from_cloud)
+                for cme_class, future in excel_futures.items():
+                    keys, elapsed = future.result()
+                    timings[pending[cme_class]] = elapsed
+                    self.store_cme_keys(pending[cme_class], keys)
+                    cme_keys[cme_class] = keys
+                self.mhdb = mhdb_future.result()
+                self.ice_futures_info = ice_future.result()
+        finally:
+            if processes is not None:
+                processes.shutdown()
+        self.cme_group_futures_info = self.get_cme_group_future_info_from_local(cme_keys)
+
+        for name, elapsed in sorted(timings.items(), key=lambda item: -item[1]):
+            logger.info(f"Loaded {name} in {elapsed:.3f}s")
+        logger.info(f"Loaded all sources in {time.perf_counter() - start:.3f}s")
+
+    def get_snapshot_sources(self, snapshot=None):
+        # Every file the loaded state is built from, this script included since it
+        # hard-codes some of the CME classes
+        previous = {} if snapshot is None else snapshot.header["sources"]
+        paths = [os.path.abspath(__file__), os.path.abspath("market-hours-database.json"), os.path.abspath(self.resolve_source("ice-futures-info"))]
+        paths += [os.path.abspath(filename) for filename in self.cme_keys_filenames.values()]
+        return {path: get_source_fingerprint(path, previous.get(path)) for path in paths}
+
+    def load_snapshot(self, snapshot, sources):
+        start = time.perf_counter()
+        if not snapshot.is_current(sources):
+            logger.info(f"Snapshot {self.snapshot_filename} is out of date")
+            return False
+        try:
+            state = snapshot.get_state()
+            spans = snapshot.get_spans()
+        except (ValueError, KeyError, IndexError):
+            logger.warning(f"Ignoring unreadable snapshot {self.snapshot_filename}")
+            return False
+        # The database file is the one the snapshot was built from, is_current
+        # compared its fingerprint, so the spans still point into its text
+        with open("market-hours-database.json", "r") as f:
+            self.mhdb_source_text = f.read()
+        self.mhdb = state["mhdb"]
+        self.cme_group_futures_info = state["cme_group_futures_info"]
+        self.ice_futures_info = pd.DataFrame(state["ice_futures_info"])
+        self.mhdb_source_entries = self.mhdb.get("entries")
+        self.mhdb_entry_spans = spans
+        self.serialized_entries = {}
+        self.entry_labels = get_entry_labels(self.mhdb_source_entries)
+        self.dirty_entries = set()
+        self.snapshot = snapshot
+        logger.info(f"Loaded snapshot {self.snapshot_filename} in {time.perf_counter() - start:.3f}s")
+        return True
+
+    def save_snapshot(self, sources):
+        start = time.perf_counter()
+        entries = self.mhdb.get("entries", {})
+        stripped, arrays = get_snapshot_entries(entries)
+        arrays.update(get_snapshot_arrays(entries))
+        spans = np.full(2 * len(entries), -1, dtype=np.int64)
+        for position, key in enumerate(entries.keys()):
+            if key in self.mhdb_entry_spans:
+                spans[2 * position:2 * position + 2] = self.mhdb_entry_spans[key]
+        arrays["entry-spans"] = spans
+        state = {
+            "mhdb": {**self.mhdb, "entries": stripped},
+            "cme_group_futures_info": self.cme_group_futures_info,
+            "ice_futures_info": json.loads(self.ice_futures_info.to_json()),
+            "dates": [ordinal_to_date(ordinal) for ordinal in arrays["dates"].tolist()],
+            "times": [seconds_to_time(seconds) for seconds in arrays["times"].tolist()],
+        }
+        write_snapshot(self.snapshot_filename, sources, state, arrays)
+        logger.info(f"Saved snapshot {self.snapshot_filename} in {time.perf_counter() - start:.3f}s")
+
+    def resolve_source(self, name, mode=None):
+        mode = self.source_mode if mode is None else mode
+        if mode == "local":
+            return self.sources[name]["path"]
+        if mode in ("cached", "remote"):
+            return self.source_cache.fetch(self.sources[name]["url"], mode)
+        raise ValueError(f"Unknown source mode {mode}")
+
+    def refresh_sources(self, names=None, mode="remote"):
+        # Downloads the given sources (default: all) concurrently into the source cache
+        names = list(self.sources.keys()) if names is None else names
+        paths = self.source_cache.fetch_all([self.sources[name]["url"] for name in names], mode)
+        return {name: paths[self.sources[name]["url"]] for name in names}
+
+    def get_mhdb_entries(self, mode=None):
+        with open(self.resolve_source("mhdb", mode), "r") as f:
+            data = json.load(f, object_pairs_hook=OrderedDict)
         return data
 
     def get_mhdb_entries_from_local(self):
         with open("market-hours-database.json", "r") as f:
-            data = json.load(f)
+            text = f.read()
+        data, spans = load_json_with_entry_spans(text)
+        self.mhdb_source_text = text
+        self.mhdb_source_entries = data.get("entries")
+        self.mhdb_entry_spans = spans
+        self.serialized_entries = {}
+        self.entry_labels = get_entry_labels(self.mhdb_source_entries)
+        self.dirty_entries = set()
         return data
 
-    def get_cme_group_future_info_from_cloud(self):
-        url = "https://www.dropbox.com/scl/fi/09j95smm8ko09aupx66gl/cme-group-futures-info.json?rlkey=43ne4e093vtsqo6o2vnbrvtfh&st=7honpni6&dl=1"
-        df = pd.read_json(url)
+    def get_cme_group_future_info_from_cloud(self, mode=None):
+        df = pd.read_json(self.resolve_source("cme-group-futures-info", mode))
         return df
 
-    def get_ice_future_info_from_cloud(self):
-        url = "https://www.dropbox.com/scl/fi/hbgp1j70jn2c0zsiy7vuf/ice-futures-info.json?rlkey=6yhs8a5nw16urdmyuhtnlb0lv&st=6xbh4im7&dl=1"
-        df = pd.read_json(url)
+    def get_ice_future_info_from_cloud(self, mode=None):
+        df = pd.read_json(self.resolve_source("ice-futures-info", mode))
         return df
 
-    def get_cme_group_future_info_from_local(self):
+    def get_cme_group_future_info_from_local(self, cme_keys=None):
         df = {}
         df["equity"] = {}
         df["interest"] = {}
@@ -63,16 +1751,13 @@ class market_hours_database:
         df["lumber"]["cmeKeys"] = {"LBR": "cme"}
         df["softs"]["cmeKeys"] = {"CJ": "nymex", "KT": "nymex", "YO": "nymex", "TT": "nymex"}
 
-        df["equity"]["cmeKeys"] = self.get_cme_equities_keys()
-        df["interest"]["cmeKeys"] = self.get_cme_interest_rate_keys()
-        df["fx"]["cmeKeys"] = self.get_cme_fx_keys()
-        df["crypto"]["cmeKeys"] = self.get_cme_crypto_keys()
-        df["energy"]["cmeKeys"] = self.get_cme_energy_keys()
-        df["metals"]["cmeKeys"] = self.get_cme_metals_keys()
-        df["grains"]["cmeKeys"] = self.get_cme_grains_keys()
-        df["dairy"]["cmeKeys"] = self.get_cme_dairy_keys()
-        df["livestock"]["cmeKeys"] = self.get_cme_livestock_keys()
+        for cme_class, filename in self.cme_keys_filenames.items():
+            if cme_keys is not None and cme_class in cme_keys:
+                df[cme_class]["cmeKeys"] = cme_keys[cme_class]
+            else:
+                df[cme_class]["cmeKeys"] = self._get_cme_keys(filename)
 
+        logger.info(f"CME keys cache: {self.cme_keys_cache_hits} hits, {self.cme_keys_cache_misses} misses")
         return df
 
     def get_cme_equities_keys(self):
@@ -106,104 +1791,305 @@ class market_hours_database:
         return self._get_cme_keys("cme_dairy.xlsx")
 
     def _get_cme_keys(self, filename):
-        df = pd.read_excel(filename)
-        merge_columns_function = lambda row: f"{str(row['Unnamed: 2'])}:{str(row['Unnamed: 5']).lower()}"
-        symbols_and_markets_df = df.apply(merge_columns_function, axis=1)
-        symbols_and_markets_list = [entry for entry in symbols_and_markets_df if ("nan" not in entry and "Globex" not in entry)]
-        symbols_and_markets_list = list(set(symbols_and_markets_list))
-        symbols_keys1 = {}
-        for item in symbols_and_markets_list:
-            symbol = item.split(":")[0]
-            market = item.split(":")[1]
-            symbols_keys1[symbol] = market
-        
-        merge_columns_function = lambda row: f"{str(row['Unnamed: 1'])}:{str(row['Unnamed: 5']).lower()}"
-        symbols_and_markets_df = df.apply(merge_columns_function, axis=1)
-        symbols_and_markets_list = [entry for entry in symbols_and_markets_df if ("nan" not in entry and "Globex" not in entry)]
-        symbols_and_markets_list = list(set(symbols_and_markets_list))
-        symbols_keys2 = {}
-        for item in symbols_and_markets_list:
-            symbol = item.split(":")[0]
-            market = item.split(":")[1]
-            symbols_keys2[symbol] = market
-        
-        return symbols_keys1 | symbols_keys2
+        keys = self.get_cached_cme_keys(filename)
+        if keys is None:
+            keys = read_cme_keys(filename)
+            self.store_cme_keys(filename, keys)
+        return dict(keys)
+
+    def get_cached_cme_keys(self, filename):
+        if self.cme_keys_cache is None:
+            self.cme_keys_cache = self.load_cme_keys_cache()
+
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        cached = self.cme_keys_cache.get(path)
+        if cached is not None and (cached["mtime"] != stat.st_mtime or cached["size"] != stat.st_size):
+            content_hash = self.get_file_hash(path)
+            if cached["hash"] == content_hash:
+                cached["mtime"] = stat.st_mtime
+                cached["size"] = stat.st_size
+                self.save_cme_keys_cache()
+            else:
+                cached = None
+        if cached is None:
+            self.cme_keys_cache_misses += 1
+            self.instrumentation.emit("cme-keys-cache-miss", filename=filename)
+            return None
+        self.cme_keys_cache_hits += 1
+        self.instrumentation.emit("cme-keys-cache-hit", filename=filename)
+        return dict(cached["keys"])
+
+    def store_cme_keys(self, filename, keys):
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        self.cme_keys_cache[path] = {"mtime": stat.st_mtime, "size": stat.st_size, "hash": self.get_file_hash(path), "keys": keys}
+        self.save_cme_keys_cache()
+
+    def get_file_hash(self, path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def load_cme_keys_cache(self):
+        if not os.path.exists(self.cme_keys_cache_filename):
+            return {}
+        try:
+            with open(self.cme_keys_cache_filename, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f"Ignoring unreadable CME keys cache {self.cme_keys_cache_filename}")
+            return {}
+
+    def save_cme_keys_cache(self):
+        with open(self.cme_keys_cache_filename, "w") as outfile:
+            outfile.write(json.dumps(self.cme_keys_cache, indent=2))
 
     def get_mhdb_key(self, ticker, market):
         return f"Future-{market}-{ticker}"
 
+    def get_cme_product_index(self):
+        if self.cme_product_index is None or self.cme_product_index.info is not self.cme_group_futures_info:
+            self.cme_product_index = cme_product_index(self.cme_group_futures_info)
+        return self.cme_product_index
+
+    def get_model(self):
+        # Built again when the entries are replaced or added without entry_changed,
+        # entry_changed keeps it up to date otherwise
+        entries = self.mhdb["entries"]
+        if self.model is None or self.model.entries is not entries or self.model.count != len(entries):
+            # Entries unchanged since the snapshot was loaded reuse its parsed dates
+            snapshot = self.snapshot if entries is self.mhdb_source_entries else None
+            self.model = mhdb_model(entries, snapshot, self.dirty_entries)
+        return self.model
+
+    def get_market_keys(self, market, security_type=None):
+        return self.get_model().get_keys(security_type, market)
+
+    def get_cme_class_keys(self, cme_class):
+        return [(ticker, key) for ticker, _, key in self.get_cme_product_index().get_class_products(cme_class)]
+
+    def set_cme_keys(self, cme_class, cme_keys):
+        if cme_class not in self.cme_group_futures_info.keys():
+            self.cme_group_futures_info[cme_class] = {}
+        self.cme_group_futures_info[cme_class]["cmeKeys"] = cme_keys
+        self.get_cme_product_index().update_class(cme_class)
+
+    def prepare_label(self, key, label):
+        # Called before a label of an entry is modified, so the open transaction can
+        # copy it first
+        if len(self.transactions) != 0:
+            self.transactions[-1].save_label(key, label)
+
+    def begin(self):
+        self.transactions.append(mhdb_transaction(self.mhdb["entries"]))
+
+    def commit(self):
+        transaction = self.transactions.pop()
+        if len(self.transactions) != 0:
+            self.transactions[-1].merge(transaction)
+
+    def rollback(self):
+        # A pending batch may refer to the discarded copies, it is dropped too
+        transaction = self.transactions.pop()
+        self.batch = None
+        for key in transaction.rollback():
+            self.entry_changed(key)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # Commits when the block completes and rolls back if it raises
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
+    def get_inheritance(self):
+        if self.inheritance is None or self.inheritance.entries is not self.mhdb["entries"]:
+            self.inheritance = mhdb_inheritance(self.mhdb["entries"])
+        return self.inheritance
+
+    def get_effective_dates(self, key, label):
+        return self.get_inheritance().get_effective(key, label)
+
+    def hoist_common_dates(self, labels=None, min_children=2):
+        # Moves the dates listed by every child of a [*] entry into the parent and
+        # drops them from the children. Returns {parent: {label: dates}}
+        labels = date_labels if labels is None else labels
+        inheritance = self.get_inheritance()
+        entries = self.mhdb["entries"]
+        hoisted = {}
+        for parent in list(inheritance.children.keys()):
+            for label in labels:
+                common = inheritance.find_common_dates(parent, label, min_children)
+                if len(common) == 0:
+                    continue
+                children = inheritance.get_children(parent)
+                common_dates = set(common)
+                self.prepare_label(parent, label)
+                if label in dict_labels:
+                    values = {**entries[parent].get(label, {}), **common}
+                    entries[parent][label] = dict(sorted(values.items(), key=lambda d: date_to_ordinal(d[0])))
+                else:
+                    values = set(entries[parent].get(label, [])) | set(common)
+                    entries[parent][label] = sorted(values, key=date_to_ordinal)
+                self.entry_changed(parent)
+                for child in children:
+                    self.prepare_label(child, label)
+                    if label in dict_labels:
+                        entries[child][label] = {date: value for date, value in entries[child][label].items() if date not in common_dates}
+                    else:
+                        entries[child][label] = [date for date in entries[child][label] if date not in common_dates]
+                    self.entry_changed(child)
+                hoisted.setdefault(parent, {})[label] = list(common)
+                self.instrumentation.emit("dates-hoisted", parent, label, dates=list(common), children=len(children))
+        return hoisted
+
+    def entry_changed(self, key):
+        # Every modification of an entry reports it here, save() relies on it to know
+        # which entries to serialize again
+        if self.inheritance is not None:
+            self.inheritance.invalidate(key)
+        self.dirty_entries.add(key)
+        if self.date_index is not None:
+            self.date_index.mark_stale(key)
+        if self.model is not None:
+            self.model.invalidate(key)
+
+    def load_date_index(self):
+        # Entries unchanged since the snapshot was loaded reuse its parsed dates
+        snapshot = self.snapshot if self.mhdb["entries"] is self.mhdb_source_entries else None
+        self.date_index = mhdb_date_index(self.mhdb["entries"], snapshot, self.dirty_entries)
+        return self.date_index
+
+    def get_affected_entries(self, date, labels=None, inherited=True):
+        if self.date_index is None or self.date_index.entries is not self.mhdb["entries"]:
+            self.load_date_index()
+        return self.date_index.query(date, labels, inherited)
+
+    def print_conversion_cache_stats(self):
+        for name, stats in get_conversion_cache_stats().items():
+            print(f"{name}: {stats['hits']} hits, {stats['misses']} misses ({stats['hitRate']:.1%} hit rate, {stats['size']}/{stats['maxSize']} cached)")
+
+    def build_session_calendar(self, start, end, keys=None, inherited=True):
+        keys = list(self.mhdb["entries"].keys()) if keys is None else keys
+        return build_session_calendar(self.mhdb["entries"], keys, start, end, inherited)
+
+    def export_date_table(self, path, format="npz"):
+        table = get_date_table(self.mhdb["entries"])
+        table.save(path, format)
+        return table
+
+    def start_batch(self):
+        self.batch = change_batch(self.mhdb["entries"])
+
+    def apply_batch(self):
+        batch = self.batch
+        self.batch = None
+        if batch is not None:
+            batch.apply()
+            # The touched labels were reported before apply() sorted and filtered them
+            for key in {key for key, _, _ in batch.touched_lists} | {key for key, _ in batch.touched_dicts}:
+                self.entry_changed(key)
+
     def update_late_opens(self, cme_class):
         late_opens = self.cme_group_futures_info[cme_class]["lateOpens"]
         for late_open in late_opens.keys():
-            date = datetime.strptime(late_open + " " + late_opens[late_open], "%m/%d/%Y %H:%M:%S")
+            date = parse_mhdb_datetime(late_open, late_opens[late_open])
             self.add_late_open_to_mhdb(cme_class, date)
 
     def update_early_closes(self, cme_class):
         early_closes = self.cme_group_futures_info[cme_class]["earlyCloses"]
         for early_close in early_closes.keys():
-            date = datetime.strptime(early_close + " " + early_closes[early_close], "%m/%d/%Y %H:%M:%S")
+            date = parse_mhdb_datetime(early_close, early_closes[early_close])
             self.add_early_close_to_mhdb(cme_class, date)
 
     def add_date_to_dict(self, key, label, date_to_add):
         timezone = self.mhdb["entries"][key]["exchangeTimeZone"]
-        date = date_to_add.strftime("%#m/%#d/%Y")
-        parsed_hour = date_to_add.astimezone(ZoneInfo(timezone)).strftime("%H:%M:%S")
+        date = format_mhdb_date(date_to_add)
+        parsed_hour = format_local_time(date_to_add, timezone)
+        self.prepare_label(key, label)
         if label not in self.mhdb["entries"][key].keys():
             self.mhdb["entries"][key][label] = dict()
+            self.entry_changed(key)
+        if self.batch is not None:
+            if self.batch.add_to_dict(key, label, date, parsed_hour):
+                self.instrumentation.emit("date-added", key, label, date=date)
+                self.entry_changed(key)
+            return
         if date not in self.mhdb["entries"][key][label].keys():
-            print(f"Date {date} added it to {key} {label}")
+            self.instrumentation.emit("date-added", key, label, date=date)
+            self.entry_changed(key)
             self.mhdb["entries"][key][label][date] = parsed_hour
-            self.mhdb["entries"][key][label] = dict(sorted(self.mhdb["entries"][key][label].items(), key=lambda d: datetime.strptime(d[0], '%m/%d/%Y')))
+            self.mhdb["entries"][key][label] = dict(sorted(self.mhdb["entries"][key][label].items(), key=lambda d: parse_mhdb_date(d[0])))
 
     def remove_date_to_dict(self, key, label, date_to_remove):
-        date = date_to_remove.strftime("%#m/%#d/%Y")
+        date = format_mhdb_date(date_to_remove)
+        self.prepare_label(key, label)
         if label not in self.mhdb["entries"][key].keys():
-            print(f"{label} not present in {key} entry")
+            self.instrumentation.emit("label-missing", key, label)
+        if self.batch is not None:
+            if self.batch.remove_from_dict(key, label, date):
+                self.instrumentation.emit("date-removed", key, label, date=date)
+                self.entry_changed(key)
+            return
         if date in self.mhdb["entries"][key][label].keys():
-            print(f"Date {date} removed from {key} {label}")
+            self.instrumentation.emit("date-removed", key, label, date=date)
+            self.entry_changed(key)
             self.mhdb["entries"][key][label].pop(date, None)
     
     def add_date_to_list(self, key, label, date_to_add):
-        date = date_to_add.strftime("%#m/%#d/%Y")
+        date = format_mhdb_date(date_to_add)
+        self.prepare_label(key, label)
         if (key in self.mhdb["entries"].keys()) and (label not in self.mhdb["entries"][key].keys()):
             self.mhdb["entries"][key][label] = list()
+            self.entry_changed(key)
+        if self.batch is not None:
+            if (key in self.mhdb["entries"].keys()) and self.batch.add_to_list(key, label, date):
+                self.instrumentation.emit("date-added", key, label, date=date)
+                self.entry_changed(key)
+            return
         if (key in self.mhdb["entries"].keys()) and (date not in self.mhdb["entries"][key][label]):
-            print(f"Date {date} added it to {key} {label}")
+            self.instrumentation.emit("date-added", key, label, date=date)
+            self.entry_changed(key)
             self.mhdb["entries"][key][label].append(date)
-            self.mhdb["entries"][key][label] = sorted(self.mhdb["entries"][key][label], key=lambda d: datetime.strptime(d, '%m/%d/%Y'))
+            self.mhdb["entries"][key][label] = sorted(self.mhdb["entries"][key][label], key=parse_mhdb_date)
 
     def remove_date_from_list(self, key, label, date_to_remove):
-        date = date_to_remove.strftime("%#m/%#d/%Y")
+        date = format_mhdb_date(date_to_remove)
+        self.prepare_label(key, label)
         if (key in self.mhdb["entries"].keys()) and (label not in self.mhdb["entries"][key].keys()):
-            print(f"{label} not present in {key} entry")
+            self.instrumentation.emit("label-missing", key, label)
+        if self.batch is not None:
+            if (key in self.mhdb["entries"].keys()) and self.batch.remove_from_list(key, label, date):
+                self.instrumentation.emit("date-removed", key, label, date=date)
+                self.entry_changed(key)
+            return
         if (key in self.mhdb["entries"].keys()) and (date in self.mhdb["entries"][key][label]):
-            print(f"Date {date} removed from {key} {label}")
+            self.instrumentation.emit("date-removed", key, label, date=date)
+            self.entry_changed(key)
             self.mhdb["entries"][key][label] = [e for e in self.mhdb["entries"][key][label] if e != date]
 
     def add_cme_late_open_to_mhdb(self, cme_class, late_open_date):
-        entry = self.cme_group_futures_info[cme_class]
-        products = entry["cmeKeys"]
-        for product in products.keys():
-            key = self.get_mhdb_key(product, products[product])
+        for product, key in self.get_cme_class_keys(cme_class):
             if key not in self.mhdb["entries"].keys():
                 continue
             self.add_date_to_dict(key, "lateOpens", late_open_date)
 
     def add_cme_early_close_to_mhdb(self, cme_class, early_close_date, is_update=False):
-        entry = self.cme_group_futures_info[cme_class]
-        products = entry["cmeKeys"]
-        for product in products.keys():
-            key = self.get_mhdb_key(product, products[product])
+        for product, key in self.get_cme_class_keys(cme_class):
             if key not in self.mhdb["entries"].keys():
                 continue
             
             self.add_date_to_dict(key, "earlyCloses", early_close_date)
 
     def add_cme_holiday_to_mhdb(self, cme_class, holiday_date):
-        entry = self.cme_group_futures_info[cme_class]
-        products = entry["cmeKeys"]
-        for product in products.keys():
-            key = self.get_mhdb_key(product, products[product])
+        for product, key in self.get_cme_class_keys(cme_class):
             self.add_date_to_list(key, "holidays", holiday_date)
     
     def add_ice_holiday_to_mhdb(self, ice_class, holiday):
@@ -215,86 +2101,108 @@ class market_hours_database:
             self.add_date_to_list(key, "holidays", holiday)
 
     def add_cme_bank_holiday_to_mhdb(self, cme_class, holiday_date, exclude):
-        entry = self.cme_group_futures_info[cme_class]
-        products = entry["cmeKeys"]
-        for product in products.keys():
+        for product, key in self.get_cme_class_keys(cme_class):
             if product in exclude: continue
-            key = self.get_mhdb_key(product, products[product])
             self.add_date_to_list(key, "bankHolidays", holiday_date)
     
     def remove_early_close_from_mhdb(self, cme_class, early_close_date):
-        entry = self.cme_group_futures_info[cme_class]
-        products = entry["cmeKeys"]
-        for product in products.keys():
-            key = self.get_mhdb_key(product, products[product])
+        for product, key in self.get_cme_class_keys(cme_class):
             if key not in self.mhdb["entries"].keys():
                 continue
             
-            date = early_close_date.strftime("%#m/%#d/%Y")
+            date = format_mhdb_date(early_close_date)
             if "earlyCloses" not in self.mhdb["entries"][key].keys():
                 continue
-            self.mhdb["entries"][key]["earlyCloses"].pop(date, None)
+            self.prepare_label(key, "earlyCloses")
+            if self.batch is not None:
+                if self.batch.remove_from_dict(key, "earlyCloses", date):
+                    self.instrumentation.emit("date-removed", key, "earlyCloses", date=date)
+                    self.entry_changed(key)
+                continue
+            if self.mhdb["entries"][key]["earlyCloses"].pop(date, None) is not None:
+                self.instrumentation.emit("date-removed", key, "earlyCloses", date=date)
+                self.entry_changed(key)
 
     def remove_late_open_from_mhdb(self, cme_class, late_open_date):
-        entry = self.cme_group_futures_info[cme_class]
-        products = entry["cmeKeys"]
-        for product in products.keys():
-            key = self.get_mhdb_key(product, products[product])
+        for product, key in self.get_cme_class_keys(cme_class):
             if key not in self.mhdb["entries"].keys():
                 continue
             
-            date = late_open_date.strftime("%#m/%#d/%Y")
+            date = format_mhdb_date(late_open_date)
             if "lateOpens" not in self.mhdb["entries"][key].keys():
                 continue
-            print(f"Date {date} removed from {key} late opens")
-            self.mhdb["entries"][key]["lateOpens"].pop(date, None)
+            self.prepare_label(key, "lateOpens")
+            if self.batch is not None:
+                if self.batch.remove_from_dict(key, "lateOpens", date):
+                    self.instrumentation.emit("date-removed", key, "lateOpens", date=date)
+                    self.entry_changed(key)
+                continue
+            if self.mhdb["entries"][key]["lateOpens"].pop(date, None) is not None:
+                self.instrumentation.emit("date-removed", key, "lateOpens", date=date)
+                self.entry_changed(key)
     
     def remove_holiday_from_mhdb(self, cme_class, holiday_date):
-        entry = self.cme_group_futures_info[cme_class]
-        products = entry["cmeKeys"]
-        for product in products.keys():
-            date = holiday_date.strftime("%#m/%#d/%Y")
-            key = self.get_mhdb_key(product, products[product])
-            
+        date = format_mhdb_date(holiday_date)
+        ordinal = date_to_ordinal(date)
+        model = self.get_model()
+        for product, key in self.get_cme_class_keys(cme_class):
             if (key in self.mhdb["entries"].keys()) and ("holidays" not in self.mhdb["entries"][key].keys()):
                 continue
-            if (key in self.mhdb["entries"].keys()) and (date in self.mhdb["entries"][key]["holidays"]):
-                print(f"Date {date} removed from {key} holidays")
+            self.prepare_label(key, "holidays")
+            if self.batch is not None:
+                if (key in self.mhdb["entries"].keys()) and self.batch.remove_from_list(key, "holidays", date, remove_all_occurrences=False):
+                    self.instrumentation.emit("date-removed", key, "holidays", date=date)
+                    self.entry_changed(key)
+                continue
+            # The typed entry answers in O(log n), the list is only scanned when it has the date
+            entry = model.get(key)
+            if entry is not None and entry.contains("holidays", ordinal) and (date in self.mhdb["entries"][key]["holidays"]):
+                self.instrumentation.emit("date-removed", key, "holidays", date=date)
+                self.entry_changed(key)
                 self.mhdb["entries"][key]["holidays"].remove(date)
-                self.mhdb["entries"][key]["holidays"] = sorted(self.mhdb["entries"][key]["holidays"], key=lambda d: datetime.strptime(d, '%m/%d/%Y'))
+                self.mhdb["entries"][key]["holidays"] = sorted(self.mhdb["entries"][key]["holidays"], key=parse_mhdb_date)
+                model.remove_date(key, "holidays", date)
     
     def remove_bank_holiday_from_mhdb(self, cme_class, holiday_date):
-        entry = self.cme_group_futures_info[cme_class]
-        products = entry["cmeKeys"]
-        for product in products.keys():
-            date = holiday_date.strftime("%#m/%#d/%Y")
-            key = self.get_mhdb_key(product, products[product])
-            
+        date = format_mhdb_date(holiday_date)
+        ordinal = date_to_ordinal(date)
+        model = self.get_model()
+        for product, key in self.get_cme_class_keys(cme_class):
             if (key in self.mhdb["entries"].keys()) and ("bankHolidays" not in self.mhdb["entries"][key].keys()):
                 continue
-            if (key in self.mhdb["entries"].keys()) and (date in self.mhdb["entries"][key]["bankHolidays"]):
-                print(f"Date {date} removed from {key} bank holidays")
+            self.prepare_label(key, "bankHolidays")
+            if self.batch is not None:
+                if (key in self.mhdb["entries"].keys()) and self.batch.remove_from_list(key, "bankHolidays", date, remove_all_occurrences=False):
+                    self.instrumentation.emit("date-removed", key, "bankHolidays", date=date)
+                    self.entry_changed(key)
+                continue
+            # The typed entry answers in O(log n), the list is only scanned when it has the date
+            entry = model.get(key)
+            if entry is not None and entry.contains("bankHolidays", ordinal) and (date in self.mhdb["entries"][key]["bankHolidays"]):
+                self.instrumentation.emit("date-removed", key, "bankHolidays", date=date)
+                self.entry_changed(key)
                 self.mhdb["entries"][key]["bankHolidays"].remove(date)
-                self.mhdb["entries"][key]["bankHolidays"] = sorted(self.mhdb["entries"][key]["bankHolidays"], key=lambda d: datetime.strptime(d, '%m/%d/%Y'))
+                self.mhdb["entries"][key]["bankHolidays"] = sorted(self.mhdb["entries"][key]["bankHolidays"], key=parse_mhdb_date)
+                model.remove_date(key, "bankHolidays", date)
 
     def add_bank_holidays_entry_to_mhdb(self):
         for entry in self.mhdb["entries"].keys():
             if "bankHolidays" not in self.mhdb["entries"][entry].keys():
+                self.prepare_label(entry, "bankHolidays")
                 self.mhdb["entries"][entry]["bankHolidays"] = []
+                self.entry_changed(entry)
 
     def add_late_open_to_cme_group_futures_info(self, cme_class, late_open_date):
         entry = self.cme_group_futures_info[cme_class]
         cme_group_futures_info_timezone = entry["exchangeTimeZone"]
-        date = late_open_date.strftime("%#m/%#d/%Y")
-        self.cme_group_futures_info[cme_class]["lateOpens"][date] = late_open_date.astimezone(
-            ZoneInfo(cme_group_futures_info_timezone)).strftime("%H:%M:%S")
+        date = format_mhdb_date(late_open_date)
+        self.cme_group_futures_info[cme_class]["lateOpens"][date] = format_local_time(late_open_date, cme_group_futures_info_timezone)
 
     def add_early_close_to_cme_group_futures_info(self, cme_class, early_close_date):
         entry = self.cme_group_futures_info[cme_class]
         cme_group_futures_info_timezone = entry["exchangeTimeZone"]
-        date = early_close_date.strftime("%#m/%#d/%Y")
-        self.cme_group_futures_info[cme_class]["earlyCloses"][date] = early_close_date.astimezone(
-            ZoneInfo(cme_group_futures_info_timezone)).strftime("%H:%M:%S")
+        date = format_mhdb_date(early_close_date)
+        self.cme_group_futures_info[cme_class]["earlyCloses"][date] = format_local_time(early_close_date, cme_group_futures_info_timezone)
 
     def add_cme_early_closes(self, cme_class, early_closes):
         for early_close in early_closes:
@@ -334,6 +2242,14 @@ class market_hours_database:
         for holiday in bank_holidays:
             self.add_cme_bank_holiday_to_mhdb(cme_class, holiday, exclude)
 
+    def apply_exchange_changes(self, changes, exchanges=None, exclude=None, workers=1):
+        # Applies the raw changes.json of every exchange in exchange_adapters, or of
+        # the given exchanges, as set-based pipeline steps and returns the diff
+        pipeline = change_pipeline(self, changes, get_exchange_steps(changes, exchanges, exclude))
+        diff = pipeline.plan(workers)
+        pipeline.apply(diff)
+        return diff
+
     def apply_cme_changes(self, cme_class, changes, exclude=[]):
         self.add_cme_early_closes(cme_class, changes["cme"][cme_class]["earlyCloses"])
         self.add_cme_late_opens(cme_class, changes["cme"][cme_class]["lateOpens"])
@@ -368,16 +2284,14 @@ class market_hours_database:
     def parse_dictionary_of_dates(self, timezone, dates):
         dates_parsed = []
         for date in dates.keys():
-            parsed = datetime.strptime(f"{date} {dates[date]}", "%m/%d/%Y %H:%M:%S")
-            parsed = parsed.replace(tzinfo=ZoneInfo(timezone))
+            parsed = parse_mhdb_datetime(date, dates[date], timezone)
             dates_parsed.append(parsed)
         return dates_parsed
     
     def parse_list_of_dates(self, timezone, dates):
         dates_parsed = []
         for date in dates:
-            parsed = datetime.strptime(f"{date}", "%m/%d/%Y")
-            parsed = parsed.replace(tzinfo=ZoneInfo(timezone))
+            parsed = parse_mhdb_date(date, timezone)
             dates_parsed.append(parsed)
         return dates_parsed
 
@@ -392,208 +2306,930 @@ class market_hours_database:
             
             changes_df["cme"][cme_class]["earlyCloses"] = self.parse_dictionary_of_dates(timezone, changes["cme"][cme_class]["earlyCloses"])
             changes_df["cme"][cme_class]["lateOpens"] = self.parse_dictionary_of_dates(timezone, changes["cme"][cme_class]["lateOpens"])
-            changes_df["cme"][cme_class]["holidays"] = [datetime.strptime(f"{date}", "%m/%d/%Y") for date in changes["cme"][cme_class]["holidays"]]
-            changes_df["cme"][cme_class]["bankHolidays"] = [datetime.strptime(f"{date}", "%m/%d/%Y") for date in changes["cme"][cme_class]["bankHolidays"]]
+            changes_df["cme"][cme_class]["holidays"] = [parse_mhdb_date(date) for date in changes["cme"][cme_class]["holidays"]]
+            changes_df["cme"][cme_class]["bankHolidays"] = [parse_mhdb_date(date) for date in changes["cme"][cme_class]["bankHolidays"]]
 
             changes_df["cme"][cme_class]["remove"] = {}
-            changes_df["cme"][cme_class]["remove"]["earlyCloses"] = [datetime.strptime(f"{date}", "%m/%d/%Y") for date in changes["cme"][cme_class]["remove"]["earlyCloses"]]
-            changes_df["cme"][cme_class]["remove"]["lateOpens"] = [datetime.strptime(f"{date}", "%m/%d/%Y") for date in changes["cme"][cme_class]["remove"]["lateOpens"]]
-            changes_df["cme"][cme_class]["remove"]["holidays"] = [datetime.strptime(f"{date}", "%m/%d/%Y") for date in changes["cme"][cme_class]["remove"]["holidays"]]
-            changes_df["cme"][cme_class]["remove"]["bankHolidays"] = [datetime.strptime(f"{date}", "%m/%d/%Y") for date in changes["cme"][cme_class]["remove"]["bankHolidays"]]
+            changes_df["cme"][cme_class]["remove"]["earlyCloses"] = [parse_mhdb_date(date) for date in changes["cme"][cme_class]["remove"]["earlyCloses"]]
+            changes_df["cme"][cme_class]["remove"]["lateOpens"] = [parse_mhdb_date(date) for date in changes["cme"][cme_class]["remove"]["lateOpens"]]
+            changes_df["cme"][cme_class]["remove"]["holidays"] = [parse_mhdb_date(date) for date in changes["cme"][cme_class]["remove"]["holidays"]]
+            changes_df["cme"][cme_class]["remove"]["bankHolidays"] = [parse_mhdb_date(date) for date in changes["cme"][cme_class]["remove"]["bankHolidays"]]
         
         changes_df["eurex"] = {}
-        changes_df["eurex"]["holidays"] = [datetime.strptime(f"{date}", "%m/%d/%Y") for date in changes["eurex"]["holidays"]]
+        changes_df["eurex"]["holidays"] = [parse_mhdb_date(date) for date in changes["eurex"]["holidays"]]
 
         changes_df["ice"] = {}
         for ice_class in changes["ice"].keys():
             changes_df["ice"][ice_class] = {}
-            changes_df["ice"][ice_class]["holidays"] = [datetime.strptime(f"{date}", "%m/%d/%Y") for date in changes["ice"][ice_class]["holidays"]]
+            changes_df["ice"][ice_class]["holidays"] = [parse_mhdb_date(date) for date in changes["ice"][ice_class]["holidays"]]
 
         changes_df["cfe"] = {}
-        changes_df["cfe"]["holidays"] = [datetime.strptime(f"{date}", "%m/%d/%Y") for date in changes["cfe"]["holidays"]]
-        changes_df["cfe"]["earlyCloses"] = self.parse_dictionary_of_dates(timezone, changes["cfe"]["earlyCloses"])
+        changes_df["cfe"]["holidays"] = [parse_mhdb_date(date) for date in changes["cfe"]["holidays"]]
+        cfe_timezone = changes["cfe"].get("exchangeTimeZone", exchange_adapters["cfe"]["timeZone"])
+        changes_df["cfe"]["earlyCloses"] = self.parse_dictionary_of_dates(cfe_timezone, changes["cfe"]["earlyCloses"])
 
         changes_df["oanda"] = {}
-        changes_df["oanda"]["holidays"] = [datetime.strptime(f"{date}", "%m/%d/%Y") for date in changes["oanda"]["holidays"]]
-        changes_df["oanda"]["lateOpens"] = [datetime.strptime(f"{date}", "%m/%d/%Y") for date in changes["oanda"]["lateOpens"]]
+        changes_df["oanda"]["holidays"] = [parse_mhdb_date(date) for date in changes["oanda"]["holidays"]]
+        changes_df["oanda"]["lateOpens"] = [parse_mhdb_date(date) for date in changes["oanda"]["lateOpens"]]
 
         changes_df["oanda"]["remove"] = {}
-        changes_df["oanda"]["remove"]["holidays"] = [datetime.strptime(f"{date}", "%m/%d/%Y") for date in changes["oanda"]["remove"]["holidays"]]
+        changes_df["oanda"]["remove"]["holidays"] = [parse_mhdb_date(date) for date in changes["oanda"]["remove"]["holidays"]]
         
         return changes_df
 
     def save_cme_group_futures_info(self):
-        result = self.cme_group_futures_info.to_json()
-        parsed = json.loads(result)
-        with open("cme-group-futures-info.json", "w") as outfile:
-            outfile.write(json.dumps(parsed, indent=2))
+        data = self.cme_group_futures_info
+        if isinstance(data, pd.DataFrame):
+            data = json.loads(data.to_json())
+        temporary = "cme-group-futures-info.json.tmp"
+        with open(temporary, "w") as outfile:
+            json.dump(data, outfile, indent=2)
+        os.replace(temporary, "cme-group-futures-info.json")
+
+    def get_serialized_entry(self, key, entry):
+        # Reuses the text of entries that were not modified, either from the loaded
+        # file or from a previous save, and re-serializes the rest. dirty_entries is
+        # what says an entry was modified. An entry or label replaced without
+        # entry_changed() is noticed since it is no longer the object the text was
+        # taken from, but a label changed in place needs entry_changed()
+        if key not in self.dirty_entries:
+            text = self.serialized_entries.get(key)
+            if text is None and key in self.mhdb_entry_spans:
+                start, end = self.mhdb_entry_spans[key]
+                text = self.mhdb_source_text[start:end]
+            if text is not None and is_same_entry(self.entry_labels.get(key), entry):
+                return text
+            self.entry_changed(key)
+        serialized = json.dumps(entry, indent=2).replace("\n", "\n    ")
+        self.serialized_entries[key] = serialized
+        self.entry_labels[key] = (entry, tuple(entry.items()))
+        return serialized
 
     def save(self):
-        json_object = json.dumps(self.mhdb  , indent = 2)
-        with open("market-hours-database-updated.json", "w") as outfile:
-            outfile.write(json_object)
-    
-    def check_duplicates(self, cme_class):
-        print(f"Checking duplicates in mhdb")
-        for key in self.mhdb["entries"].keys():
-            holidays = [date for date in self.mhdb["entries"][key]["holidays"]]
-            duplicates = {
-                date: count
-                for date, count in Counter(holidays).items()
-                if count > 1
-            }
-            if len(duplicates) != 0:
-                print(f"Duplicated {key} holidays: {duplicates}\n")
-                for date in duplicates:
-                    date_formatted = datetime.strptime(f"{date}", "%m/%d/%Y")
-                    self.remove_date_from_list(key, "holidays", date_formatted)
-
-            if "bankHolidays" in self.mhdb["entries"][key].keys():
-                bank_holidays = [date for date in self.mhdb["entries"][key]["bankHolidays"]]
-                duplicates = {
-                    date: count
-                    for date, count in Counter(bank_holidays).items()
-                    if count > 1
-                }
-                if len(duplicates) != 0:
-                    print(f"Duplicated {key} bank holidays: {duplicates}\n")
-                    for date in duplicates:
-                        date_formatted = datetime.strptime(f"{date}", "%m/%d/%Y")
-                        self.remove_date_from_list(key, "bankHolidays", date_formatted)
-            
-            if "earlyCloses" in self.mhdb["entries"][key].keys():
-                early_closes = [date for date in self.mhdb["entries"][key]["earlyCloses"]]
-                duplicates = {
-                    date: count
-                    for date, count in Counter(early_closes).items()
-                    if count > 1
-                }
-                if len(duplicates) != 0:
-                    print(f"Duplicated {key} early closes: {duplicates}\n")
-                    for date in duplicates:
-                        date_formatted = datetime.strptime(f"{date}", "%m/%d/%Y")
-                        self.remove_date_from_dict(key, "earlyCloses", date_formatted)
-            
-            if "lateOpens" in self.mhdb["entries"][key].keys():
-                late_opens = [date for date in self.mhdb["entries"][key]["lateOpens"]]
-                duplicates = {
-                    date: count
-                    for date, count in Counter(late_opens).items()
-                    if count > 1
-                }
-                if len(duplicates) != 0:
-                    print(f"Duplicated {key} late opens: {duplicates}\n")
-                    for date in duplicates:
-                        date_formatted = datetime.strptime(f"{date}", "%m/%d/%Y")
-                        self.remove_date_from_dict(key, "lateOpens", date_formatted)
+        # Streams the database entry by entry with the same layout as
+        # json.dumps(indent=2) and atomically replaces the output file
+        if self.mhdb.get("entries") is not self.mhdb_source_entries:
+            self.mhdb_source_entries = self.mhdb.get("entries")
+            self.mhdb_entry_spans = {}
+            self.serialized_entries = {}
+            self.entry_labels = {}
+        filename = "market-hours-database-updated.json"
+        temporary = f"{filename}.tmp"
+        with open(temporary, "w", encoding="utf-8") as outfile:
+            outfile.write("{")
+            for index, (name, value) in enumerate(self.mhdb.items()):
+                outfile.write(("," if index != 0 else "") + "\n  " + json.dumps(name) + ": ")
+                if name != "entries" or len(value) == 0:
+                    outfile.write(json.dumps(value, indent=2).replace("\n", "\n  "))
+                    continue
+                outfile.write("{")
+                for entry_index, (key, entry) in enumerate(value.items()):
+                    outfile.write(("," if entry_index != 0 else "") + "\n    " + json.dumps(key) + ": ")
+                    outfile.write(self.get_serialized_entry(key, entry))
+                outfile.write("\n  }")
+            outfile.write("\n}" if len(self.mhdb) != 0 else "}")
+        os.replace(temporary, filename)
+        self.instrumentation.flush()
+        if len(self.dirty_entries) != 0:
+            # The snapshot dates of the saved entries are no longer marked as stale
+            self.snapshot = None
+        self.dirty_entries = set()
     
+    def validate(self, rules=None, fix=False, workers=1):
+        entries = self.mhdb["entries"]
+        if workers <= 1:
+            findings = find_inconsistencies(entries, entries, rules)
+        else:
+            keys = list(entries.keys())
+            size = -(-len(keys) // workers)
+            shards = []
+            for start in range(0, len(keys), size):
+                shard = {key: entries[key] for key in keys[start:start + size]}
+                parents = {get_parent_key(key): entries[get_parent_key(key)] for key in shard if get_parent_key(key) in entries}
+                shards.append((shard, parents))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = pool.map(find_inconsistencies, [shard for shard, _ in shards], [parents for _, parents in shards], [rules] * len(shards))
+                findings = [finding for result in results for finding in result]
+        if fix:
+            self.fix_inconsistencies(findings)
+        return findings
+
+    def fix_inconsistencies(self, findings):
+        # "duplicate" findings keep the first occurrence of each date and
+        # "parent-overlap" findings drop the inherited dates from the child entry.
+        # "holiday-overlap" findings need a human decision and are left as they are
+        for finding in findings:
+            key = finding["entry"]
+            label = finding["label"]
+            dates = set(finding["dates"])
+            if finding["rule"] in ("duplicate", "parent-overlap"):
+                self.prepare_label(key, label)
+            if finding["rule"] == "duplicate":
+                seen = set()
+                self.mhdb["entries"][key][label] = [date for date in self.mhdb["entries"][key][label] if not (date in seen or seen.add(date))]
+            elif finding["rule"] == "parent-overlap":
+                if isinstance(self.mhdb["entries"][key][label], dict):
+                    for date in dates:
+                        self.mhdb["entries"][key][label].pop(date, None)
+                else:
+                    self.mhdb["entries"][key][label] = [date for date in self.mhdb["entries"][key][label] if date not in dates]
+            else:
+                continue
+            self.instrumentation.emit("dates-fixed", key, label, dates=finding["dates"], rule=finding["rule"])
+            self.entry_changed(key)
+
+    def print_findings(self, findings):
+        for finding in findings:
+            print(format_finding(finding))
+
+    def emit_findings(self, findings):
+        for finding in findings:
+            self.instrumentation.emit("finding", finding["entry"], finding["label"], rule=finding["rule"], dates=finding["dates"], parent=finding["parent"])
+
+    def check_duplicates(self, cme_class=None):
+        findings = self.validate(["duplicate"])
+        self.emit_findings(findings)
+        self.fix_inconsistencies(findings)
+
     def find_new_entries(self):
+        index = self.get_cme_product_index()
+        new_entries = []
         for entry in self.mhdb["entries"]:
-            cme_code = entry.split("-")[2]
-            market = entry.split("-")[1]
+            _, market, cme_code = entry.split("-", 2)
             if cme_code == "[*]": continue
             if market not in ["cme", "cbot", "nymex", "comex"]: continue
 
-            is_old_entry = True
-            for cme_class in self.cme_group_futures_info.keys():
-                if cme_code in self.cme_group_futures_info[cme_class]["cmeKeys"].keys() and self.cme_group_futures_info[cme_class]["cmeKeys"][cme_code] == market:
-                    is_old_entry = False
-            
-            if is_old_entry:
-                print(f"Product {cme_code} is a new entry")
-    
-    def check_intersection_of_holidays_and_label(self, entry, label):
-        holidays = [date for date in self.mhdb["entries"][entry]["holidays"]]
-        if label not in self.mhdb["entries"][entry].keys(): return
+            if not index.contains(cme_code, market):
+                self.instrumentation.emit("new-entry", entry, ticker=cme_code)
+                new_entries.append(entry)
+        return new_entries
 
-        try:
-            dates = [date for date in self.mhdb["entries"][entry][label].keys()]
-        except:
-            dates = [date for date in self.mhdb["entries"][entry][label]]
-        intersection = list(set(holidays) & set(dates))
-        if len(intersection) != 0:
-            print(f"The following dates belong to both holidays and {label} of {entry}: {intersection}")
+    def check_intersection_of_holidays_and_label(self, entry, label):
+        # Same finding as the "holiday-overlap" rule of find_inconsistencies
+        view = self.get_model().get(entry)
+        if not view.has("holidays") or not view.has(label):
+            return
+        overlap = view.get_overlap(label, view, "holidays")
+        if len(overlap) != 0:
+            self.emit_findings([{"rule": "holiday-overlap", "entry": entry, "label": label, "dates": view.get_dates(label, overlap), "parent": None}])
 
     def check_disjoint_holidays(self):
-        for entry in self.mhdb["entries"]:
-            self.check_intersection_of_holidays_and_label(entry, "earlyCloses")
-            self.check_intersection_of_holidays_and_label(entry, "lateOpens")
-            self.check_intersection_of_holidays_and_label(entry, "bankHolidays")
-    
+        self.emit_findings(self.validate(["holiday-overlap"]))
+
     def check_disjoint_holidays_with_parent(self):
-        for entry in self.mhdb["entries"]:
-            product = entry.split("-")
-            parent = f"{product[0]}-{product[1]}-[*]"
-            if (parent != entry) and (parent in self.mhdb["entries"].keys()):
-                product_holidays = [date for date in self.mhdb["entries"][entry]["holidays"]]
-                parent_holidays = [date for date in self.mhdb["entries"][parent]["holidays"]]
-
-                intersection = list(set(product_holidays) & set(parent_holidays))
-                if len(intersection) != 0:
-                    print(f"The following dates belong to both holidays of {entry} and its genric entry {parent}: {intersection}")
-                    print(f"Dates removed from {entry} holidays")
-                    self.mhdb["entries"][entry]["holidays"] = [date for date in self.mhdb["entries"][entry]["holidays"] if date not in intersection]
-
-                if "earlyCloses" in self.mhdb["entries"][entry].keys() and  "earlyCloses" in self.mhdb["entries"][parent].keys():
-                    product_early_closes = [date for date in self.mhdb["entries"][entry]["earlyCloses"].keys()]
-                    parent_early_closes = [date for date in self.mhdb["entries"][parent]["earlyCloses"].keys()]
-
-                    intersection = list(set(product_early_closes) & set(parent_early_closes))
-                    if len(intersection) != 0:
-                        print(f"The following dates belong to both early closes of {entry} and its genric entry {parent}: {intersection}")
-                        print(f"Dates removed from {entry} early Closes")
-                        for date in intersection:
-                            self.mhdb["entries"][entry]["earlyCloses"].pop(date, None)
-                
-                if "lateOpens" in self.mhdb["entries"][entry].keys() and  "lateOpens" in self.mhdb["entries"][parent].keys():
-                    product_late_opens = [date for date in self.mhdb["entries"][entry]["lateOpens"].keys()]
-                    parent_late_opens = [date for date in self.mhdb["entries"][parent]["lateOpens"].keys()]
-
-                    intersection = list(set(product_late_opens) & set(parent_late_opens))
-                    if len(intersection) != 0:
-                        print(f"The following dates belong to both late opens of {entry} and its genric entry {parent}: {intersection}")
-                        print(f"Dates removed from {entry} late opens")
-                        for date in intersection:
-                            self.mhdb["entries"][entry]["lateOpens"].pop(date, None)
-                
-                if "bankHolidays" in self.mhdb["entries"][entry].keys() and  "bankHolidays" in self.mhdb["entries"][parent].keys():
-                    product_bank_holidays = [date for date in self.mhdb["entries"][entry]["bankHolidays"]]
-                    parent_bank_holidays = [date for date in self.mhdb["entries"][parent]["bankHolidays"]]
-
-                    intersection = list(set(product_bank_holidays) & set(parent_bank_holidays))
-                    if len(intersection) != 0:
-                        print(f"The following dates belong to both bank holidays of {entry} and its genric entry {parent}: {intersection}")
-                        print(f"Dates removed from {entry} bank holidays")
-                        self.mhdb["entries"][entry]["holidays"] = [date for date in self.mhdb["entries"][entry]["holidays"] if date not in intersection]
-                print("\n")
-
-mhdb = market_hours_database()
-"""
-for cme_class in changes.keys():
-    for early_close in changes[cme_class]["earlyCloses"]:
-        #mhdb.add_early_close_to_mhdb(cme_class, early_close)
-        mhdb.add_early_close_to_cme_group_futures_info(cme_class, early_close)
-    for late_open in changes[cme_class]["lateOpens"]:
-        #mhdb.add_late_open_to_mhdb(cme_class, late_open)
-        mhdb.add_late_open_to_cme_group_futures_info(cme_class, late_open)
-
-for cme_class in changes.keys():
-    mhdb.update_early_closes(cme_class)
-    mhdb.update_late_opens(cme_class)
-    for holiday in changes[cme_class]["holidays"]:
-        mhdb.add_holiday_to_mhdb(cme_class, holiday)"""
-
-print("NICE")
-#mhdb.add_bank_holidays_entry_to_mhdb()
-#mhdb.save_cme_group_futures_info()
-
-changes = mhdb.read_changes_from_json("changes.json")
-mhdb.check_disjoint_holidays_with_parent()
-mhdb.check_disjoint_holidays()
-mhdb.check_duplicates("")
-mhdb.remove_all("dairy", changes)
-mhdb.remove_all("livestock", changes)
-mhdb.remove_all("lumber", changes)
-mhdb.remove_holidays("Forex-oanda-[*]", changes["oanda"]["remove"]["holidays"])
-mhdb.remove_date_from_list("Future-cbot-KE", "holidays", datetime(2023, 9, 4))
-mhdb.save()
\ No newline at end of file
+        findings = self.get_model().find_parent_overlaps()
+        self.emit_findings(findings)
+        self.fix_inconsistencies(findings)
+
+# Steps applied by "python main.py pipeline" when no --steps file is given. They
+# reproduce the removals hard-coded in update_mhdb()
+default_pipeline_steps = [
+    {"action": "remove", "target": {"cmeClass": "dairy"}, "changes": ["cme", "dairy", "remove"]},
+    {"action": "remove", "target": {"cmeClass": "livestock"}, "changes": ["cme", "livestock", "remove"]},
+    {"action": "remove", "target": {"cmeClass": "lumber"}, "changes": ["cme", "lumber", "remove"]},
+    {"action": "remove", "target": {"entry": "Forex-oanda-[*]"}, "changes": ["oanda", "remove"], "labels": ["holidays"]},
+    {"action": "remove", "target": {"entry": "Future-cbot-KE"}, "dates": {"holidays": ["9/4/2023"]}},
+]
+
+# How each section of changes.json reaches the database. Sections of exchanges with
+# "groups" are keyed by product group and each group targets {groups: name}, the
+# other sections apply to "target". "timeZone" is the time zone of early closes and
+# late opens when the section has no exchangeTimeZone. Adding a venue only needs
+# a new row here
+exchange_adapters = {
+    "cme": {"groups": "cmeClass", "timeZone": "America/Chicago"},
+    "ice": {"groups": "iceClass", "timeZone": "America/New_York"},
+    "eurex": {"target": {"market": "eurex", "securityType": "Future"}, "timeZone": "Europe/Berlin"},
+    "cfe": {"target": {"market": "cfe", "securityType": "Future"}, "timeZone": "America/Chicago"},
+    "oanda": {"target": {"entry": "Forex-oanda-[*]"}, "timeZone": "America/New_York"},
+}
+
+def get_exchange_steps(changes, exchanges=None, exclude=None):
+    # Pipeline steps applying the additions and then the "remove" sections of
+    # changes.json, one step per exchange, product group, action and label.
+    # exclude maps CME classes to the tickers that do not get bank holidays
+    exclude = {} if exclude is None else exclude
+    steps = []
+    for exchange, adapter in exchange_adapters.items():
+        if exchange not in changes or (exchanges is not None and exchange not in exchanges):
+            continue
+        if "groups" in adapter:
+            groups = [({adapter["groups"]: group}, [exchange, group]) for group in changes[exchange]]
+        else:
+            groups = [(adapter["target"], [exchange])]
+        for target, path in groups:
+            section = changes
+            for name in path:
+                section = section[name]
+            time_zone = section.get("exchangeTimeZone", adapter["timeZone"])
+            for action, action_path in [("add", path), ("remove", path + ["remove"])]:
+                dates = section if action == "add" else section.get("remove", {})
+                for label in date_labels:
+                    if len(dates.get(label, [])) == 0:
+                        continue
+                    if action == "add" and label in dict_labels and not isinstance(dates[label], dict):
+                        # e.g. the oanda late opens, listed as dates without their times
+                        logger.warning(f"Skipping {label} of {'/'.join(action_path)}: they need their times, as {{date: time}}")
+                        continue
+                    step = {"action": action, "target": target, "changes": action_path, "labels": [label], "timeZone": time_zone}
+                    if "cmeClass" in target and label == "bankHolidays":
+                        step["exclude"] = exclude.get(target["cmeClass"], [])
+                    steps.append(step)
+    return steps
+
+# Labels each changes.json section can add and remove, as read_changes_from_json
+# reads them. oanda late opens are listed without their times, so the differ
+# always leaves them empty and reports them with the other changes it cannot express
+changeset_labels = {
+    "cme": {"add": date_labels, "remove": date_labels},
+    "eurex": {"add": ["holidays"], "remove": []},
+    "ice": {"add": ["holidays"], "remove": []},
+    "cfe": {"add": ["holidays", "earlyCloses"], "remove": []},
+    "oanda": {"add": ["holidays"], "remove": ["holidays"]},
+}
+
+def get_label_items(entry, label):
+    # Dates of a label as a set, paired with their times for early closes and late opens
+    if entry is None:
+        return set()
+    dates = entry.get(label, [])
+    return set(dates.items()) if isinstance(dates, dict) else set(dates)
+
+def get_item_date(item):
+    return item[0] if isinstance(item, tuple) else item
+
+def get_section_item(item, entry_time_zone, section_time_zone):
+    # Inverse of the conversion plan_entry_changes applies to early closes and late
+    # opens: the (date, time) a section in section_time_zone must hold for the entry
+    # to end up with item. None when no time maps back exactly, e.g. in a DST gap
+    date, time = item
+    converted = format_local_time(parse_mhdb_datetime(date, time, entry_time_zone), section_time_zone)
+    if format_local_time(parse_mhdb_datetime(date, converted, section_time_zone), entry_time_zone) != time:
+        return None
+    return date, converted
+
+def get_changes_between(old_entries, new_entries, cme_group_futures_info, ice_futures_info=None):
+    # Smallest changes.json turning old_entries into new_entries. A date is added to
+    # a product group when every entry of the group has it afterwards and removed
+    # when none has it, so applying the change-set touches nothing else. Also returns
+    # the changes the schema cannot express, as {key: {label: {"add": [], "remove": []}}}
+    changed = {}
+    for key in set(old_entries.keys()) | set(new_entries.keys()):
+        old_entry = old_entries.get(key)
+        new_entry = new_entries.get(key)
+        for label in date_labels:
+            if old_entry is not None and new_entry is not None and old_entry.get(label) == new_entry.get(label):
+                continue
+            old_items = get_label_items(old_entry, label)
+            new_items = get_label_items(new_entry, label)
+            if old_items != new_items:
+                changed[(key, label)] = {"add": new_items - old_items, "remove": old_items - new_items, "new": new_items}
+
+    # (path in changes.json, keys dates are added to, keys dates are removed from),
+    # resolved the way the exchange adapters resolve their targets
+    groups = []
+    for cme_class, info in cme_group_futures_info.items():
+        keys = [f"Future-{market}-{ticker}" for ticker, market in info["cmeKeys"].items()]
+        groups.append((["cme", cme_class], keys, keys))
+    if ice_futures_info is not None:
+        for ice_class in ice_futures_info.keys():
+            keys = [f"Future-ice-{product}" for product in ice_futures_info[ice_class]["keys"]]
+            groups.append((["ice", ice_class], keys, keys))
+    for exchange in ["eurex", "cfe"]:
+        keys = [key for key in new_entries if key.startswith(f"Future-{exchange}-")]
+        targeted = set(keys)
+        groups.append(([exchange], [key for key in keys if get_parent_key(key) == key or get_parent_key(key) not in targeted], keys))
+    groups.append((["oanda"], ["Forex-oanda-[*]"], ["Forex-oanda-[*]"]))
+
+    changes = {exchange: {} for exchange in changeset_labels}
+    covered = set()
+    for path, add_keys, remove_keys in groups:
+        exchange = path[0]
+        time_zone = exchange_adapters[exchange]["timeZone"]
+        section = {}
+        if exchange in ("cme", "cfe"):
+            section["exchangeTimeZone"] = time_zone
+        for action in ["add", "remove"]:
+            if action == "remove" and len(changeset_labels[exchange]["remove"]) == 0:
+                continue
+            group_keys = [key for key in (add_keys if action == "add" else remove_keys) if key in new_entries]
+            target = section if action == "add" else section.setdefault("remove", {})
+            for label in changeset_labels[exchange][action]:
+                dict_label = label in dict_labels
+                selected = set()
+                if any((key, label) in changed for key in group_keys):
+                    if action == "add":
+                        # Times are compared in the time zone of the section, the one
+                        # the change-set gives them in. section_items maps them back,
+                        # mapping only the dates some entry of the group added
+                        wanted = set()
+                        for key in group_keys:
+                            if (key, label) in changed:
+                                wanted |= {get_item_date(item) for item in changed[(key, label)]["add"]}
+                        section_items = {}
+                        candidates = set()
+                        for key in group_keys:
+                            items = changed[(key, label)]["new"] if (key, label) in changed else get_label_items(new_entries[key], label)
+                            items = [item for item in items if get_item_date(item) in wanted]
+                            if dict_label and new_entries[key]["exchangeTimeZone"] != time_zone:
+                                items = {get_section_item(item, new_entries[key]["exchangeTimeZone"], time_zone): item for item in items}
+                            else:
+                                items = {item: item for item in items}
+                            section_items[key] = items
+                            if (key, label) in changed:
+                                added = changed[(key, label)]["add"]
+                                candidates |= {item for item, original in items.items() if original in added}
+                        candidates.discard(None)
+                        # Adding a date an entry already has is a no-op and keeps its time
+                        def is_added(key, item):
+                            if not dict_label:
+                                return item in section_items[key]
+                            old_dates = old_entries[key].get(label, {}) if key in old_entries else {}
+                            if item[0] in old_dates:
+                                return new_entries[key][label].get(item[0]) == old_dates[item[0]]
+                            return item in section_items[key]
+                        selected = {item for item in candidates if all(is_added(key, item) for key in group_keys)}
+                        for key in group_keys:
+                            if (key, label) in changed:
+                                covered.update((key, label, "add", section_items[key][item]) for item in selected if item in section_items[key])
+                    else:
+                        candidates = set()
+                        for key in group_keys:
+                            if (key, label) in changed:
+                                candidates |= {get_item_date(item) for item in changed[(key, label)]["remove"]}
+                        # Early closes and late opens are looked up by date in the entry itself
+                        group_dates = [new_entries[key].get(label, {}) if dict_label else changed[(key, label)]["new"] if (key, label) in changed else get_label_items(new_entries[key], label) for key in group_keys]
+                        selected = {date for date in candidates if not any(date in dates for dates in group_dates)}
+                        for key in group_keys:
+                            if (key, label) in changed:
+                                covered.update((key, label, "remove", item) for item in changed[(key, label)]["remove"] if get_item_date(item) in selected)
+                if action == "add" and dict_label:
+                    target[label] = dict(sorted(selected, key=lambda item: date_to_ordinal(item[0])))
+                else:
+                    target[label] = sorted({get_item_date(item) for item in selected}, key=date_to_ordinal)
+        if exchange == "oanda":
+            section["lateOpens"] = []
+        if len(path) == 2:
+            changes[exchange][path[1]] = section
+        else:
+            changes[exchange] = section
+
+    residual = {}
+    for (key, label), items in changed.items():
+        for action in ["add", "remove"]:
+            remaining = sorted((item for item in items[action] if (key, label, action, item) not in covered), key=lambda item: date_to_ordinal(get_item_date(item)))
+            if len(remaining) != 0:
+                empty = {} if label in dict_labels else []
+                dates = dict(remaining) if label in dict_labels else remaining
+                residual.setdefault(key, {}).setdefault(label, {"add": empty, "remove": empty})[action] = dates
+    return changes, residual
+
+removed_date = object()
+
+def plan_entry_changes(entries, work):
+    # Net added and removed dates of each entry and label, given the (step, dates,
+    # time zone) actions of the steps touching it in order. Module level so
+    # change_pipeline.plan can run it on shards of the entries in a process pool
+    diff = []
+    for (key, label), actions in work.items():
+        current = entries[key].get(label, {} if label in dict_labels else [])
+        # Membership is tested for every date of every step, lists are looked up as a set
+        current = current if isinstance(current, dict) else set(current)
+        overrides = {}
+        for step, values, time_zone in actions:
+            for date in values:
+                if step["action"] == "add" and label in dict_labels:
+                    if time_zone is None:
+                        raise ValueError(f"Step {step} adds {label} without a time zone")
+                    local = parse_mhdb_datetime(date, values[date], time_zone)
+                    date, value = format_mhdb_date(local), format_local_time(local, entries[key]["exchangeTimeZone"])
+                else:
+                    date, value = format_mhdb_date(parse_mhdb_date(date)), None
+                present = overrides[date] is not removed_date if date in overrides else date in current
+                if step["action"] == "add" and not present:
+                    overrides[date] = value
+                elif step["action"] == "remove" and present:
+                    overrides[date] = removed_date
+
+        added = {}
+        removed = []
+        for date, value in overrides.items():
+            if value is removed_date:
+                if date in current:
+                    removed.append(date)
+            elif date not in current or (isinstance(current, dict) and current[date] != value):
+                added[date] = value
+        if len(added) != 0 or len(removed) != 0:
+            ordered = sorted(added, key=date_to_ordinal)
+            diff.append({
+                "entry": key,
+                "label": label,
+                "added": {date: added[date] for date in ordered} if label in dict_labels else ordered,
+                "removed": sorted(removed, key=date_to_ordinal),
+            })
+    return diff
+
+class change_pipeline:
+    # Runs a change-set as declarative steps in timed stages: plan, apply, validate
+    # and save. Each step has an "action" ("add" or "remove"), a "target" (one of
+    # {"cmeClass": name}, {"iceClass": name}, {"market": name} with an optional
+    # "securityType", {"entry": key} or {"entries": [keys]}; market steps add to
+    # the [*] entries and remove from every entry)
+    # and either "changes", a path into changes.json to the section holding the
+    # dates per label, or inline "dates". Optional fields are "labels" to restrict
+    # the labels taken from the section, "timeZone" for the times of early closes
+    # and late opens (default: the exchangeTimeZone of the section) and "exclude",
+    # tickers that do not get bank holidays, as in apply_cme_changes
+    def __init__(self, mhdb, changes, steps=None, keys=None):
+        self.mhdb = mhdb
+        self.changes = changes
+        self.steps = default_pipeline_steps if steps is None else steps
+        # Only these entries are planned when given, see mhdb_watcher
+        self.keys = keys
+        self.timings = {}
+
+    def timed(self, stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - start
+        return result
+
+    def get_step_keys(self, step):
+        target = step["target"]
+        entries = self.mhdb.mhdb["entries"]
+        if "cmeClass" in target:
+            keys = [key for _, key in self.mhdb.get_cme_class_keys(target["cmeClass"])]
+        elif "iceClass" in target:
+            keys = [self.mhdb.get_mhdb_key(product, "ice") for product in self.mhdb.ice_futures_info[target["iceClass"]]["keys"]]
+        elif "market" in target:
+            keys = self.mhdb.get_market_keys(target["market"], target.get("securityType"))
+            if step.get("action") == "add":
+                # Children inherit from their [*] entry, so dates are only added to
+                # the entries whose parent is not targeted too
+                targeted = set(keys)
+                keys = [key for key in keys if get_parent_key(key) == key or get_parent_key(key) not in targeted]
+        elif "entry" in target:
+            keys = [target["entry"]]
+        else:
+            keys = target["entries"]
+        return [key for key in keys if key in entries and (self.keys is None or key in self.keys)]
+
+    def get_step_dates(self, step):
+        if "dates" in step:
+            return step["dates"], step.get("timeZone")
+        section = self.changes
+        time_zone = step.get("timeZone")
+        for name in step["changes"]:
+            section = section[name]
+            if "timeZone" not in step and "exchangeTimeZone" in section:
+                time_zone = section["exchangeTimeZone"]
+        labels = step.get("labels", [label for label in date_labels if label in section])
+        return {label: section[label] for label in labels}, time_zone
+
+    def plan(self, workers=1):
+        # Replays the steps against the current entries without touching them and
+        # returns the net difference per entry and label. Entries are independent,
+        # so with several workers they are planned in shards on a process pool
+        entries = self.mhdb.mhdb["entries"]
+        work = {}
+        for step in self.steps:
+            dates, time_zone = self.get_step_dates(step)
+            exclude = set(step.get("exclude", []))
+            for key in self.get_step_keys(step):
+                ticker = key.split("-", 2)[2]
+                for label, values in dates.items():
+                    if label == "bankHolidays" and ticker in exclude:
+                        continue
+                    work.setdefault((key, label), []).append((step, values, time_zone))
+        if workers <= 1:
+            return plan_entry_changes(entries, work)
+
+        work_by_key = {}
+        for (key, label), actions in work.items():
+            work_by_key.setdefault(key, {})[(key, label)] = actions
+        keys = list(work_by_key.keys())
+        # More shards than workers, so one class with many products does not hold up the rest
+        size = max(-(-len(keys) // (workers * 4)), 1)
+        shards = []
+        for start in range(0, len(keys), size):
+            shard_entries = {}
+            shard_work = {}
+            for key in keys[start:start + size]:
+                shard_work.update(work_by_key[key])
+                # Only the labels the shard plans and the time zone are sent to the worker
+                fields = ["exchangeTimeZone"] + [label for _, label in work_by_key[key]]
+                shard_entries[key] = {field: entries[key][field] for field in fields if field in entries[key]}
+            shards.append((shard_entries, shard_work))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(plan_entry_changes, [shard_entries for shard_entries, _ in shards], [shard_work for _, shard_work in shards])
+            changes = {(change["entry"], change["label"]): change for result in results for change in result}
+        # Same order as the serial plan: first step touching each entry and label
+        return [changes[item] for item in work if item in changes]
+
+    def apply(self, diff):
+        entries = self.mhdb.mhdb["entries"]
+        for change in diff:
+            entry = entries[change["entry"]]
+            label = change["label"]
+            self.mhdb.prepare_label(change["entry"], label)
+            removed = set(change["removed"])
+            if label in dict_labels:
+                values = {date: value for date, value in entry.get(label, {}).items() if date not in removed}
+                values.update(change["added"])
+                if len(change["added"]) != 0:
+                    values = dict(sorted(values.items(), key=lambda d: date_to_ordinal(d[0])))
+            else:
+                values = [date for date in entry.get(label, []) if date not in removed] + change["added"]
+                if len(change["added"]) != 0:
+                    values = sorted(values, key=date_to_ordinal)
+            entry[label] = values
+            for date in change["removed"]:
+                self.mhdb.instrumentation.emit("date-removed", change["entry"], label, date=date)
+            for date in change["added"]:
+                self.mhdb.instrumentation.emit("date-added", change["entry"], label, date=date)
+            self.mhdb.entry_changed(change["entry"])
+
+    def run(self, dry_run=False, fix=False, workers=1):
+        diff = self.timed("plan", self.plan, workers)
+        if dry_run:
+            return diff, []
+        self.timed("apply", self.apply, diff)
+        findings = self.timed("validate", self.mhdb.validate, None, fix, workers)
+        self.timed("save", self.mhdb.save)
+        return diff, findings
+
+    def print_timings(self):
+        for stage, elapsed in self.timings.items():
+            print(f"Stage {stage} took {elapsed:.3f}s")
+
+class mhdb_watcher:
+    # Keeps the database loaded and re-applies the change-set whenever it or a CME
+    # keys workbook changes. The watcher keeps one transaction open over everything
+    # it applied, so an entry is recomputed by restoring its original labels from
+    # that transaction and replaying the steps for it alone. Only the entries of the
+    # groups whose section or products changed are recomputed, validated and saved
+    def __init__(self, mhdb, changes_path="changes.json", exchanges=None, fix=False):
+        self.mhdb = mhdb
+        self.changes_path = changes_path
+        self.exchanges = exchanges
+        self.fix = fix
+        self.changes = {}
+        self.fingerprints = {}
+        self.base = None
+
+    def get_watched_files(self):
+        files = {self.changes_path: None}
+        for cme_class, filename in self.mhdb.cme_keys_filenames.items():
+            files[filename] = cme_class
+        return files
+
+    def poll(self):
+        # Files whose content changed since the previous update, all of them the first
+        # time, and their new fingerprints. update() records them once they are applied
+        changed = {}
+        for path in self.get_watched_files():
+            if not os.path.exists(path):
+                continue
+            previous = self.fingerprints.get(path)
+            fingerprint = get_source_fingerprint(path, previous)
+            if previous is None or fingerprint["hash"] != previous["hash"]:
+                changed[path] = fingerprint
+        return changed
+
+    def get_group_sections(self, changes):
+        sections = {}
+        for exchange, adapter in exchange_adapters.items():
+            if exchange not in changes or (self.exchanges is not None and exchange not in self.exchanges):
+                continue
+            if "groups" in adapter:
+                for group, section in changes[exchange].items():
+                    sections[(exchange, group)] = ({adapter["groups"]: group}, section)
+            else:
+                sections[(exchange,)] = (adapter["target"], changes[exchange])
+        return sections
+
+    def get_group_keys(self, target):
+        return set(change_pipeline(self.mhdb, {}, []).get_step_keys({"target": target}))
+
+    def restore(self, keys):
+        for (key, label), (entry, original) in self.base.labels.items():
+            if key not in keys:
+                continue
+            self.mhdb.prepare_label(key, label)
+            if original is mhdb_transaction.missing:
+                entry.pop(label, None)
+            else:
+                entry[label] = type(original)(original)
+            self.mhdb.entry_changed(key)
+
+    def update(self):
+        # Applies what changed since the previous call and returns the diff, or None.
+        # A change-set or workbook that cannot be read or applied, e.g. one an editor
+        # is still writing, is logged and left unrecorded so the next call retries it
+        changed = self.poll()
+        if len(changed) == 0:
+            return None
+        try:
+            diff = self.apply(list(changed))
+        except Exception as e:
+            logger.error(f"Could not apply {', '.join(changed)}: {e!r}")
+            return None
+        self.fingerprints.update(changed)
+        return diff
+
+    def apply(self, changed):
+        start = time.perf_counter()
+        # Every input is read before the database is touched
+        files = self.get_watched_files()
+        cme_keys = {}
+        if self.base is not None:
+            cme_keys = {files[path]: self.mhdb._get_cme_keys(path) for path in changed if files[path] is not None}
+        changes = self.changes
+        if self.changes_path in changed:
+            with open(self.changes_path, "r") as f:
+                changes = json.load(f)
+
+        # The update runs in its own transaction, nested in the one the watcher keeps
+        # open, so a failure leaves the database and the CME keys as they were
+        previous_keys = {cme_class: self.mhdb.cme_group_futures_info.get(cme_class, {}).get("cmeKeys") for cme_class in cme_keys}
+        first = self.base is None
+        self.mhdb.begin()
+        if first:
+            self.base = self.mhdb.transactions[-1]
+        try:
+            diff, keys, findings = self.recompute(changes, cme_keys)
+        except BaseException:
+            self.mhdb.rollback()
+            for cme_class, class_keys in previous_keys.items():
+                if class_keys is not None:
+                    self.mhdb.set_cme_keys(cme_class, class_keys)
+            if first:
+                self.base = None
+            raise
+        if not first:
+            self.mhdb.commit()
+        self.changes = changes
+
+        summary = f"{len(diff)} entry changes, {len(findings)} validation findings in {time.perf_counter() - start:.2f}s"
+        if keys is None:
+            print(f"Applied {self.changes_path}: {summary}")
+        else:
+            print(f"{', '.join(changed)} changed: recomputed {len(keys)} entries, {summary}")
+        return diff
+
+    def recompute(self, changes, cme_keys):
+        keys = set()
+        for cme_class, class_keys in cme_keys.items():
+            before = self.get_group_keys({"cmeClass": cme_class})
+            self.mhdb.set_cme_keys(cme_class, class_keys)
+            keys |= before | self.get_group_keys({"cmeClass": cme_class})
+
+        previous = self.get_group_sections(self.changes)
+        current = self.get_group_sections(changes)
+        for group in set(previous) | set(current):
+            if previous.get(group, (None, None))[1] != current.get(group, (None, None))[1]:
+                keys |= self.get_group_keys((current.get(group) or previous.get(group))[0])
+
+        if self.base is self.mhdb.transactions[-1]:
+            # First run: everything is applied inside the transaction the watcher keeps open
+            keys = None
+        else:
+            # Children are checked against their [*] entry, so they are recomputed with it
+            inheritance = self.mhdb.get_inheritance()
+            keys |= {child for key in list(keys) for child in inheritance.get_children(key)}
+            self.restore(keys)
+        pipeline = change_pipeline(self.mhdb, changes, get_exchange_steps(changes, self.exchanges), keys)
+        diff = pipeline.plan()
+        pipeline.apply(diff)
+
+        entries = self.mhdb.mhdb["entries"]
+        if keys is None:
+            findings = self.mhdb.validate(None, self.fix)
+        else:
+            shard = {key: entries[key] for key in keys if key in entries}
+            parents = {get_parent_key(key): entries[get_parent_key(key)] for key in shard if get_parent_key(key) in entries}
+            findings = find_inconsistencies(shard, parents)
+            if self.fix:
+                self.mhdb.fix_inconsistencies(findings)
+        self.mhdb.print_findings(findings)
+        self.mhdb.save()
+        return diff, keys, findings
+
+    def run(self, interval=1.0):
+        print(f"Watching {', '.join(self.get_watched_files())}, press Ctrl+C to stop")
+        try:
+            while True:
+                self.update()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+def run_change_pipeline(changes_path="changes.json", steps_path=None, dry_run=False, fix=False, timing=False, exchanges=None, workers=1, use_snapshot=False, source_mode="cached", parallel=False):
+    start = time.perf_counter()
+    mhdb = market_hours_database(parallel=parallel, source_mode=source_mode, use_snapshot=use_snapshot, instrumentation=mhdb_instrumentation(timing=timing))
+    with open(changes_path, "r") as f:
+        changes = json.load(f)
+    steps = None
+    if steps_path is not None:
+        with open(steps_path, "r") as f:
+            steps = json.load(f)
+    elif exchanges is not None:
+        steps = get_exchange_steps(changes, exchanges)
+    pipeline = change_pipeline(mhdb, changes, steps)
+    pipeline.timings["load"] = time.perf_counter() - start
+    diff, findings = pipeline.run(dry_run, fix, workers)
+    if dry_run:
+        print(json.dumps(diff, indent=2))
+    else:
+        print(f"Applied {len(diff)} entry changes, {len(findings)} validation findings")
+        mhdb.print_findings(findings)
+    pipeline.print_timings()
+    mhdb.instrumentation.print_summary()
+    return pipeline
+
+def update_mhdb(timing=False, use_snapshot=False, source_mode="cached", parallel=False):
+    mhdb = market_hours_database(parallel=parallel, source_mode=source_mode, use_snapshot=use_snapshot, instrumentation=mhdb_instrumentation(timing=timing))
+    """
+    for cme_class in changes.keys():
+        for early_close in changes[cme_class]["earlyCloses"]:
+            #mhdb.add_early_close_to_mhdb(cme_class, early_close)
+            mhdb.add_early_close_to_cme_group_futures_info(cme_class, early_close)
+        for late_open in changes[cme_class]["lateOpens"]:
+            #mhdb.add_late_open_to_mhdb(cme_class, late_open)
+            mhdb.add_late_open_to_cme_group_futures_info(cme_class, late_open)
+
+    for cme_class in changes.keys():
+        mhdb.update_early_closes(cme_class)
+        mhdb.update_late_opens(cme_class)
+        for holiday in changes[cme_class]["holidays"]:
+            mhdb.add_holiday_to_mhdb(cme_class, holiday)"""
+
+    print("NICE")
+    #mhdb.add_bank_holidays_entry_to_mhdb()
+    #mhdb.save_cme_group_futures_info()
+
+    changes = mhdb.read_changes_from_json("changes.json")
+    findings = mhdb.validate()
+    mhdb.emit_findings(findings)
+    mhdb.fix_inconsistencies(findings)
+    mhdb.start_batch()
+    mhdb.remove_all("dairy", changes)
+    mhdb.remove_all("livestock", changes)
+    mhdb.remove_all("lumber", changes)
+    mhdb.remove_holidays("Forex-oanda-[*]", changes["oanda"]["remove"]["holidays"])
+    mhdb.remove_date_from_list("Future-cbot-KE", "holidays", datetime(2023, 9, 4))
+    mhdb.apply_batch()
+    mhdb.save()
+    if timing:
+        mhdb.print_conversion_cache_stats()
+    mhdb.instrumentation.print_summary()
+
+def normalize_mhdb(labels=None, min_children=2, use_snapshot=False, source_mode="cached", parallel=False):
+    mhdb = market_hours_database(parallel=parallel, source_mode=source_mode, use_snapshot=use_snapshot)
+    size = len(mhdb.mhdb_source_text) if mhdb.mhdb_source_text is not None else None
+    hoisted = mhdb.hoist_common_dates(labels, min_children)
+    mhdb.save()
+    dates = sum(len(dates) for parent in hoisted.values() for dates in parent.values())
+    print(f"Hoisted {dates} dates into {len(hoisted)} parent entries")
+    if size is not None:
+        print(f"Database size: {size} -> {os.path.getsize('market-hours-database-updated.json')} bytes")
+    mhdb.instrumentation.print_summary()
+
+def diff_mhdb(old_path, new_path, output="changes.json", cme_info_path="cme-group-futures-info.json", ice_info_path="ice-futures-info.json"):
+    # Writes the changes.json that turns old_path into new_path
+    start = time.perf_counter()
+    with open(old_path, "r") as f:
+        old_entries = json.load(f)["entries"]
+    with open(new_path, "r") as f:
+        new_entries = json.load(f)["entries"]
+    with open(cme_info_path, "r") as f:
+        cme_group_futures_info = json.load(f)
+    ice_futures_info = None
+    if os.path.exists(ice_info_path):
+        with open(ice_info_path, "r") as f:
+            ice_futures_info = json.load(f)
+    else:
+        print(f"{ice_info_path} not found, ICE changes are not grouped by class")
+    loaded = time.perf_counter()
+    changes, residual = get_changes_between(old_entries, new_entries, cme_group_futures_info, ice_futures_info)
+    temporary = f"{output}.tmp"
+    with open(temporary, "w") as outfile:
+        json.dump(changes, outfile, indent=2)
+    os.replace(temporary, output)
+    for key, labels in sorted(residual.items()):
+        for label, dates in labels.items():
+            print(f"Not expressible in {output}: {key} {label} add {list(dates['add'])} remove {list(dates['remove'])}")
+    print(f"Wrote {output} in {time.perf_counter() - loaded:.3f}s (loading took {loaded - start:.3f}s)")
+    return changes, residual
+
+def export_mhdb(mhdb_path="market-hours-database.json", output="mhdb-dates.npz", format="npz"):
+    start = time.perf_counter()
+    with open(mhdb_path, "r") as f:
+        entries = json.load(f)["entries"]
+    table = get_date_table(entries)
+    table.save(output, format)
+    print(f"Exported {len(table)} dates of {len(table.keys)} entries to {output} in {time.perf_counter() - start:.2f}s")
+    return table
+
+def watch_mhdb(changes_path="changes.json", interval=1.0, exchanges=None, fix=False, use_snapshot=False, source_mode="cached", parallel=False):
+    mhdb = market_hours_database(parallel=parallel, source_mode=source_mode, use_snapshot=use_snapshot)
+    mhdb_watcher(mhdb, changes_path, exchanges, fix).run(interval)
+
+def refresh_sources(names=None, mode="remote", concurrency=4):
+    # Refreshes the source cache without loading the database
+    cache = source_cache(concurrency=concurrency)
+    names = list(remote_sources.keys()) if names is None else names
+    start = time.perf_counter()
+    paths = cache.fetch_all([remote_sources[name]["url"] for name in names], mode)
+    for name in names:
+        print(f"{name}: {paths[remote_sources[name]['url']]}")
+    print(f"Refreshed {len(names)} sources in {time.perf_counter() - start:.2f}s")
+
+def print_affected_entries(args):
+    # Uses the snapshot when it was built from the same database file
+    path = os.path.abspath(args.mhdb)
+    snapshot = open_snapshot(snapshot_filename)
+    if snapshot is not None and path in snapshot.header["sources"]:
+        recorded = snapshot.header["sources"][path]
+        if get_source_fingerprint(path, recorded)["hash"] != recorded["hash"]:
+            snapshot = None
+    else:
+        snapshot = None
+    if snapshot is not None:
+        entries = snapshot.get_state()["mhdb"]["entries"]
+    else:
+        with open(args.mhdb, "r") as f:
+            entries = json.load(f)["entries"]
+    index = mhdb_date_index(entries, snapshot)
+    labels = date_labels if args.label is None else args.label
+    if args.end is None:
+        affected = index.query(args.date, labels, not args.no_inherited)
+        for label in labels:
+            print(f"{label}: {', '.join(sorted(affected[label]))}")
+        return
+    for label in labels:
+        for ordinal, keys in index.query_range(args.date, args.end, label, not args.no_inherited).items():
+            print(f"{ordinal_to_date(ordinal)} {label}: {', '.join(sorted(keys))}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Updates the market hours database. Without a command it applies changes.json")
+    parser.add_argument("--verbose", action="store_true", help="log every date added or removed and every validation finding")
+    parser.add_argument("--timing", action="store_true", help="time the market_hours_database methods and print the totals")
+    parser.add_argument("--snapshot", action="store_true", help=f"load the database from {snapshot_filename} when it is current, and write it otherwise")
+    parser.add_argument("--parallel", action="store_true", help="load the database and the CME workbooks concurrently")
+    parser.add_argument("--source-mode", choices=["local", "cached", "remote"], default="cached", help="\"local\" reads the sources from the working directory, \"cached\" downloads them only when the source cache is stale and \"remote\" always downloads them")
+    subparsers = parser.add_subparsers(dest="command")
+    affected_parser = subparsers.add_parser("affected", help="list the entries closed or shortened on a date")
+    affected_parser.add_argument("date", help="date as m/d/yyyy, or the first date of a range when --end is given")
+    affected_parser.add_argument("--end", help="last date (m/d/yyyy) of the range to list")
+    affected_parser.add_argument("--label", action="append", choices=date_labels, help="label to look up, can be repeated (default: all)")
+    affected_parser.add_argument("--no-inherited", action="store_true", help="do not expand [*] entries into their children")
+    affected_parser.add_argument("--mhdb", default="market-hours-database.json", help="market hours database to index")
+    pipeline_parser = subparsers.add_parser("pipeline", help="apply a change-set as declarative steps")
+    pipeline_parser.add_argument("--changes", default="changes.json", help="change-set the steps read their dates from")
+    pipeline_parser.add_argument("--steps", help="JSON list of steps (default: default_pipeline_steps)")
+    pipeline_parser.add_argument("--exchange", action="append", choices=list(exchange_adapters.keys()), help="apply every section of this exchange in the change-set instead of the default steps, can be repeated")
+    pipeline_parser.add_argument("--dry-run", action="store_true", help="print the planned changes as JSON without applying them")
+    pipeline_parser.add_argument("--fix", action="store_true", help="fix the validation findings that can be fixed automatically")
+    pipeline_parser.add_argument("--workers", type=int, default=1, help="plan and validate the entries in this many processes")
+    normalize_parser = subparsers.add_parser("normalize", help="move the dates shared by all the children of a [*] entry into it")
+    normalize_parser.add_argument("--label", action="append", choices=date_labels, help="label to normalize, can be repeated (default: all)")
+    normalize_parser.add_argument("--min-children", type=int, default=2, help="only hoist from parents with at least this many children")
+    diff_parser = subparsers.add_parser("diff", help="write the changes.json that turns one database into another")
+    diff_parser.add_argument("old", help="market hours database before the changes")
+    diff_parser.add_argument("new", help="market hours database after the changes")
+    diff_parser.add_argument("--output", default="changes.json", help="change-set to write")
+    diff_parser.add_argument("--cme-info", default="cme-group-futures-info.json", help="CME classes the changes are grouped by")
+    diff_parser.add_argument("--ice-info", default="ice-futures-info.json", help="ICE classes the changes are grouped by")
+    watch_parser = subparsers.add_parser("watch", help="keep the database loaded and re-apply the change-set whenever an input changes")
+    watch_parser.add_argument("--changes", default="changes.json", help="change-set to watch")
+    watch_parser.add_argument("--interval", type=float, default=1.0, help="seconds between checks of the inputs")
+    watch_parser.add_argument("--exchange", action="append", choices=list(exchange_adapters.keys()), help="only apply the sections of this exchange, can be repeated (default: all)")
+    watch_parser.add_argument("--fix", action="store_true", help="fix the validation findings that can be fixed automatically")
+    export_parser = subparsers.add_parser("export", help="write the dates of every entry as columnar tables for analytics")
+    export_parser.add_argument("--mhdb", default="market-hours-database.json", help="market hours database to export")
+    export_parser.add_argument("--output", help="table to write (default: mhdb-dates.npz or mhdb-dates.parquet)")
+    export_parser.add_argument("--format", choices=["npz", "parquet"], default="npz", help="compressed numpy arrays or a Parquet table")
+    refresh_parser = subparsers.add_parser("refresh", help="download the upstream sources into the source cache")
+    refresh_parser.add_argument("--source", action="append", choices=list(remote_sources.keys()), help="source to refresh, can be repeated (default: all)")
+    refresh_parser.add_argument("--mode", choices=["remote", "cached"], default="remote", help="\"cached\" only downloads the sources that are stale or changed upstream")
+    refresh_parser.add_argument("--concurrency", type=int, default=4, help="maximum number of downloads at once")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(message)s")
+
+    if args.command == "affected":
+        print_affected_entries(args)
+    elif args.command == "normalize":
+        normalize_mhdb(args.label, args.min_children, args.snapshot, args.source_mode, args.parallel)
+    elif args.command == "diff":
+        diff_mhdb(args.old, args.new, args.output, args.cme_info, args.ice_info)
+    elif args.command == "watch":
+        watch_mhdb(args.changes, args.interval, args.exchange, args.fix, args.snapshot, args.source_mode, args.parallel)
+    elif args.command == "export":
+        export_mhdb(args.mhdb, args.output or f"mhdb-dates.{args.format}", args.format)
+    elif args.command == "refresh":
+        refresh_sources(args.source, args.mode, args.concurrency)
+    elif args.command == "pipeline":
+        run_change_pipeline(args.changes, args.steps, args.dry_run, args.fix, args.timing, args.exchange, args.workers, args.snapshot, args.source_mode, args.parallel)
+    else:
+        update_mhdb(args.timing, args.snapshot, args.source_mode, args.parallel)
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# main.py and benchmark.py live in the repository root, next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import workspace as workspace_helpers
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    # A synthetic database, CME workbooks, ICE info and change-set in the working directory
+    monkeypatch.chdir(tmp_path)
+    workspace_helpers.generate(tmp_path)
+    return tmp_path
@@ -0,0 +1,20 @@
+import json
+
+from workspace import load
+
+# The batch must leave the database as the serial calls do, checked on the
+# synthetic workspace the benchmarks run on
+
+def apply_cme_changes(mhdb, changes):
+    for cme_class in changes["cme"].keys():
+        mhdb.apply_cme_changes(cme_class, changes)
+        mhdb.remove_all(cme_class, changes)
+
+def test_batch_matches_serial(workspace):
+    serial = load()
+    apply_cme_changes(serial, serial.read_changes_from_json("changes.json"))
+    batch = load()
+    batch.start_batch()
+    apply_cme_changes(batch, batch.read_changes_from_json("changes.json"))
+    batch.apply_batch()
+    assert json.dumps(batch.mhdb) == json.dumps(serial.mhdb)
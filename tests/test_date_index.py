@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import main
+from workspace import add_entries, get_entry, load, read_json
+
+def get_expected(entries, date, label):
+    return {key for key, entry in entries.items() if date in entry.get(label, ())}
+
+def test_queries_match_a_scan(workspace):
+    mhdb = load()
+    entries = mhdb.mhdb["entries"]
+    key = next(key for key, entry in entries.items() if entry.get("holidays") and "[*]" not in key)
+    date = entries[key]["holidays"][0]
+    affected = mhdb.get_affected_entries(date, inherited=False)
+    for label in main.date_labels:
+        assert affected[label] == get_expected(entries, date, label)
+    # Same answer for a datetime or an ordinal
+    assert mhdb.get_affected_entries(main.parse_mhdb_date(date), inherited=False) == affected
+    assert mhdb.get_affected_entries(main.date_to_ordinal(date), inherited=False) == affected
+
+def test_children_inherit_the_parent_dates(workspace):
+    parent = get_entry("America/Chicago", ["7/4/2041"])
+    parent["earlyCloses"] = {"11/29/2041": "12:15:00"}
+    add_entries({"Future-cfe-[*]": parent, "Future-cfe-VX": get_entry("America/Chicago"), "Future-cfe-VX2": get_entry("America/Chicago")})
+    mhdb = load()
+    assert mhdb.get_affected_entries("7/4/2041", ["holidays"], inherited=False) == {"holidays": {"Future-cfe-[*]"}}
+    assert mhdb.get_affected_entries("7/4/2041", ["holidays"]) == {"holidays": {"Future-cfe-[*]", "Future-cfe-VX", "Future-cfe-VX2"}}
+    ranges = mhdb.load_date_index().query_range("1/1/2041", "12/31/2041", "earlyCloses")
+    assert ranges == {main.date_to_ordinal("11/29/2041"): {"Future-cfe-[*]", "Future-cfe-VX", "Future-cfe-VX2"}}
+
+def test_index_follows_the_changes(workspace):
+    mhdb = load()
+    index = mhdb.load_date_index()
+    key = next(key for key, entry in mhdb.mhdb["entries"].items() if entry.get("holidays") and "[*]" not in key)
+    removed = mhdb.mhdb["entries"][key]["holidays"][0]
+    mhdb.add_date_to_list(key, "holidays", datetime(2040, 1, 2))
+    mhdb.remove_date_from_list(key, "holidays", main.parse_mhdb_date(removed))
+    # Only the changed entry is indexed again
+    assert index.stale == {key}
+    assert key in mhdb.get_affected_entries("1/2/2040", ["holidays"], inherited=False)["holidays"]
+    assert key not in mhdb.get_affected_entries(removed, ["holidays"], inherited=False)["holidays"]
+    assert mhdb.date_index is index and index.stale == set()
+
+    mhdb.apply_exchange_changes(read_json("changes.json"))
+    fresh = main.mhdb_date_index(mhdb.mhdb["entries"])
+    index.refresh()
+    assert index.postings == fresh.postings and index.ordinals == fresh.ordinals
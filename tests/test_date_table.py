@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+import main
+from workspace import load
+
+def get_rows(table):
+    keys = table.get_key_column("key").tolist()
+    return list(zip(keys, table.label_codes.tolist(), table.ordinals.tolist(), table.seconds.tolist()))
+
+def assert_tables_equal(loaded, table):
+    assert loaded.keys == table.keys
+    assert get_rows(loaded) == get_rows(table)
+
+def test_table_holds_every_date(workspace):
+    mhdb = load()
+    table = main.get_date_table(mhdb.mhdb["entries"])
+    expected = []
+    for key, entry in mhdb.mhdb["entries"].items():
+        for code, label in enumerate(main.date_labels):
+            dates = entry.get(label) or {}
+            for date in dates:
+                seconds = main.time_to_seconds(dates[date]) if isinstance(dates, dict) else -1
+                expected.append((key, code, main.date_to_ordinal(date), seconds))
+    assert get_rows(table) == expected
+    rows = table.select("earlyCloses")
+    markets = table.get_key_column("market")[rows]
+    counts = table.count("earlyCloses")
+    assert counts.sum() == rows.sum()
+    market, year = counts.index[0]
+    assert counts.iloc[0] == (rows & (table.get_key_column("market") == market) & (table.get_years() == year)).sum()
+    assert set(markets) == set(counts.index.get_level_values("market"))
+
+def test_npz_round_trip(workspace):
+    table = load().export_date_table("dates.npz")
+    assert_tables_equal(main.load_date_table("dates.npz"), table)
+    assert np.array_equal(main.load_date_table("dates.npz").get_years(), table.get_years())
+
+def test_parquet_round_trip(workspace):
+    pytest.importorskip("pyarrow")
+    table = load().export_date_table("dates.parquet", "parquet")
+    assert_tables_equal(main.load_date_table("dates.parquet"), table)
+
+def test_unknown_format_is_rejected(workspace):
+    with pytest.raises(ValueError):
+        load().export_date_table("dates.csv", "csv")
@@ -0,0 +1,36 @@
+import copy
+
+import main
+from workspace import add_entries, get_entry, load, read_json
+
+def test_diff_round_trip(workspace):
+    mhdb = load()
+    old = copy.deepcopy(mhdb.mhdb["entries"])
+    mhdb.apply_exchange_changes(read_json("changes.json"))
+    changes, residual = main.get_changes_between(old, mhdb.mhdb["entries"], mhdb.cme_group_futures_info, read_json("ice-futures-info.json"))
+    assert residual == {}
+    replayed = load()
+    replayed.apply_exchange_changes(changes)
+    assert replayed.mhdb["entries"] == mhdb.mhdb["entries"]
+
+def test_diff_round_trip_across_time_zones(workspace):
+    # The cfe early closes are given in Chicago time, Future-cfe-VX holds them in New York time
+    add_entries({
+        "Future-cfe-[*]": get_entry("America/Chicago", ["1/1/2025"]),
+        "Future-cfe-VX": get_entry("America/New_York"),
+        "Future-cfe-VX2": get_entry("America/Chicago", ["7/4/2025"]),
+        "Future-eurex-FDAX": get_entry("Europe/Berlin"),
+        "Future-eurex-FGBL": get_entry("America/New_York"),
+    })
+    changes = {
+        "cfe": {"holidays": ["7/4/2025", "12/25/2025"], "earlyCloses": {"11/28/2025": "12:15:00", "1/5/2025": "12:00:00"}},
+        "eurex": {"holidays": ["5/1/2025"]},
+    }
+    mhdb = load()
+    old = copy.deepcopy(mhdb.mhdb["entries"])
+    mhdb.apply_exchange_changes(changes)
+    diff, residual = main.get_changes_between(old, mhdb.mhdb["entries"], mhdb.cme_group_futures_info)
+    assert residual == {}
+    replayed = load()
+    replayed.apply_exchange_changes(diff)
+    assert replayed.mhdb["entries"] == mhdb.mhdb["entries"]
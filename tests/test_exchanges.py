@@ -0,0 +1,46 @@
+import logging
+
+from workspace import add_entries, get_entry, load, read_json, write_json
+
+def test_cme_sections_match_the_cme_methods(workspace):
+    legacy = load()
+    changes = legacy.read_changes_from_json("changes.json")
+    for cme_class in changes["cme"].keys():
+        legacy.apply_cme_changes(cme_class, changes)
+        legacy.remove_all(cme_class, changes)
+    mhdb = load()
+    mhdb.apply_exchange_changes(read_json("changes.json"), exchanges=["cme"])
+    assert mhdb.mhdb["entries"] == legacy.mhdb["entries"]
+
+def test_market_dates_go_to_the_futures_parent_only(workspace):
+    add_entries({
+        "Future-cfe-[*]": get_entry("America/Chicago"),
+        "Future-cfe-VX": get_entry("America/Chicago"),
+        "Index-cfe-VIX": get_entry("America/Chicago"),
+        "Future-eurex-FDAX": get_entry("Europe/Berlin"),
+    })
+    mhdb = load()
+    mhdb.apply_exchange_changes({"cfe": {"holidays": ["7/4/2025"], "earlyCloses": {"11/28/2025": "12:15:00"}}, "eurex": {"holidays": ["5/1/2025"]}})
+    entries = mhdb.mhdb["entries"]
+    assert entries["Future-cfe-[*]"]["holidays"] == ["7/4/2025"]
+    assert entries["Future-cfe-[*]"]["earlyCloses"] == {"1/5/2025": "12:00:00", "11/28/2025": "12:15:00"}
+    assert entries["Future-cfe-VX"]["holidays"] == [] and entries["Index-cfe-VIX"]["holidays"] == []
+    # Without a [*] entry every Future entry of the market gets the date
+    assert entries["Future-eurex-FDAX"]["holidays"] == ["5/1/2025"]
+
+def test_dates_without_times_are_skipped(workspace, caplog):
+    add_entries({"Forex-oanda-[*]": get_entry("America/New_York")})
+    changes = read_json("changes.json")
+    changes["oanda"]["holidays"] = ["1/2/2031"]
+    expected = load()
+    expected.apply_exchange_changes(changes)
+    changes["oanda"]["lateOpens"] = ["1/2/2031"]
+    write_json("changes.json", changes)
+    mhdb = load()
+    with caplog.at_level(logging.WARNING, logger="mhdb"):
+        mhdb.apply_exchange_changes(changes)
+    assert mhdb.mhdb["entries"] == expected.mhdb["entries"]
+    assert "1/2/2031" in mhdb.mhdb["entries"]["Forex-oanda-[*]"]["holidays"]
+    assert "Skipping lateOpens of oanda" in caplog.text
+    # The section is also read as the pre-adapter change-set
+    assert len(mhdb.read_changes_from_json("changes.json")["oanda"]["lateOpens"]) == 1
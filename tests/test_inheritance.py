@@ -0,0 +1,46 @@
+from workspace import add_entries, get_entry, load
+
+def get_calendars(mhdb, keys):
+    inheritance = mhdb.get_inheritance()
+    return {(key, label): inheritance.get_effective(key, label) for key in keys for label in ["holidays", "earlyCloses"]}
+
+def test_hoisting_keeps_the_effective_calendars(workspace):
+    parent = get_entry("America/Chicago", ["1/1/2025"])
+    parent["earlyCloses"] = {"11/28/2025": "12:00:00"}
+    children = {f"Future-cfe-VX{i}": get_entry("America/Chicago", ["7/4/2025", "12/25/2025", f"3/{i + 1}/2025"]) for i in range(3)}
+    for child in children.values():
+        child["earlyCloses"] = {"11/28/2025": "12:15:00", "12/24/2025": "12:15:00"}
+    add_entries({"Future-cfe-[*]": parent, **children})
+    mhdb = load()
+    before = get_calendars(mhdb, children)
+    hoisted = mhdb.hoist_common_dates(["holidays", "earlyCloses"])
+    assert hoisted["Future-cfe-[*]"] == {"holidays": ["7/4/2025", "12/25/2025"], "earlyCloses": ["12/24/2025"]}
+    entries = mhdb.mhdb["entries"]
+    # The parent keeps its own time, the children keep the date with theirs
+    assert entries["Future-cfe-[*]"]["earlyCloses"] == {"11/28/2025": "12:00:00", "12/24/2025": "12:15:00"}
+    assert entries["Future-cfe-VX0"]["earlyCloses"] == {"11/28/2025": "12:15:00"}
+    assert entries["Future-cfe-VX0"]["holidays"] == ["3/1/2025"]
+    mhdb.get_inheritance().effective = {}
+    assert get_calendars(mhdb, children) == before
+
+def test_times_in_other_time_zones_are_not_hoisted(workspace):
+    children = {f"Future-cfe-VX{i}": get_entry("America/Chicago") for i in range(2)}
+    children["Future-cfe-VX1"]["exchangeTimeZone"] = "America/New_York"
+    add_entries({"Future-cfe-[*]": get_entry("America/Chicago"), **children})
+    mhdb = load()
+    assert mhdb.get_inheritance().find_common_dates("Future-cfe-[*]", "earlyCloses") == {}
+
+def test_parents_with_too_few_children_are_left_alone(workspace):
+    add_entries({"Future-cfe-[*]": get_entry("America/Chicago"), "Future-cfe-VX": get_entry("America/Chicago", ["7/4/2025"])})
+    mhdb = load()
+    assert "Future-cfe-[*]" not in mhdb.hoist_common_dates(["holidays"])
+    assert mhdb.mhdb["entries"]["Future-cfe-VX"]["holidays"] == ["7/4/2025"]
+
+def test_hoisted_dates_follow_a_changed_parent(workspace):
+    add_entries({"Future-cfe-[*]": get_entry("America/Chicago"), "Future-cfe-VX": get_entry("America/Chicago", ["7/4/2025"])})
+    mhdb = load()
+    assert "1/1/2025" not in mhdb.get_effective_dates("Future-cfe-VX", "holidays")
+    mhdb.prepare_label("Future-cfe-[*]", "holidays")
+    mhdb.mhdb["entries"]["Future-cfe-[*]"]["holidays"] = ["1/1/2025"]
+    mhdb.entry_changed("Future-cfe-[*]")
+    assert mhdb.get_effective_dates("Future-cfe-VX", "holidays") == frozenset({"1/1/2025", "7/4/2025"})
@@ -0,0 +1,19 @@
+import os
+
+from workspace import load
+
+def test_parallel_load_matches_serial(workspace, capsys):
+    parallel = load(parallel=True)
+    assert capsys.readouterr().out == ""
+    os.remove("cme-keys-cache.json")
+    serial = load()
+    assert parallel.mhdb == serial.mhdb
+    assert parallel.cme_group_futures_info == serial.cme_group_futures_info
+    assert parallel.ice_futures_info.equals(serial.ice_futures_info)
+    assert parallel.mhdb_source_text == serial.mhdb_source_text
+
+def test_parallel_load_reuses_the_cme_keys_cache(workspace):
+    serial = load()
+    parallel = load(parallel=True)
+    assert parallel.cme_keys_cache_misses == 0
+    assert parallel.cme_group_futures_info == serial.cme_group_futures_info
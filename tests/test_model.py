@@ -0,0 +1,117 @@
+import json
+
+import numpy as np
+
+import main
+from workspace import add_entries, get_entry, load, read_json
+
+def get_key(mhdb, label="holidays"):
+    return next(key for key, entry in mhdb.mhdb["entries"].items() if entry.get(label) and "[*]" not in key)
+
+def assert_views_match(mhdb):
+    # The views kept up to date equal views built again from the JSON entries
+    model = mhdb.get_model()
+    for key, entry in mhdb.mhdb["entries"].items():
+        fresh = main.mhdb_entry(key, entry)
+        for label in main.date_labels:
+            assert np.array_equal(model.get(key).get_ordinals(label), fresh.get_ordinals(label)), (key, label)
+            if label in main.dict_labels:
+                assert model.get(key).get_values(label) == fresh.get_values(label), (key, label)
+
+def capture_findings(mhdb):
+    events = []
+    mhdb.instrumentation = main.mhdb_instrumentation(sink=events.extend, buffer_size=1)
+    return events
+
+def test_views_hold_the_typed_dates(workspace):
+    add_entries({"Future-cfe-VX": {**get_entry("America/Chicago", ["7/4/2025", "1/1/2025", "7/4/2025"]), "lateOpens": ["1/6/2025"]}})
+    view = load().get_model().get("Future-cfe-VX")
+    assert (view.security_type, view.market, view.ticker) == ("Future", "cfe", "VX")
+    # Sorted without duplicates, whatever the order of the list
+    assert view.get_values("holidays").tolist() == [main.date_to_ordinal("1/1/2025"), main.date_to_ordinal("7/4/2025")]
+    assert view.get_values("earlyCloses") == {main.date_to_ordinal("1/5/2025"): 12 * 3600}
+    assert view.get_values("lateOpens") == {main.date_to_ordinal("1/6/2025"): None}
+    assert view.contains("holidays", main.date_to_ordinal("7/4/2025"))
+    assert not view.contains("bankHolidays", main.date_to_ordinal("7/4/2025"))
+
+def test_indexes_keep_the_entries_order(workspace):
+    mhdb = load()
+    model = mhdb.get_model()
+    entries = mhdb.mhdb["entries"]
+    assert model.get_keys(market="cme") == [key for key in entries if key.split("-")[1] == "cme"]
+    assert model.get_keys("Future", "cme") == [key for key in entries if key.startswith("Future-cme-")]
+    ticker = get_key(mhdb).split("-", 2)[2]
+    assert model.get_keys(ticker=ticker) == [key for key in entries if key.split("-", 2)[2] == ticker]
+    parent = next(key for key in entries if key.endswith("[*]"))
+    assert model.get_children(parent) == [key for key in entries if main.get_parent_key(key) == parent and key != parent]
+    # A new entry is picked up through entry_changed
+    mhdb.mhdb["entries"]["Future-cme-ZZZ"] = get_entry("America/Chicago")
+    mhdb.entry_changed("Future-cme-ZZZ")
+    assert mhdb.get_market_keys("cme", "Future")[-1] == "Future-cme-ZZZ"
+    assert model.get("Future-cme-ZZZ").ticker == "ZZZ"
+
+def test_model_saves_the_entries_as_loaded(workspace):
+    mhdb = load()
+    model = mhdb.get_model()
+    for key in mhdb.mhdb["entries"]:
+        for label in main.date_labels:
+            model.get(key).get_values(label)
+    assert json.dumps(model.to_json(mhdb.mhdb)) == json.dumps(read_json("market-hours-database.json"))
+    mhdb.save()
+    with open("market-hours-database.json", "rb") as original, open("market-hours-database-updated.json", "rb") as saved:
+        assert saved.read() == original.read()
+
+def test_parent_overlaps_match_the_validation(workspace):
+    mhdb = load()
+    mhdb.apply_exchange_changes(read_json("changes.json"))
+    findings = mhdb.get_model().find_parent_overlaps()
+    assert len(findings) != 0
+    assert findings == mhdb.validate(["parent-overlap"])
+    mhdb.check_disjoint_holidays_with_parent()
+    assert mhdb.get_model().find_parent_overlaps() == []
+    assert mhdb.validate(["parent-overlap"]) == []
+
+def test_views_follow_the_removals(workspace):
+    mhdb = load()
+    changes = mhdb.read_changes_from_json("changes.json")
+    for cme_class in changes["cme"].keys():
+        for key in mhdb.get_market_keys("cme"):
+            mhdb.get_model().get(key).get_ordinals("holidays")
+        mhdb.remove_all(cme_class, changes)
+    assert_views_match(mhdb)
+
+def test_views_follow_a_batch(workspace):
+    mhdb = load()
+    changes = mhdb.read_changes_from_json("changes.json")
+    for key in mhdb.mhdb["entries"]:
+        mhdb.get_model().get(key).get_ordinals("holidays")
+    mhdb.start_batch()
+    for cme_class in changes["cme"].keys():
+        mhdb.apply_cme_changes(cme_class, changes)
+        mhdb.remove_all(cme_class, changes)
+    mhdb.apply_batch()
+    assert_views_match(mhdb)
+
+def test_holiday_overlap_is_reported(workspace):
+    entry = get_entry("America/Chicago", ["1/5/2025", "7/4/2025"])
+    entry["bankHolidays"] = ["7/4/2025", "12/25/2025"]
+    add_entries({"Future-cfe-VX": entry})
+    mhdb = load()
+    events = capture_findings(mhdb)
+    mhdb.check_intersection_of_holidays_and_label("Future-cfe-VX", "bankHolidays")
+    mhdb.check_intersection_of_holidays_and_label("Future-cfe-VX", "earlyCloses")
+    mhdb.check_intersection_of_holidays_and_label("Future-cfe-VX", "lateOpens")
+    assert [(event["label"], event["dates"]) for event in events if event["event"] == "finding"] == [("bankHolidays", ["7/4/2025"]), ("earlyCloses", ["1/5/2025"])]
+
+def test_snapshot_views_match_the_parsed_ones(workspace):
+    load(use_snapshot=True)
+    mhdb = load(use_snapshot=True)
+    assert mhdb.snapshot is not None
+    parsed = load().get_model()
+    for key, entry in mhdb.mhdb["entries"].items():
+        view = mhdb.get_model().get(key)
+        assert view.source is not None
+        for label in main.date_labels:
+            assert np.array_equal(view.get_ordinals(label), parsed.get(key).get_ordinals(label)), (key, label)
+            if label in main.dict_labels:
+                assert view.get_values(label) == parsed.get(key).get_values(label)
@@ -0,0 +1,23 @@
+import json
+
+import main
+from workspace import load, read_json
+
+def get_pipeline(mhdb):
+    changes = read_json("changes.json")
+    return main.change_pipeline(mhdb, changes, main.get_exchange_steps(changes))
+
+def test_sharded_plan_matches_serial(workspace):
+    mhdb = load()
+    serial = get_pipeline(mhdb).plan()
+    assert len(serial) != 0
+    # Same changes in the same order, whatever the number of shards
+    for workers in [2, 3]:
+        assert json.dumps(get_pipeline(mhdb).plan(workers)) == json.dumps(serial)
+
+def test_sharded_apply_matches_serial(workspace):
+    serial = load()
+    serial_diff = serial.apply_exchange_changes(read_json("changes.json"))
+    sharded = load()
+    assert sharded.apply_exchange_changes(read_json("changes.json"), workers=2) == serial_diff
+    assert json.dumps(sharded.mhdb) == json.dumps(serial.mhdb)
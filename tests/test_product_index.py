@@ -0,0 +1,35 @@
+import main
+from workspace import load
+
+def get_classes_by_scan(info, ticker, market):
+    return {cme_class for cme_class, class_info in info.items() if class_info.get("cmeKeys", {}).get(ticker) == market}
+
+def test_index_matches_the_cme_keys(workspace):
+    mhdb = load()
+    info = mhdb.cme_group_futures_info
+    index = mhdb.get_cme_product_index()
+    for cme_class, class_info in info.items():
+        for ticker, market in class_info["cmeKeys"].items():
+            assert index.get_classes(ticker, market) == get_classes_by_scan(info, ticker, market)
+            assert cme_class in index.get_classes_by_key(f"Future-{market}-{ticker}")
+        assert mhdb.get_cme_class_keys(cme_class) == [(ticker, f"Future-{market}-{ticker}") for ticker, market in class_info["cmeKeys"].items()]
+
+def test_set_cme_keys_keeps_the_index_in_sync(workspace):
+    mhdb = load()
+    index = mhdb.get_cme_product_index()
+    cme_class, class_info = next(iter(mhdb.cme_group_futures_info.items()))
+    dropped, market = next(iter(class_info["cmeKeys"].items()))
+    kept = {ticker: market for ticker, market in class_info["cmeKeys"].items() if ticker != dropped}
+    mhdb.set_cme_keys(cme_class, {**kept, "ZZZ": "nymex"})
+    assert mhdb.get_cme_product_index() is index
+    assert cme_class not in index.get_classes(dropped, market)
+    assert index.get_classes("ZZZ", "nymex") == {cme_class}
+    assert mhdb.get_cme_class_keys(cme_class)[-1] == ("ZZZ", "Future-nymex-ZZZ")
+    # A new class is indexed too, and the index equals one built again
+    mhdb.set_cme_keys("new-class", {"ZZZ": "nymex"})
+    assert index.get_classes("ZZZ", "nymex") == {cme_class, "new-class"}
+    fresh = main.cme_product_index(mhdb.cme_group_futures_info)
+    assert index.classes_by_product == fresh.classes_by_product and index.products_by_class == fresh.products_by_class
+    # find_new_entries sees the tickers of the updated classes
+    mhdb.mhdb["entries"]["Future-nymex-ZZZ"] = {"exchangeTimeZone": "America/New_York"}
+    assert "Future-nymex-ZZZ" not in mhdb.find_new_entries()
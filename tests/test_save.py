@@ -0,0 +1,48 @@
+import json
+from datetime import datetime
+
+from workspace import load, read_json
+
+def read_saved():
+    return read_json("market-hours-database-updated.json")
+
+def get_key(mhdb):
+    return next(key for key, entry in mhdb.mhdb["entries"].items() if entry.get("holidays"))
+
+def test_unchanged_database_is_saved_byte_identical(workspace):
+    load().save()
+    with open("market-hours-database.json", "rb") as original, open("market-hours-database-updated.json", "rb") as saved:
+        assert saved.read() == original.read()
+
+def test_saved_database_matches_a_full_dump(workspace):
+    mhdb = load()
+    mhdb.apply_exchange_changes(read_json("changes.json"))
+    mhdb.save()
+    with open("market-hours-database-updated.json", "r") as f:
+        assert f.read() == json.dumps(mhdb.mhdb, indent=2)
+    mhdb.add_date_to_list(get_key(mhdb), "holidays", datetime(2040, 1, 2))
+    mhdb.save()
+    with open("market-hours-database-updated.json", "r") as f:
+        assert f.read() == json.dumps(mhdb.mhdb, indent=2)
+
+def test_replaced_labels_and_entries_are_saved(workspace):
+    mhdb = load()
+    mhdb.save()
+    entries = mhdb.mhdb["entries"]
+    keys = [key for key, entry in entries.items() if entry.get("holidays")][:3]
+    entries[keys[0]]["holidays"] = ["1/1/2040"]
+    entries[keys[1]] = dict(entries[keys[1]], holidays=["1/2/2040"])
+    del entries[keys[2]]["holidays"]
+    entries["Future-cfe-VX"] = {"exchangeTimeZone": "America/Chicago", "holidays": ["1/3/2040"]}
+    mhdb.save()
+    assert read_saved()["entries"] == entries
+    assert mhdb.dirty_entries == set()
+
+def test_labels_changed_in_place_are_saved_after_entry_changed(workspace):
+    mhdb = load()
+    mhdb.save()
+    key = get_key(mhdb)
+    mhdb.mhdb["entries"][key]["holidays"].append("1/1/2040")
+    mhdb.entry_changed(key)
+    mhdb.save()
+    assert read_saved()["entries"][key]["holidays"][-1] == "1/1/2040"
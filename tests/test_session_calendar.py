@@ -0,0 +1,46 @@
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import main
+from workspace import add_entries, get_entry, load
+
+def get_entry_with_sessions(time_zone, holidays=()):
+    entry = get_entry(time_zone, holidays)
+    for day in ["monday", "tuesday", "wednesday", "thursday", "friday"]:
+        entry[day] = [{"start": "09:30:00", "end": "16:00:00", "state": "market"}]
+    return entry
+
+def get_utc(day, time, time_zone):
+    local = datetime.strptime(f"{day} {time}", "%m/%d/%Y %H:%M:%S").replace(tzinfo=ZoneInfo(time_zone))
+    return int(local.astimezone(timezone.utc).timestamp())
+
+def test_sessions_follow_the_daylight_saving_changes(workspace):
+    add_entries({"Equity-usa-SPY": get_entry_with_sessions("America/New_York"), "Equity-xetra-SAP": get_entry_with_sessions("Europe/Berlin")})
+    calendar = load().build_session_calendar("3/7/2025", "3/31/2025", ["Equity-usa-SPY", "Equity-xetra-SAP"])
+    for key, time_zone in [("Equity-usa-SPY", "America/New_York"), ("Equity-xetra-SAP", "Europe/Berlin")]:
+        opens, closes = calendar.get(key)
+        for ordinal, open, close in zip(calendar.ordinals.tolist(), opens.tolist(), closes.tolist()):
+            day = main.ordinal_to_date(ordinal)
+            if datetime.fromordinal(ordinal).weekday() >= 5:
+                assert open == close == main.session_calendar.closed
+            else:
+                assert (open, close) == (get_utc(day, "09:30:00", time_zone), get_utc(day, "16:00:00", time_zone)), (key, day)
+    # New York moved on 3/9, Berlin on 3/30
+    assert calendar.get("Equity-usa-SPY")[0][3] - calendar.get("Equity-usa-SPY")[0][0] == 3 * 86400 - 3600
+
+def test_holidays_and_shortened_days(workspace):
+    parent = {**get_entry("America/New_York", ["7/4/2025"]), "earlyCloses": {}}
+    child = get_entry_with_sessions("America/New_York", ["7/3/2025"])
+    child["earlyCloses"] = {"7/2/2025": "13:00:00"}
+    child["lateOpens"] = {"7/1/2025": "10:30:00"}
+    child["bankHolidays"] = ["6/30/2025"]
+    add_entries({"Equity-usa-[*]": parent, "Equity-usa-SPY": child})
+    mhdb = load()
+    opens, closes = mhdb.build_session_calendar("6/30/2025", "7/4/2025", ["Equity-usa-SPY"]).get("Equity-usa-SPY")
+    closed = main.session_calendar.closed
+    time_zone = "America/New_York"
+    # Bank holidays still trade, the parent holiday is inherited
+    assert opens.tolist() == [get_utc("6/30/2025", "09:30:00", time_zone), get_utc("7/1/2025", "10:30:00", time_zone), get_utc("7/2/2025", "09:30:00", time_zone), closed, closed]
+    assert closes.tolist() == [get_utc("6/30/2025", "16:00:00", time_zone), get_utc("7/1/2025", "16:00:00", time_zone), get_utc("7/2/2025", "13:00:00", time_zone), closed, closed]
+    opens, _ = mhdb.build_session_calendar("6/30/2025", "7/4/2025", ["Equity-usa-SPY"], inherited=False).get("Equity-usa-SPY")
+    assert opens[4] == get_utc("7/4/2025", "09:30:00", time_zone)
@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import struct
+
+import benchmark
+import main
+from workspace import add_entries, get_entry, load
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_snapshot_load_matches_a_normal_load(workspace):
+    load(use_snapshot=True)
+    snapshot = load(use_snapshot=True)
+    assert snapshot.snapshot is not None
+    parsed = load()
+    assert json.dumps(snapshot.mhdb) == json.dumps(parsed.mhdb)
+    assert snapshot.cme_group_futures_info == parsed.cme_group_futures_info
+    assert snapshot.ice_futures_info.equals(parsed.ice_futures_info)
+    assert snapshot.mhdb_entry_spans == parsed.mhdb_entry_spans
+    snapshot.save()
+    assert read("market-hours-database-updated.json") == read("market-hours-database.json")
+
+def test_snapshot_stores_the_dates_once(workspace):
+    load(use_snapshot=True)
+    snapshot = main.open_snapshot(main.snapshot_filename)
+    # The entries are stored without their dates, which are in the arrays, and
+    # the database text is not stored at all
+    state = json.loads(snapshot.get_bytes("state"))
+    assert all(entry.get(label) is None for entry in state["mhdb"]["entries"].values() for label in main.date_labels)
+    assert set(snapshot.header["sections"]) - {"state"} == set(main.get_snapshot_arrays({}).keys()) | {"entry-spans"} | {f"{label}-rebuilt" for label in main.date_labels}
+    snapshot.close()
+
+def test_date_index_from_the_snapshot_matches_the_parsed_one(workspace):
+    load(use_snapshot=True)
+    mhdb = load(use_snapshot=True)
+    key = next(key for key, entry in mhdb.mhdb["entries"].items() if entry.get("holidays") and "[*]" not in key)
+    mhdb.entry_changed(key)
+    mhdb.mhdb["entries"][key]["holidays"].append("1/2/2040")
+    index = mhdb.load_date_index()
+    parsed = main.mhdb_date_index(mhdb.mhdb["entries"])
+    assert index.postings == parsed.postings and index.ordinals == parsed.ordinals
+    assert key in index.query("1/2/2040")["holidays"]
+
+def test_non_canonical_dates_are_kept_as_written(workspace):
+    entry = get_entry("America/New_York", ["01/02/2025", "1/3/2025"])
+    entry["earlyCloses"] = {"1/5/2025": "9:30:00"}
+    entry["lateOpens"] = ["1/6/2025"]
+    add_entries({"Future-cfe-VX": entry})
+    load(use_snapshot=True)
+    mhdb = load(use_snapshot=True)
+    assert mhdb.snapshot is not None
+    assert mhdb.mhdb["entries"]["Future-cfe-VX"] == entry
+
+def test_changed_source_invalidates_the_snapshot(workspace):
+    load(use_snapshot=True)
+    os.utime("market-hours-database.json")
+    assert load(use_snapshot=True).snapshot is not None
+    with open("market-hours-database.json", "a") as f:
+        f.write(" ")
+    assert load(use_snapshot=True).snapshot is None
+    assert load(use_snapshot=True).snapshot is not None
+
+def test_unusable_snapshots_are_ignored(workspace, caplog):
+    load(use_snapshot=True)
+    data = read(main.snapshot_filename)
+    with open(main.snapshot_filename, "wb") as f:
+        f.write(data[:len(data) // 2])
+    with caplog.at_level(logging.WARNING, logger="mhdb"):
+        assert load(use_snapshot=True).snapshot is None
+    assert "truncated" in caplog.text
+    # The truncated file was replaced
+    assert load(use_snapshot=True).snapshot is not None
+
+    data = bytearray(read(main.snapshot_filename))
+    struct.pack_into("<I", data, 8, main.snapshot_version - 1)
+    with open(main.snapshot_filename, "wb") as f:
+        f.write(data)
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger="mhdb"):
+        assert load(use_snapshot=True).snapshot is None
+    assert f"version {main.snapshot_version - 1}" in caplog.text
+
+def test_snapshot_is_opt_in(workspace):
+    load()
+    assert not os.path.exists(main.snapshot_filename)
+
+def test_slower_snapshot_fails_the_benchmark():
+    cases = {"market_hours_database-snapshot": {"seconds": 0.5}, "market_hours_database-cme-keys-cache": {"seconds": 0.4}}
+    unmet = benchmark.find_unmet_expectations({"scales": {"1": {"cases": cases}}})
+    assert [expectation["case"] for expectation in unmet] == ["market_hours_database-snapshot"]
+    cases["market_hours_database-snapshot"]["seconds"] = 0.3
+    assert benchmark.find_unmet_expectations({"scales": {"1": {"cases": cases}}}) == []
@@ -0,0 +1,186 @@
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import main
+
+class source_server:
+    # Local stand-in for the upstream hosts. Serves self.sources as {path: body} with
+    # an ETag derived from the body, answers If-None-Match with 304 and replies with
+    # the statuses queued in self.failures before serving a path normally
+    def __init__(self):
+        self.sources = {}
+        self.failures = []
+        self.requests = []
+        self.delay = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.get_handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+
+    def get_handler(self):
+        stand_in = self
+        class handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with stand_in.lock:
+                    stand_in.requests.append((self.path, dict(self.headers)))
+                    stand_in.active += 1
+                    stand_in.max_active = max(stand_in.max_active, stand_in.active)
+                    status = stand_in.failures.pop(0) if stand_in.failures else None
+                try:
+                    time.sleep(stand_in.delay)
+                    self.respond(status)
+                finally:
+                    with stand_in.lock:
+                        stand_in.active -= 1
+
+            def respond(self, status):
+                body = stand_in.sources.get(self.path)
+                if status is None and body is None:
+                    status = 404
+                if status is not None:
+                    self.send_response(status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        return handler
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+
+    def get_requests(self, path):
+        return [headers for requested, headers in self.requests if requested == path]
+
+@pytest.fixture
+def server():
+    stand_in = source_server()
+    stand_in.thread.start()
+    yield stand_in
+    stand_in.server.shutdown()
+    stand_in.server.server_close()
+
+@pytest.fixture
+def cache(tmp_path):
+    return main.source_cache(directory=str(tmp_path / "cache"), timeout=5, backoff=0)
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_fetch_stores_the_payload_by_content(server, cache):
+    server.sources["/mhdb.json"] = b'{"entries": {}}'
+    path = cache.fetch(server.url("/mhdb.json"))
+    assert read(path) == b'{"entries": {}}'
+    assert path == cache.get_object_path(hashlib.sha256(b'{"entries": {}}').hexdigest())
+    assert cache.load_index()[server.url("/mhdb.json")]["etag"] is not None
+
+def test_fresh_copy_is_not_requested_again(server, cache):
+    server.sources["/mhdb.json"] = b"first"
+    first = cache.fetch(server.url("/mhdb.json"))
+    server.sources["/mhdb.json"] = b"second"
+    assert cache.fetch(server.url("/mhdb.json")) == first
+    assert len(server.get_requests("/mhdb.json")) == 1
+
+def test_index_is_read_back_by_a_new_cache(server, cache):
+    server.sources["/mhdb.json"] = b"payload"
+    path = cache.fetch(server.url("/mhdb.json"))
+    reopened = main.source_cache(directory=cache.directory)
+    assert reopened.fetch(server.url("/mhdb.json")) == path
+    assert len(server.get_requests("/mhdb.json")) == 1
+
+def test_stale_copy_is_revalidated_with_its_etag(server, cache):
+    cache.ttl = 0
+    server.sources["/mhdb.json"] = b"payload"
+    first = cache.fetch(server.url("/mhdb.json"))
+    assert cache.fetch(server.url("/mhdb.json")) == first
+    revalidation = server.get_requests("/mhdb.json")[1]
+    assert revalidation["If-None-Match"] == cache.load_index()[server.url("/mhdb.json")]["etag"]
+
+def test_changed_source_is_downloaded_again(server, cache):
+    cache.ttl = 0
+    server.sources["/mhdb.json"] = b"first"
+    first = cache.fetch(server.url("/mhdb.json"))
+    server.sources["/mhdb.json"] = b"second"
+    second = cache.fetch(server.url("/mhdb.json"))
+    assert second != first and read(second) == b"second" and read(first) == b"first"
+
+def test_server_errors_are_retried(server, cache):
+    server.sources["/mhdb.json"] = b"payload"
+    server.failures = [503, 429]
+    assert read(cache.fetch(server.url("/mhdb.json"))) == b"payload"
+    assert len(server.get_requests("/mhdb.json")) == 3
+
+def test_client_errors_are_not_retried(server, cache):
+    with pytest.raises(requests.HTTPError):
+        cache.fetch(server.url("/missing.json"))
+    assert len(server.get_requests("/missing.json")) == 1
+
+def test_stale_copy_is_used_when_the_server_fails(server, cache):
+    cache.ttl = 0
+    cache.retries = 1
+    server.sources["/mhdb.json"] = b"payload"
+    path = cache.fetch(server.url("/mhdb.json"))
+    server.failures = [500, 500]
+    assert cache.fetch(server.url("/mhdb.json")) == path
+
+def test_remote_mode_always_downloads_and_never_falls_back(server, cache):
+    server.sources["/mhdb.json"] = b"payload"
+    cache.fetch(server.url("/mhdb.json"))
+    cache.fetch(server.url("/mhdb.json"), "remote")
+    assert len(server.get_requests("/mhdb.json")) == 2
+    assert "If-None-Match" not in server.get_requests("/mhdb.json")[1]
+    cache.retries = 0
+    server.failures = [500]
+    with pytest.raises(requests.HTTPError):
+        cache.fetch(server.url("/mhdb.json"), "remote")
+
+def test_unreachable_host_without_cached_copy_raises(cache):
+    cache.retries = 0
+    with pytest.raises(requests.ConnectionError):
+        cache.fetch("http://127.0.0.1:9/mhdb.json")
+
+def test_fetch_all_is_bounded_by_concurrency(server, cache):
+    cache.concurrency = 2
+    server.delay = 0.05
+    paths = [f"/source-{i}.json" for i in range(6)]
+    for path in paths:
+        server.sources[path] = path.encode()
+    fetched = cache.fetch_all([server.url(path) for path in paths])
+    assert all(read(fetched[server.url(path)]) == path.encode() for path in paths)
+    assert server.max_active == 2
+
+def test_fetch_all_raises_the_first_failure(server, cache):
+    cache.retries = 0
+    server.sources["/mhdb.json"] = b"payload"
+    with pytest.raises(requests.HTTPError):
+        cache.fetch_all([server.url("/mhdb.json"), server.url("/missing.json")])
+    assert cache.get_cached_path(server.url("/mhdb.json")) is not None
+
+def test_local_mode_reads_the_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    mhdb = main.market_hours_database.__new__(main.market_hours_database)
+    mhdb.source_mode = "local"
+    mhdb.sources = main.remote_sources
+    assert mhdb.resolve_source("mhdb") == "market-hours-database.json"
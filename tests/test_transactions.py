@@ -0,0 +1,93 @@
+import copy
+from datetime import datetime
+
+import pytest
+
+from workspace import load, read_json
+
+def get_key(mhdb):
+    return next(key for key, entry in mhdb.mhdb["entries"].items() if entry.get("holidays") and "[*]" not in key)
+
+def test_rollback_restores_the_entries(workspace):
+    mhdb = load()
+    original = copy.deepcopy(mhdb.mhdb["entries"])
+    mhdb.begin()
+    mhdb.apply_exchange_changes(read_json("changes.json"))
+    assert mhdb.mhdb["entries"] != original
+    mhdb.rollback()
+    assert mhdb.mhdb["entries"] == original
+    assert mhdb.transactions == []
+
+def test_rolled_back_entries_are_saved_as_loaded(workspace):
+    mhdb = load()
+    mhdb.begin()
+    mhdb.apply_exchange_changes(read_json("changes.json"))
+    mhdb.rollback()
+    mhdb.save()
+    with open("market-hours-database.json", "rb") as original, open("market-hours-database-updated.json", "rb") as saved:
+        assert saved.read() == original.read()
+
+def test_labels_are_copied_before_they_change(workspace):
+    mhdb = load()
+    key = get_key(mhdb)
+    holidays = mhdb.mhdb["entries"][key]["holidays"]
+    before = list(holidays)
+    mhdb.begin()
+    mhdb.add_date_to_list(key, "holidays", datetime(2040, 1, 2))
+    assert holidays == before
+    assert "1/2/2040" in mhdb.mhdb["entries"][key]["holidays"]
+    mhdb.commit()
+    assert "1/2/2040" in mhdb.mhdb["entries"][key]["holidays"]
+
+def test_rollback_of_a_batch(workspace):
+    mhdb = load()
+    original = copy.deepcopy(mhdb.mhdb["entries"])
+    changes = mhdb.read_changes_from_json("changes.json")
+    mhdb.begin()
+    mhdb.start_batch()
+    for cme_class in changes["cme"].keys():
+        mhdb.apply_cme_changes(cme_class, changes)
+    mhdb.apply_batch()
+    mhdb.rollback()
+    assert mhdb.mhdb["entries"] == original
+
+def test_nested_rollback_only_undoes_the_inner_transaction(workspace):
+    mhdb = load()
+    key = get_key(mhdb)
+    mhdb.begin()
+    mhdb.add_date_to_list(key, "holidays", datetime(2040, 1, 2))
+    mhdb.begin()
+    mhdb.add_date_to_list(key, "holidays", datetime(2040, 1, 3))
+    mhdb.remove_date_from_list(key, "holidays", datetime(2040, 1, 2))
+    mhdb.rollback()
+    holidays = mhdb.mhdb["entries"][key]["holidays"]
+    assert "1/2/2040" in holidays and "1/3/2040" not in holidays
+    mhdb.commit()
+    assert mhdb.transactions == []
+
+def test_nested_commit_is_undone_by_the_outer_rollback(workspace):
+    mhdb = load()
+    key = get_key(mhdb)
+    original = copy.deepcopy(mhdb.mhdb["entries"][key])
+    mhdb.begin()
+    mhdb.begin()
+    mhdb.add_date_to_list(key, "holidays", datetime(2040, 1, 2))
+    mhdb.add_date_to_list(key, "bankHolidays", datetime(2040, 1, 2))
+    mhdb.commit()
+    mhdb.add_date_to_list(key, "holidays", datetime(2040, 1, 3))
+    mhdb.rollback()
+    assert mhdb.mhdb["entries"][key] == original
+
+def test_transaction_block_rolls_back_when_it_raises(workspace):
+    mhdb = load()
+    key = get_key(mhdb)
+    original = copy.deepcopy(mhdb.mhdb["entries"][key])
+    with pytest.raises(KeyError):
+        with mhdb.transaction():
+            mhdb.add_date_to_list(key, "holidays", datetime(2040, 1, 2))
+            raise KeyError(key)
+    assert mhdb.mhdb["entries"][key] == original
+    with mhdb.transaction():
+        mhdb.add_date_to_list(key, "holidays", datetime(2040, 1, 2))
+    assert "1/2/2040" in mhdb.mhdb["entries"][key]["holidays"]
+    assert mhdb.transactions == []
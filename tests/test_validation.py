@@ -0,0 +1,26 @@
+from workspace import add_entries, get_entry, load, read_json
+
+def test_one_pass_finds_every_rule(workspace):
+    parent = {**get_entry("America/Chicago", ["1/1/2025"]), "earlyCloses": {}}
+    child = get_entry("America/Chicago", ["1/1/2025", "7/4/2025", "7/4/2025", "1/5/2025"])
+    child["bankHolidays"] = ["12/25/2025", "12/25/2025"]
+    add_entries({"Future-cfe-[*]": parent, "Future-cfe-VX": child})
+    mhdb = load()
+    findings = [finding for finding in mhdb.validate() if finding["entry"] == "Future-cfe-VX"]
+    assert [(finding["rule"], finding["label"], finding["dates"]) for finding in findings] == [
+        ("duplicate", "holidays", ["7/4/2025"]),
+        ("duplicate", "bankHolidays", ["12/25/2025"]),
+        ("holiday-overlap", "earlyCloses", ["1/5/2025"]),
+        ("parent-overlap", "holidays", ["1/1/2025"]),
+    ]
+    assert [finding["rule"] for finding in mhdb.validate(["duplicate"]) if finding["entry"] == "Future-cfe-VX"] == ["duplicate", "duplicate"]
+    # The holiday overlap is left for a human to decide
+    mhdb.validate(None, True)
+    assert [finding["rule"] for finding in mhdb.validate() if finding["entry"] == "Future-cfe-VX"] == ["holiday-overlap"]
+    assert mhdb.mhdb["entries"]["Future-cfe-VX"]["holidays"] == ["7/4/2025", "1/5/2025"]
+    assert mhdb.mhdb["entries"]["Future-cfe-VX"]["bankHolidays"] == ["12/25/2025"]
+
+def test_validation_in_processes_matches_serial(workspace):
+    mhdb = load()
+    mhdb.apply_exchange_changes(read_json("changes.json"))
+    assert mhdb.validate(workers=2) == mhdb.validate()
@@ -0,0 +1,78 @@
+import copy
+import json
+import logging
+
+import main
+from workspace import add_entries, load, read_json, rebuild, write_json
+
+def test_watcher_matches_full_rebuild(workspace):
+    mhdb = load()
+    watcher = main.mhdb_watcher(mhdb)
+    watcher.update()
+    assert mhdb.mhdb["entries"] == rebuild()
+    assert watcher.update() is None
+
+    changes = read_json("changes.json")
+    cme_class = list(changes["cme"].keys())[0]
+    changes["cme"][cme_class]["holidays"] = changes["cme"][cme_class]["holidays"][1:] + ["12/24/2040"]
+    changes["cme"][cme_class]["remove"]["holidays"] = []
+    write_json("changes.json", changes)
+    watcher.update()
+    assert mhdb.mhdb["entries"] == rebuild()
+    assert read_json("market-hours-database-updated.json")["entries"] == mhdb.mhdb["entries"]
+
+def test_watcher_fixes_children_of_changed_parents(workspace):
+    add_entries({"Forex-oanda-EURUSD": {"exchangeTimeZone": "America/New_York", "holidays": ["1/2/2031"]}})
+    mhdb = load()
+    watcher = main.mhdb_watcher(mhdb, fix=True)
+    watcher.update()
+    assert mhdb.mhdb["entries"] == rebuild(fix=True)
+    for holidays in [["1/2/2031"], []]:
+        changes = read_json("changes.json")
+        changes["oanda"]["holidays"] = holidays
+        write_json("changes.json", changes)
+        watcher.update()
+        assert mhdb.mhdb["entries"] == rebuild(fix=True)
+
+def test_partial_writes_are_retried(workspace, caplog):
+    mhdb = load()
+    watcher = main.mhdb_watcher(mhdb)
+    watcher.update()
+    applied = copy.deepcopy(mhdb.mhdb["entries"])
+    changes = read_json("changes.json")
+    cme_class = list(changes["cme"].keys())[0]
+    changes["cme"][cme_class]["holidays"].append("12/24/2040")
+    text = json.dumps(changes)
+    with open("changes.json", "w") as f:
+        f.write(text[:len(text) // 2])
+    with caplog.at_level(logging.ERROR, logger="mhdb"):
+        assert watcher.update() is None
+    assert "Could not apply changes.json" in caplog.text
+    assert mhdb.mhdb["entries"] == applied
+    with open("changes.json", "w") as f:
+        f.write(text)
+    assert watcher.update() is not None
+    assert mhdb.mhdb["entries"] == rebuild()
+
+def test_failed_updates_leave_the_database_as_it_was(workspace, caplog):
+    mhdb = load()
+    watcher = main.mhdb_watcher(mhdb)
+    watcher.update()
+    applied = copy.deepcopy(mhdb.mhdb["entries"])
+    changes = read_json("changes.json")
+    for cme_class in changes["cme"].keys():
+        changes["cme"][cme_class]["holidays"] = ["12/24/2040"]
+    changes["cme"][cme_class]["holidays"].append("13/45/2040")
+    write_json("changes.json", changes)
+    assert watcher.update() is None
+    assert mhdb.mhdb["entries"] == applied
+    assert len(mhdb.transactions) == 1
+    # Retried while the file stays the same
+    caplog.clear()
+    with caplog.at_level(logging.ERROR, logger="mhdb"):
+        assert watcher.update() is None
+    assert "month must be in 1..12" in caplog.text
+    del changes["cme"][cme_class]["holidays"][-1]
+    write_json("changes.json", changes)
+    watcher.update()
+    assert mhdb.mhdb["entries"] == rebuild()
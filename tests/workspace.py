@@ -0,0 +1,35 @@
+import json
+
+import benchmark
+import main
+
+# Helpers for the tests that run on the synthetic workspace the benchmarks use
+
+def generate(directory, scale=0.3, seed=1):
+    benchmark.generate_workspace(str(directory), scale, dict(benchmark.default_base), seed)
+
+def load(**kwargs):
+    return main.market_hours_database(source_mode="local", **kwargs)
+
+def read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+def add_entries(entries):
+    mhdb = read_json("market-hours-database.json")
+    mhdb["entries"].update(entries)
+    write_json("market-hours-database.json", mhdb)
+
+def get_entry(time_zone, holidays=()):
+    return {"exchangeTimeZone": time_zone, "holidays": list(holidays), "earlyCloses": {"1/5/2025": "12:00:00"}, "lateOpens": {}, "bankHolidays": []}
+
+def rebuild(fix=False):
+    mhdb = load()
+    mhdb.apply_exchange_changes(read_json("changes.json"))
+    if fix:
+        mhdb.validate(None, True)
+    return mhdb.mhdb["entries"]